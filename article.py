@@ -0,0 +1,223 @@
+import re
+from typing import List, Dict
+from authors import normalise_authors
+from journal_profile import JournalProfile
+from species_fuzzy import get_fuzzy_matcher, find_misspelled_species
+from stages import StageMonitor
+from transforms import surround_headers, contains_any
+from xml import xml
+
+# The attributes of the <article> tag checked for discrepancies with the issue
+DISCREPANCY_TYPES = ('volume', 'number', 'year')
+
+
+def remove_NA_authors(lines: List[str]) -> None:
+	"""
+	Removes NA from any of the <author> and <authors> tags if applicable.
+	Mutates the list of lines passed in.
+
+	:param lines: list of lines in an xml file
+	:returns: None
+	"""
+
+	# N.B.: <author> tag is always line 2.
+	if re.match(
+				r'\s*\<author seq=\"1\"\>((n\/?a)|none)\<\/author\>',
+				lines[1], re.IGNORECASE
+				) and re.match(r'\s*\<authors seq=\"1\"\>', lines[2]):
+		# Replace line 2 with empty tag if NA was supplied as author's name
+		lines[1] = "  <author seq=\"1\"></author>"
+
+		# Replace line 4 with empty last name tag
+		lines[3] = "    <lastname/>"
+
+
+def update_index(line: str, to_update: str, value: str) -> str:
+	"""
+	Replaces one component of an <index> tag.
+
+	:param line: the line containing the index tag
+	:param to_update: the component to replace: 'y' (year), 'v' (volume),
+					  'n' (number) or 'i' (article id)
+	:param value: the new value of the component
+	:returns: line with the component replaced
+	"""
+	spaces = 0
+	while(line[spaces] == ' '):
+		spaces += 1
+
+	tokens = line[spaces:].split(' ')
+
+	# Split the 3rd token in half
+	tokens[2] = tokens[2].split('N')
+
+	# All together, our index has been split like so:
+	#           <index>year  JOURNAL    Volume        Number            ID</index>
+	components = [tokens[0], tokens[1], tokens[2][0], 'N'+tokens[2][1], tokens[3]]
+
+	to_update = to_update.lower()
+	if to_update == 'y':   # Update year
+		components[0] = '<index>' + value
+	elif to_update == 'v': # Update volume
+		components[2] = 'V' + value
+	elif to_update == 'n': # Update number
+		components[3] = 'N' + value
+	elif to_update == 'i':
+		components[4] = value + '</index>'
+
+	line = ''
+	for i in range(len(components)):
+		line += components[i]
+		if i != 2 and i != 4:
+			line += ' '
+
+	return spaces * ' ' + line
+
+
+
+def fix_redundant_page_numbers(line: str) -> str:
+	"""
+	Replaces redunant page numbering (of the form pages="x-x") with
+	the simplified version (pages="x")
+	:param line: line containing pages attribute to fix
+	:returns: line with redundant page numbering removed
+	"""
+
+	pages = xml.get_attribute("pages", line)
+	if (re.match(r'(\d+)-\1$', pages)):
+		line = xml.set_attribute("pages", pages[:pages.index("-")], line)
+	return line
+
+
+def already_processed(filename: str, text: str) -> bool:
+	"""
+	Returns True if the file has already been preprocessed: its <article> tag
+	(always line 0 of a Bioline xml file) no longer has the id JJxxx.
+
+	:param filename: name of the xml file
+	:param text: contents of the xml file
+	"""
+	return not text.splitlines()[0].strip().startswith("<article id=\"" + filename[0:2] + "xxx\"")
+
+
+def article_info(text: str) -> Dict[str, str]:
+	"""
+	Returns the volume, number and year in a file's <article> tag.
+
+	:param text: contents of the xml file (lines separated by \\n)
+	:returns: dict of the discrepancy types to their values
+	"""
+	line = text.split('\n', 1)[0]
+	return {disc_type: xml.get_attribute(disc_type, line) for disc_type in DISCREPANCY_TYPES}
+
+
+def fix_metadata(lines: List[str], filename: str, profile: JournalProfile, year: str) -> List[str]:
+	"""
+	Fixes the page numbers, NA authors and titles, copyright, keywords and
+	index of an article.
+
+	:param lines: list of lines in an xml file
+	:param filename: name of the xml file
+	:param profile: the (compiled) profile of the file's journal
+	:param year: the year of the issue, for the copyright line
+	:returns: the fixed lines (lines itself is left as it is)
+	"""
+	lines = list(lines)
+
+	# Fix redundant page numbers if possible
+	lines[0] = fix_redundant_page_numbers(lines[0])
+
+	# Remove NA from authors if applicable
+	remove_NA_authors(lines)
+
+	# Loop through remaining lines and replace values as appropriate
+	for i in range(len(lines)):
+
+		# Replace NA titles if applicable
+		if lines[i].strip().startswith('<title') or lines[i].strip().startswith('<abstract') or lines[i].strip().startswith('<keyword'):
+			lines[i] = xml.remove_NA(lines[i])
+
+		# Replace copyright if applicable
+		if xml.get_tag(lines[i]) == 'copyright':
+			if (profile.copyright != "default"):
+				lines[i] = f"  <copyright>Copyright {year} - {profile.copyright}</copyright>"
+			else:
+				lines[i] = f'  <copyright>Copyright {year} - {lines[i][lines[i].find("<copyright>")+11:-12]} </copyright>'
+
+		# Remove superfluous commas from keywords if applicable
+		elif xml.get_tag(lines[i]) == 'keyword':
+			lines[i] = lines[i].replace(",;", ";")
+			if profile.split_keywords:
+				lines[i] = lines[i].replace(',', ';')
+
+		# Replace the id in the index tag with the appropriate value
+		elif xml.get_tag(lines[i]) == 'index':
+			lines[i] = update_index(lines[i], 'i', filename[0:-4])
+
+	return lines
+
+
+def process_article(filename: str, original: str, profile: JournalProfile, year: str,
+					monitor: StageMonitor, notes: List[str], species_index=None) -> str:
+	"""
+	Runs every stage of preprocessing a single (unprocessed) xml file, except
+	species linking, which is done for a whole issue at once (see
+	species_link.insert_species_links_batch). A stage that runs out of its
+	time budget is skipped, and noted for the proofer.
+
+	:param filename: name of the xml file (e.g. hn19001.xml)
+	:param original: contents of the xml file
+	:param profile: the (compiled) profile of the file's journal
+	:param year: the year of the issue, for the copyright line
+	:param monitor: measures each stage (begin_file must already be called)
+	:param notes: list that lines for the proofer to check are added to
+	:param species_index: the species index (needed if the journal suggests
+						  misspelled species)
+	:returns: the processed contents of the file
+	"""
+	# NB: LINE 0 IS ALWAYS THE <abstract> LINE IN A BIOLINE XML!
+	lines = original.splitlines()
+
+	# Replace id="JJxxx" with appropriate values
+	lines[0] = xml.set_attribute('id', filename[0:-4], lines[0])
+
+	# Fix page numbers, NA authors and titles, copyright, keywords and index
+	lines = monitor.attempt('metadata', fix_metadata, lines, filename, profile, year) or lines
+
+	# Swap author names and/or add missing <authors> tags if the journal
+	# requires it. Names that can't be handled are left for the proofer.
+	if profile.swap_names or profile.generate_authors:
+		before = list(lines)
+		author_notes = monitor.attempt('authors', normalise_authors, lines, profile.swap_names, profile.generate_authors)
+		if author_notes is None:
+			lines[:] = before
+		notes += author_notes or []
+		if lines != before:
+			monitor.changed('authors')
+
+	# Join list of lines on newline char
+	with monitor.measure('join'):
+		body = "\n".join(lines)
+	if body != original:
+		monitor.changed('metadata')
+
+	# Add linebreaks, italics, and bolds to common abstract sections
+	header_tags = profile.header_tags()
+	if header_tags is not None:
+		body = monitor.run('headers', surround_headers, body, *header_tags, profile.language_packs,
+						   prefilter=lambda text: contains_any(text, profile.header_literals))
+
+	# Perform common textual substitutions (and those of the journal's rule packs)
+	if profile.text_subs:
+		body = monitor.run('textsubs', profile.text_rules.apply, body, prefilter=profile.text_rules.prefilter)
+
+	# Note any near-misses of dictionary species for the proofer
+	if profile.fuzzy_species > 0:
+		matcher = get_fuzzy_matcher(species_index, profile.fuzzy_species)
+		for (written, suggestion) in monitor.attempt('fuzzy', find_misspelled_species, body, matcher) or []:
+			notes.append(f'Possible misspelled species: {written} (did you mean {suggestion}?)')
+
+	for stage in monitor.over_budget.get(filename, []):
+		notes.append(f'Stage \'{stage}\' skipped: ran out of its time budget')
+
+	return body
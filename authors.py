@@ -0,0 +1,149 @@
+import re
+from typing import List, Optional, Tuple
+
+# The author lines of a Bioline XML file, and the <authors> block that may
+# follow each one:
+#   <author seq="1">Doe, Jane</author>
+#   <authors seq="1">
+#     <lastname>Doe</lastname>
+#     <firstname>Jane</firstname>
+#   </authors>
+AUTHOR = re.compile(r'^\s*<author seq="(\d+)">(.*)</author>\s*$')
+AUTHORS_OPEN = re.compile(r'^\s*<authors seq="(\d+)">\s*$')
+AUTHORS_CLOSE = '</authors>'
+
+# Particles that begin a last name ('Santos, Maria da' is 'Maria da Santos')
+PARTICLE = re.compile(r'( de | da | el-)', re.IGNORECASE)
+
+
+def split_name(name: str) -> Optional[Tuple[str, str]]:
+	"""
+	Splits the name in an <author> tag into its last and first names, on the
+	comma. A name without a comma is all last name.
+
+	:param name: the text of an <author> tag
+	:returns: (last name, first name), or None if name has several commas
+	"""
+	parts = name.split(',')
+	if len(parts) > 2:
+		return None
+	if len(parts) == 1:
+		return (name.strip(), '')
+	return (parts[0].strip(), parts[1].strip())
+
+
+def swap_name(lastname: str, firstname: str) -> Tuple[str, str, int]:
+	"""
+	Swaps a name submitted first name first ('Mohamed, el-Gamdi'). The two
+	parts are joined back into one name, which is split again before its
+	last particle (de, da, el-) if it has one, or else before its last word.
+
+	>>> swap_name('Mohamed', 'el-Gamdi')
+	('Gamdi', 'Mohamed el-', 1)
+
+	:param lastname: the part of the name before the comma
+	:param firstname: the part of the name after the comma
+	:returns: (last name, first name, number of particles in the name)
+	"""
+	name = lastname + ' ' + firstname
+	particles = PARTICLE.findall(name)
+	if len(particles) > 0:
+		# Split after the last particle in the name
+		i = name.rfind(particles[-1]) + len(particles[-1])
+		return (name[i:].strip(), name[:i].strip(), len(particles))
+
+	# Take last token by default to be the last name, the rest is a first name
+	words = name.split(' ')
+	return (words[-1].strip(), ' '.join(words[:-1]).strip(), 0)
+
+
+def author_tag(indent: str, seq: str, lastname: str, firstname: str) -> str:
+	return f'{indent}<author seq="{seq}">{lastname}, {firstname}</author>'
+
+
+def authors_block(seq: str, lastname: str, firstname: str) -> List[str]:
+	"""
+	Returns the lines of the <authors> block for an author.
+	"""
+	firstname_tag = '<firstname/>' if firstname == '' else '<firstname>' + firstname + '</firstname>'
+	return [f'  <authors seq="{seq}">', f'    <lastname>{lastname}</lastname>', f'    {firstname_tag}', '  </authors>']
+
+
+def authors_block_end(lines: List[str], i: int, seq: str) -> Optional[int]:
+	"""
+	Returns the index just past the <authors> block for seq starting at
+	lines[i], or None if there isn't one there.
+	"""
+	if i >= len(lines):
+		return None
+	match = AUTHORS_OPEN.match(lines[i])
+	if match is None or match.group(1) != seq:
+		return None
+	for j in range(i + 1, len(lines)):
+		if AUTHORS_CLOSE in lines[j]:
+			return j + 1
+	return None
+
+
+def normalise_authors(lines: List[str], swap: bool, generate: bool) -> List[str]:
+	"""
+	Normalises the author lines of a file, as the swap_names and
+	generate_authors_tags Sublime plugins do for a selection: if swap, the
+	names of every <author> tag are swapped (see swap_name), and if generate,
+	an <authors> block is added after every <author> tag without one. When a
+	name is swapped, the <authors> block following it is rebuilt too.
+	Mutates the list of lines passed in.
+
+	Names that can't be handled with confidence are left as they are, and
+	returned as notes for the proofer.
+
+	:param lines: list of lines in an xml file
+	:param swap: whether to swap first and last names
+	:param generate: whether to generate missing <authors> blocks
+	:returns: list of notes about ambiguous names
+	"""
+	notes = []
+	i = 0
+	while i < len(lines):
+		match = AUTHOR.match(lines[i])
+		if match is None:
+			i += 1
+			continue
+
+		(seq, name) = match.groups()
+		block_end = authors_block_end(lines, i + 1, seq)
+		split = split_name(name)
+		if name.strip() == '':
+			# Empty (or NA) authors are left to remove_NA_authors
+			i += 1
+			continue
+		if split is None:
+			notes.append(f'Ambiguous author name (several commas): {name}')
+			i += 1
+			continue
+
+		(lastname, firstname) = split
+		changed = False
+		if swap:
+			if ',' not in name:
+				notes.append(f'Author name not swapped (no comma): {name}')
+			elif ' ' not in (lastname + ' ' + firstname).strip():
+				notes.append(f'Author name not swapped (single word): {name}')
+			else:
+				(lastname, firstname, particles) = swap_name(lastname, firstname)
+				if particles > 1:
+					notes.append(f'Ambiguous author name (several particles): {name} (swapped to {lastname}, {firstname})')
+				lines[i] = author_tag(lines[i][:len(lines[i]) - len(lines[i].lstrip())], seq, lastname, firstname)
+				changed = True
+
+		if generate and block_end is None:
+			if ',' not in name and not swap:
+				notes.append(f'Author name has no comma (all taken as last name): {name}')
+			lines[i + 1:i + 1] = authors_block(seq, lastname, firstname)
+			block_end = i + 1 + 4
+		elif changed and block_end is not None:
+			lines[i + 1:block_end] = authors_block(seq, lastname, firstname)
+			block_end = i + 1 + 4
+
+		i = block_end if block_end is not None else i + 1
+	return notes
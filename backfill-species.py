@@ -0,0 +1,171 @@
+import os
+import sys
+import getopt
+from typing import List, Set, Tuple
+from colours import colours
+from species_index import get_species_index
+from species_link import unlink_species, insert_species_links_batch
+from occurrence_index import INDEX_FILE, OccurrenceIndex, block_tokens, text_blocks, entry_name, name_tokens, changed_names
+
+USAGE = 'USAGE: python backfill-species.py (-p <PATH> | -f <FILE>) [-i <INDEX>] [-n <NAMES>] [-d] [--index-only]'
+
+
+def processed_files(path: str) -> List[Tuple[str, str]]:
+	"""
+	Returns the already processed xml files in the folder at path (those
+	relink.py would relink), by absolute path, and their contents.
+
+	:param path: path to a folder of xml files
+	:returns: list of (file path, contents)
+	"""
+	files = []
+	for filename in sorted(os.listdir(path)):
+		if not filename.endswith('.xml'):
+			continue
+		with open(path + filename) as f:
+			body = f.read()
+		if body.lstrip().startswith('<article id="' + filename[0:2] + 'xxx"'):
+			continue
+		if '<title' not in body or '<keyword' not in body:
+			continue
+		files.append((os.path.abspath(path + filename), body))
+	return files
+
+
+def read_names(path: str) -> Set[str]:
+	with open(path) as f:
+		return {' '.join(line.split()) for line in f.readlines() if line.strip() != ''}
+
+
+def backfill(occurrences: OccurrenceIndex, changes: List[Tuple[str, bool]], removed: Set[str], dry_run: bool) -> Tuple[int, int]:
+	"""
+	Relinks, in place, the blocks of the indexed files that mention any of the
+	changed species names. The other blocks of each file keep their links.
+
+	:param occurrences: the occurrence index
+	:param changes: the changed names, and whether their genus changed
+	:param removed: the changed names no longer in the dictionaries (whose
+					italics are dropped along with their links)
+	:param dry_run: if True, report what would change without writing
+	:returns: the number of files, and of blocks, that were (or would be)
+			  changed
+	"""
+	index = get_species_index()
+	tokens = {token for (name, genus_changed) in changes for token in name_tokens(name, genus_changed)}
+
+	# Only the affected blocks are unlinked; the rest are left untouched when
+	# the files are linked again together
+	files = []
+	already_linked = set()
+	for path in sorted(occurrences.files_with(tokens)):
+		with open(path) as f:
+			body = f.read()
+		pieces = []
+		position = 0
+		blocks = 0
+		for (start, end) in text_blocks(body):
+			block = body[start:end]
+			if tokens.isdisjoint(block_tokens(block)):
+				already_linked.add(block)
+				continue
+			pieces += [body[position:start], unlink_species(block, index, removed)]
+			position = end
+			blocks += 1
+		pieces.append(body[position:])
+		files.append((path, body, ''.join(pieces), blocks))
+
+	relinked_files = insert_species_links_batch([unlinked for (_, _, unlinked, _) in files], index, already_linked)
+
+	(changed, changed_blocks) = (0, 0)
+	for ((path, body, _, blocks), relinked) in zip(files, relinked_files):
+		if relinked == body:
+			continue
+		changed += 1
+		changed_blocks += blocks
+		print(('Would relink ' if dry_run else 'Relinking ') + f'{path} ({blocks} block(s))...')
+		if not dry_run:
+			with open(path, 'w') as f:
+				f.write(relinked)
+			occurrences.add(path, relinked)
+	return (changed, changed_blocks)
+
+
+# Relink only the processed files that mention species added to (or removed
+# from) the dictionaries since they were last linked, using a persistent
+# index of the words in every processed file's titles and abstracts
+if __name__ == '__main__':
+	paths = []
+	index_path = INDEX_FILE
+	names_path = None
+	dry_run = False
+	index_only = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'p:f:i:n:d', ['path=', 'file=', 'index=', 'names=', 'dry-run', 'index-only'])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-p', '--path'):
+			paths.append(arg)
+		if opt in ('-f', '--file'):
+			with open(arg) as f:
+				paths += [line.strip() for line in f.readlines() if line.strip() != '']
+		if opt in ('-i', '--index'):
+			index_path = arg
+		if opt in ('-n', '--names'):
+			names_path = arg
+		if opt in ('-d', '--dry-run'):
+			dry_run = True
+		if opt == '--index-only':
+			index_only = True
+
+	if len(paths) == 0:
+		print(USAGE)
+		exit(3)
+
+	occurrences = OccurrenceIndex(index_path)
+	forgotten = occurrences.remove_missing()
+
+	# Bring the index up to date (files are reindexed when their size or
+	# modification time changes)
+	indexed = 0
+	for path in paths:
+		path = path.replace('\\', '/')
+		if not path.endswith('/'):
+			path += '/'
+		for (file_path, body) in processed_files(path):
+			if not occurrences.is_current(file_path):
+				occurrences.add(file_path, body)
+				indexed += 1
+	(file_count, token_count) = occurrences.counts()
+	print(f'{colours.YELLOW}Indexed {indexed} file(s){colours.ENDC} ({forgotten} missing file(s) forgotten; '
+		  f'{file_count} file(s) and {token_count} token(s) in the index)')
+	if index_only:
+		exit(0)
+
+	current = {entry_name(entry) for entry in get_species_index().entries()}
+	linked = occurrences.linked_names()
+	changes = changed_names(current, linked) if len(linked) > 0 else []
+	if names_path is not None:
+		names = read_names(names_path)
+		genera = {name.lstrip('*').split(' ', 1)[0].lower() for name in current - names}
+		changes += [(name, name.lstrip('*').split(' ', 1)[0].lower() not in genera) for name in sorted(names)]
+
+	if len(linked) == 0 and names_path is None:
+		# Nothing to compare the dictionaries with yet
+		if not dry_run:
+			occurrences.set_linked_names(current)
+		print(f'{colours.GREEN}{"Would record" if dry_run else "Recorded"} the {len(current)} dictionary name(s) '
+			  f'the files are linked with{colours.ENDC}')
+		exit(0)
+
+	for (name, genus_changed) in changes:
+		print(f'{"Added" if name in current else "Removed"}: {name}' + (' (genus changed)' if genus_changed else ''))
+	removed = {name for (name, _) in changes if name not in current}
+	(changed, blocks) = backfill(occurrences, changes, removed, dry_run) if len(changes) > 0 else (0, 0)
+	if not dry_run:
+		occurrences.set_linked_names(current)
+	occurrences.close()
+
+	print(f'\n{colours.GREEN}{"Would relink" if dry_run else "Relinked"} {blocks} block(s) in {changed} file(s){colours.ENDC}')
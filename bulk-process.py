@@ -1,49 +1,388 @@
 import sys, getopt, os
+import time
+import json
+import ctypes
+import signal
+import sqlite3
+import tempfile
+import threading
+import traceback
 import subprocess
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from colours import colours
+from checkpoint import CheckpointJournal, DONE, FAILED
+from work_queue import WorkQueue, LEASE_SECONDS, PENDING, LEASED, worker_id
+from issue_context import preprocess_issue
+from metrics import BulkMetrics, DEFAULT_INTERVAL
+from stages import budget_arg, STAGE_BUDGET, FILE_BUDGET
+
+USAGE = ('USAGE: python bulk-process.py -f <FILE> [-r <REPORT>] [-m | -t <THREADS>] [-c <CHECKPOINT>] [--resume | --retry-failed]\n'
+		 '                              [-e <METRICS>] [-s] [--interval <SECONDS>] [--stage-budget <SECONDS>] [--file-budget <SECONDS>]\n'
+		 '       python bulk-process.py -q <QUEUE> [-f <FILE>] [-r <REPORT>] [-m] [-c <CHECKPOINT>] [--retry-failed | --status]\n'
+		 '                              [-e <METRICS>] [-s] [--interval <SECONDS>] [--stage-budget <SECONDS>] [--file-budget <SECONDS>]')
 
 second_last = lambda s, o: s[:s.rfind(o)].rfind(o)
 
 # Get command-line args
 PATH = None
+REPORT_PATH = None
+TRACE_MEMORY = False
+CHECKPOINT_PATH = None
+RESUME = False
+RETRY_FAILED = False
+QUEUE_PATH = None
+STATUS = False
+THREADS = None
+METRICS_PATH = None
+STATUS_LINE = False
+INTERVAL = DEFAULT_INTERVAL
+STAGE_SECONDS = STAGE_BUDGET
+FILE_SECONDS = FILE_BUDGET
 try:
-	opts, args = getopt.getopt(sys.argv[1:], 'f:', ['file='])
+	opts, args = getopt.getopt(sys.argv[1:], 'f:r:mc:q:t:e:s', ['file=', 'report=', 'memory', 'checkpoint=', 'resume', 'retry-failed',
+															'queue=', 'status', 'threads=', 'metrics=', 'status-line',
+															'interval=', 'stage-budget=', 'file-budget='])
 except getopt.GetoptError:
-	print('USAGE: python bulk-process.py -f <FILE>')
+	print(USAGE)
 	exit()
 
 for opt, arg in opts:
 	if opt in ('-f', '--file'):
 		PATH = arg.replace('\\', '/')
+	if opt in ('-r', '--report'):
+		REPORT_PATH = arg.replace('\\', '/')
+	if opt in ('-m', '--memory'):
+		TRACE_MEMORY = True
+	if opt in ('-c', '--checkpoint'):
+		CHECKPOINT_PATH = arg.replace('\\', '/')
+	if opt == '--resume':
+		RESUME = True
+	if opt == '--retry-failed':
+		RETRY_FAILED = True
+	if opt in ('-q', '--queue'):
+		QUEUE_PATH = arg.replace('\\', '/')
+	if opt == '--status':
+		STATUS = True
+	if opt in ('-t', '--threads'):
+		THREADS = int(arg)
+	if opt in ('-e', '--metrics'):
+		METRICS_PATH = arg.replace('\\', '/')
+	if opt in ('-s', '--status-line'):
+		STATUS_LINE = True
+	if opt == '--interval':
+		INTERVAL = float(arg)
+	if opt == '--stage-budget':
+		STAGE_SECONDS = budget_arg(arg)
+	if opt == '--file-budget':
+		FILE_SECONDS = budget_arg(arg)
+
+if PATH == None and QUEUE_PATH == None:
+	print(USAGE)
+	exit()
 
-if PATH == None:
-	print('USAGE: python bulk-process.py -f <FILE>')
+# Issues run on threads share one process, so memory can't be traced per
+# issue, and there is no queue worker to hold leases
+if THREADS is not None and (TRACE_MEMORY or QUEUE_PATH is not None):
+	print(USAGE)
 	exit()
 
 
+def issue_folder(path: str) -> str:
+	return path[second_last(path, '/')+1:path.rindex('/')]
+
+
+def read_issue_report(report_path: str, offset: int, path: str) -> tuple:
+	"""
+	Finds the run report of the issue at path among the reports appended to
+	the report file since offset (other workers may share the file).
+
+	:param report_path: the bulk run's report file
+	:param offset: size of the report file before the issue was preprocessed
+	:param path: path to the issue's xml folder
+	:returns: the issue's report metrics (None if it wrote no report), and the
+			  new size of the report file
+	"""
+	report = None
+	if not os.path.exists(report_path):
+		return (report, offset)
+	with open(report_path, 'r') as f:
+		f.seek(offset)
+		for line in f.readlines():
+			try:
+				metrics = json.loads(line)
+			except ValueError:
+				continue
+			if metrics.get('path', '').rstrip('/') == path.rstrip('/'):
+				report = metrics
+		return (report, f.tell())
+
+
+# prctl(2) option asking for a signal when the parent process dies (Linux)
+PR_SET_PDEATHSIG = 1
+
+
+def die_with_worker(worker_pid: int) -> None:
+	"""
+	Has the calling process (preprocess.py for a leased issue, just before it
+	starts) killed when the worker that started it dies, even if the worker
+	is killed outright (e.g. by the OOM killer), so that it can't go on
+	writing the issue once the lease has expired and another worker has
+	claimed it. Only on Linux.
+
+	:param worker_pid: the process id of the worker
+	"""
+	libc = ctypes.CDLL(None, use_errno=True)
+	libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+	# (the worker may have died before the signal was asked for)
+	if os.getppid() != worker_pid:
+		os._exit(1)
+
+
+def run_leased(queue: WorkQueue, path: str, worker: str, args: list) -> int:
+	"""
+	Preprocesses the issue at path while holding its lease, renewing the lease
+	every third of LEASE_SECONDS. If the lease can't be renewed in time, the
+	issue may be handed to another worker, so preprocessing is stopped.
+	Workers run unattended, so preprocess.py runs in batch mode (nothing is
+	asked; discrepancies are only reported). It is killed if the worker dies
+	(see die_with_worker).
+
+	:param queue: the work queue the issue was claimed from
+	:param path: path to the issue's xml folder
+	:param worker: this worker's id
+	:param args: extra command-line args for preprocess.py
+	:returns: the exit code of preprocess.py, or None if the lease was lost
+	"""
+	interval = LEASE_SECONDS / 3
+	deadline = time.time() + LEASE_SECONDS
+	worker_pid = os.getpid()
+	proc = subprocess.Popen([sys.executable, 'preprocess.py', '-p', path, '--batch'] + args, stdin=subprocess.DEVNULL,
+							preexec_fn=(lambda: die_with_worker(worker_pid)) if sys.platform.startswith('linux') else None)
+	try:
+		while True:
+			try:
+				return proc.wait(timeout=interval)
+			except subprocess.TimeoutExpired:
+				pass
+
+			try:
+				renewed = queue.heartbeat(path, worker)
+			except sqlite3.OperationalError:
+				# The database is busy; try again next interval while the lease lasts
+				renewed = None
+			if renewed:
+				deadline = time.time() + LEASE_SECONDS
+			elif renewed is False or time.time() > deadline - interval:
+				proc.kill()
+				proc.wait()
+				print(f'{colours.RED}Lost the lease on {path}; stopped preprocessing it{colours.ENDC}')
+				return None
+	except KeyboardInterrupt:
+		proc.kill()
+		proc.wait()
+		queue.release(path, worker)
+		raise
+
+
+_print_lock = threading.Lock()
+
+
+def run_in_thread(path: str, journal: CheckpointJournal, resume: bool, metrics: Optional[BulkMetrics]=None) -> int:
+	"""
+	Preprocesses the issue at path in this process (on the calling thread),
+	as preprocess.py would, except that nothing is asked of the user: a
+	journal without a .config file fails, and discrepancies are only
+	reported. Each line of output is prefixed with the issue's folder.
+
+	:param path: path to the issue's xml folder
+	:param journal: the bulk run's checkpoint journal
+	:param resume: whether to skip files the journal has completed
+	:param metrics: the bulk run's live metrics (if any)
+	:returns: the exit code preprocess.py would have had
+	"""
+	prefix = issue_folder(path)
+	reports = []
+
+	def out(message: str) -> None:
+		with _print_lock:
+			for line in message.split('\n'):
+				print(f'[{prefix}] {line}')
+
+	if not path.endswith('/'):
+		path += '/'
+	if metrics is not None:
+		metrics.issue_started()
+	try:
+		res = preprocess_issue(path, report_path=REPORT_PATH, journal=journal, resume=resume, stage_budget=STAGE_SECONDS,
+							   file_budget=FILE_SECONDS, on_report=reports.append, out=out)
+	except Exception:
+		# As preprocess.py would crash with a traceback
+		out(traceback.format_exc())
+		res = 1
+	if metrics is not None:
+		metrics.issue_finished(res, reports[0] if len(reports) > 0 else None)
+	return res
+
+# Completed issues (and files) are journaled so an interrupted run can be
+# resumed. A new run (neither --resume nor --retry-failed) starts a new journal.
+# Queued issues are tracked by the queue, and all of its workers share one
+# journal so an issue reclaimed from a dead worker carries on where it stopped.
+if CHECKPOINT_PATH is None:
+	CHECKPOINT_PATH = (PATH if QUEUE_PATH is None else QUEUE_PATH) + '.checkpoint'
+if QUEUE_PATH is None:
+	journal = CheckpointJournal(CHECKPOINT_PATH, fresh=not (RESUME or RETRY_FAILED))
+
+# Every issue appends its metrics to the same report file
+report_arg = f' -r "{REPORT_PATH}"' if REPORT_PATH is not None else ''
+if (METRICS_PATH is not None or STATUS_LINE) and not STATUS:
+	# The live metrics are read from each issue's report, so there must be one
+	if REPORT_PATH is None:
+		(fd, REPORT_PATH) = tempfile.mkstemp(suffix='.jsonl')
+		os.close(fd)
+		TEMPORARY_REPORT = True
+	else:
+		TEMPORARY_REPORT = False
+	report_arg = f' -r "{REPORT_PATH}"'
+	metrics = BulkMetrics(0, METRICS_PATH, STATUS_LINE, INTERVAL)
+else:
+	metrics = None
+report_offset = os.path.getsize(REPORT_PATH) if REPORT_PATH is not None and os.path.exists(REPORT_PATH) else 0
+if TRACE_MEMORY:
+	report_arg += ' -m'
+report_arg += f' -j "{CHECKPOINT_PATH}"'
+if RESUME or RETRY_FAILED:
+	report_arg += ' --resume'
+# (0 is no limit)
+budget_args = ['--stage-budget', str(STAGE_SECONDS or 0), '--file-budget', str(FILE_SECONDS or 0)]
+report_arg += ' ' + ' '.join(budget_args)
+
 # Read in the file containing a list of paths
-f = open(PATH, 'r')
-paths = f.readlines()
+paths = []
+if PATH is not None:
+	f = open(PATH, 'r')
+	paths = f.readlines()
 
 # Lists to hold names of (un)successfully preprocessed issues
 success = []
 failure = []
 
-# Preprocess the files at each listed path
+# Work through a shared queue alongside any other workers
+if QUEUE_PATH is not None:
+	queue = WorkQueue(QUEUE_PATH)
+	if len(paths) > 0:
+		print(f'Queued {queue.add(paths)} issues')
+	if RETRY_FAILED:
+		print(f'Requeued {queue.retry_failed()} failed issues')
+	if STATUS:
+		for (path, status, worker, attempts, code) in queue.issues():
+			print(f'{status:8} {path}' + (f' ({worker})' if worker else '') + (f' - ERR CODE {code}' if code else ''))
+		print(queue.counts())
+		exit()
+
+	args = ['-j', CHECKPOINT_PATH, '--resume']
+	if REPORT_PATH is not None:
+		args += ['-r', REPORT_PATH]
+	if TRACE_MEMORY:
+		args += ['-m']
+	args += budget_args
+
+	worker = worker_id()
+	if metrics is not None:
+		# Issues left are those no worker has finished yet
+		metrics.labels['worker'] = worker
+		counts = queue.counts()
+		metrics.set_remaining(counts[PENDING] + counts[LEASED])
+		metrics.start()
+	path = queue.claim(worker)
+	while path is not None:
+		print('--------------------------------')
+		print(f'{worker} preprocessing {path}')
+		if metrics is not None:
+			metrics.issue_started()
+		res = run_leased(queue, path, worker, args)
+		if res is None or not queue.complete(path, worker, res):
+			failure.append(issue_folder(path) + ' - LEASE LOST')
+		elif res == 0:
+			success.append(issue_folder(path))
+		else:
+			failure.append(issue_folder(path) + f' - ERR CODE {res}')
+		if metrics is not None:
+			(report, report_offset) = read_issue_report(REPORT_PATH, report_offset, path)
+			metrics.issue_finished(0 if res == 0 else 1, report)
+			counts = queue.counts()
+			metrics.set_remaining(counts[PENDING] + counts[LEASED])
+		path = queue.claim(worker)
+
+	# Every queued issue has been claimed, so there's no list to go through
+	paths = []
+
+# Work out which of the listed paths to preprocess
+to_process = []
 for path in paths:
 	path = path.strip().replace('\\', '/')
 	if not path == '':
-		print('--------------------------------')
-		try:
-			res = os.system(f'python preprocess.py -p {path}')
-			
-			# Check if our subprocess exited with a non-zero exit code (i.e. error)
-			if res != 0:
-				raise Exception
-			else:
-				success.append(path[second_last(path, '/')+1:path.rindex('/')])
-		except:
-			failure.append(path[second_last(path, '/')+1:path.rindex('/')] + f' - ERR CODE {res}')
+		status = journal.issue_status(path)
+
+		# Only rerun the issues that failed last time if asked to
+		if RETRY_FAILED and status != FAILED:
+			continue
+
+		# Don't redo issues a resumed run has already completed
+		if RESUME and status == DONE:
+			print(f'Already preprocessed {path} (checkpoint)')
+			success.append(issue_folder(path))
+			continue
+		to_process.append(path)
+
+if metrics is not None and QUEUE_PATH is None:
+	metrics.set_remaining(len(to_process))
+	metrics.start()
+
+# Preprocess several issues at once on threads, in this process
+if THREADS is not None:
+	codes = dict()
+	with ThreadPoolExecutor(THREADS) as pool:
+		futures = {pool.submit(run_in_thread, path, journal, RESUME or RETRY_FAILED, metrics): path for path in to_process}
+		# Each issue is recorded as soon as it finishes, so an interrupted run
+		# can be resumed without redoing it
+		for future in as_completed(futures):
+			path = futures[future]
+			codes[path] = future.result()
+			journal.record_issue(path, DONE if codes[path] == 0 else FAILED, codes[path])
+	for path in to_process:
+		res = codes[path]
+		if res == 0:
+			success.append(issue_folder(path))
+		else:
+			failure.append(issue_folder(path) + f' - ERR CODE {res}')
+	to_process = []
+
+# Preprocess the files at each listed path
+for path in to_process:
+	print('--------------------------------')
+	if metrics is not None:
+		metrics.issue_started()
+	try:
+		res = os.system(f'python preprocess.py -p "{path}"{report_arg}')
+		if metrics is not None:
+			(report, report_offset) = read_issue_report(REPORT_PATH, report_offset, path)
+			metrics.issue_finished(res, report)
+		journal.record_issue(path, DONE if res == 0 else FAILED, res)
+
+		# Check if our subprocess exited with a non-zero exit code (i.e. error)
+		if res != 0:
+			raise Exception
+		else:
+			success.append(issue_folder(path))
+	except:
+		failure.append(issue_folder(path) + f' - ERR CODE {res}')
+
+# Write the final metrics (so a finished run shows nothing remaining)
+if metrics is not None:
+	metrics.stop()
+	if TEMPORARY_REPORT:
+		os.remove(REPORT_PATH)
 
 # Print summary of preprocessing results to user
 print('\n\n--------------------------------\nSummary\n--------------------------------')
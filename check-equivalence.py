@@ -0,0 +1,161 @@
+import os
+import sys
+import getopt
+from colours import colours
+from report import RunReport
+from language_packs import get_language_packs
+from species_index import get_species_index
+from equivalence import build_targets, load_candidate, generated_inputs, compare, time_engine, first_difference
+
+USAGE = ('USAGE: python check-equivalence.py [-c <CORPUS>] [-n <ARTICLES>] [-s <SEED>] [-t <TARGET>] [-e <TARGET>=<MODULE>:<FUNCTION>]\n'
+		 '                                   [-l <LANGPACK>] [-m <REPRODUCERS>] [-o <FOLDER>] [-r <REPORT>]')
+
+LANG_FOLDER = './lang'
+
+
+def read_corpus(folder: str) -> list:
+	"""
+	Returns the contents of every xml file under folder (processed or not).
+
+	:param folder: the corpus folder
+	:returns: list of (path, contents) pairs
+	"""
+	corpus = []
+	for (root, _, filenames) in sorted(os.walk(folder)):
+		for filename in sorted(filenames):
+			if filename.endswith('.xml'):
+				path = os.path.join(root, filename)
+				with open(path) as f:
+					corpus.append((os.path.relpath(path, folder), f.read()))
+	return corpus
+
+
+def write_reproducer(folder: str, target: str, engine: str, number: int, reproducer: tuple) -> str:
+	"""
+	Writes a reproducer's input and both outputs to folder.
+
+	:returns: the path of the input file
+	"""
+	(_, text, expected, actual) = reproducer
+	stem = os.path.join(folder, f'{target}-{engine}-{number}')
+	for (suffix, contents) in (('.xml', text), ('.reference.xml', expected), ('.candidate.xml', actual)):
+		with open(stem + suffix, 'w') as f:
+			f.write(contents)
+	return stem + '.xml'
+
+
+# Check that every engine of species linking, text substitutions and header
+# formatting produces exactly the output of its reference implementation, over
+# generated and fuzzed articles plus any corpus of xml files, and report how
+# much faster each engine is. Run before each release; exits 1 if any engine
+# differs from its reference other than as documented.
+if __name__ == '__main__':
+	corpus_paths = []
+	count = 200
+	seed = 0
+	only = []
+	candidate_specs = []
+	pack_paths = [os.path.join(LANG_FOLDER, f) for f in sorted(os.listdir(LANG_FOLDER))] if os.path.isdir(LANG_FOLDER) else []
+	reproducers = 3
+	output = None
+	report_path = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'c:n:s:t:e:l:m:o:r:', ['corpus=', 'articles=', 'seed=', 'target=', 'engine=',
+																		'langpack=', 'reproducers=', 'output=', 'report='])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-c', '--corpus'):
+			corpus_paths.append(arg)
+		if opt in ('-n', '--articles'):
+			count = int(arg)
+		if opt in ('-s', '--seed'):
+			seed = int(arg)
+		if opt in ('-t', '--target'):
+			only.append(arg)
+		if opt in ('-e', '--engine'):
+			candidate_specs.append(arg)
+		if opt in ('-l', '--langpack'):
+			pack_paths.append(arg)
+		if opt in ('-m', '--reproducers'):
+			reproducers = int(arg)
+		if opt in ('-o', '--output'):
+			output = arg
+		if opt in ('-r', '--report'):
+			report_path = arg.replace('\\', '/')
+
+	try:
+		packs = get_language_packs(pack_paths)
+	except (OSError, ValueError) as ex:
+		print(f'{colours.RED}LANGUAGE PACK ERROR (ERR 004):{colours.ENDC} {str(ex)}')
+		exit(4)
+
+	try:
+		candidates = [load_candidate(spec) for spec in candidate_specs]
+		index = get_species_index()
+		targets = build_targets(index, packs, '.', candidates)
+	except (ImportError, AttributeError, ValueError) as ex:
+		print(f'{colours.RED}ENGINE ERROR:{colours.ENDC} {str(ex)}')
+		exit(1)
+
+	for target in only:
+		if target not in targets:
+			print(f'{colours.RED}Unknown target \'{target}\'{colours.ENDC} (one of {", ".join(targets)})')
+			exit(3)
+
+	inputs = generated_inputs(index, packs, count, seed)
+	for path in corpus_paths:
+		inputs += read_corpus(path)
+	print(f'{colours.YELLOW}Checking engines over {len(inputs)} article(s) '
+		  f'({count} generated with seed {seed}){colours.ENDC}')
+	if output is not None:
+		os.makedirs(output, exist_ok=True)
+
+	report = RunReport(report_path)
+	results = report.section('equivalence')
+	failed = False
+	for (target, (reference, engines)) in targets.items():
+		if len(only) > 0 and target not in only:
+			continue
+
+		(expected, reference_seconds) = time_engine(reference, inputs)
+		print(f'\n{colours.CYAN}{target}{colours.ENDC}: reference {reference_seconds * 1000:.1f} ms')
+		results[target] = {'reference_seconds': round(reference_seconds, 6), 'engines': dict()}
+		for engine in engines:
+			comparison = compare(reference, engine, inputs, expected, reproducers)
+			speedup = reference_seconds / comparison.seconds if comparison.seconds > 0 else float('inf')
+			results[target]['engines'][engine.name] = {'seconds': round(comparison.seconds, 6), 'speedup': round(speedup, 2),
+													   'differences': comparison.differences,
+													   'documented_differences': comparison.documented}
+			timing = f'{comparison.seconds * 1000:9.1f} ms {speedup:7.2f}x'
+			if len(comparison.differences) == 0 and len(comparison.documented) == 0:
+				print(f'  {engine.name:24} {timing}  {colours.GREEN}identical{colours.ENDC}')
+				continue
+			if len(comparison.differences) == 0:
+				print(f'  {engine.name:24} {timing}  {colours.YELLOW}{len(comparison.documented)} documented '
+					  f'difference(s){colours.ENDC} ({engine.documented.description})')
+				continue
+
+			failed = True
+			print(f'  {engine.name:24} {timing}  {colours.RED}differs on {len(comparison.differences)} '
+				  f'article(s){colours.ENDC}')
+			if len(comparison.documented) > 0:
+				print(f'  {"":24} {"":20}  {colours.YELLOW}{len(comparison.documented)} documented '
+					  f'difference(s){colours.ENDC} ({engine.documented.description})')
+			for (number, reproducer) in enumerate(comparison.reproducers):
+				(name, text, a, b) = reproducer
+				(position, around_a, around_b) = first_difference(a, b)
+				print(f'    {name}: minimal input ({len(text)} chars), first difference at {position}:')
+				print(f'      input:     {text!r}')
+				print(f'      reference: ...{around_a!r}...')
+				print(f'      {engine.name}: ...{around_b!r}...')
+				if output is not None:
+					print(f'      saved as {write_reproducer(output, target, engine.name, number, reproducer)}')
+
+	report.write()
+	if failed:
+		print(f'\n{colours.RED}Some engines differ from their reference implementations{colours.ENDC}')
+		exit(1)
+	print(f'\n{colours.GREEN}Every engine matches its reference implementation{colours.ENDC}')
@@ -0,0 +1,112 @@
+import os
+import json
+import threading
+from typing import Dict, Optional
+
+# Statuses of an issue in the journal
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CheckpointJournal:
+	"""
+	Append-only journal (one JSON object per line) of the issues and files a
+	bulk run has completed. Each completed file is recorded with a hash of its
+	output, so a resumed run can skip it without reading it again. Files are
+	stat'ed and hashed by their issue (a DirectoryIssue, see issue_io), as
+	stored: a compressed file by its .xml.gz.
+	"""
+
+	def __init__(self, path: str, fresh: bool=False) -> None:
+		"""
+		:param path: path to the journal file
+		:param fresh: if True, discard any existing journal at path
+		"""
+		self.path = path
+		self.issues = dict()
+		self.files = dict()
+		self._lock = threading.Lock()
+
+		if fresh:
+			open(path, 'w').close()
+		elif os.path.exists(path):
+			with open(path) as f:
+				for line in f.readlines():
+					try:
+						self._apply(json.loads(line))
+					except ValueError:
+						# A line cut short by an interrupted run
+						pass
+
+	@staticmethod
+	def issue_key(issue: str) -> str:
+		return issue.replace('\\', '/').rstrip('/')
+
+	def _apply(self, entry: Dict) -> None:
+		if entry['type'] == 'issue':
+			self.issues[entry['issue']] = entry
+		elif entry['type'] == 'file':
+			self.files[(entry['issue'], entry['file'])] = entry
+
+	def _append(self, entry: Dict) -> None:
+		# (issues preprocessed on threads may share one journal)
+		with self._lock:
+			self._apply(entry)
+			with open(self.path, 'a') as f:
+				f.write(json.dumps(entry) + '\n')
+
+	def record_issue(self, issue: str, status: str, code: int=0) -> None:
+		"""
+		Records that the issue at path issue finished with status (DONE or
+		FAILED).
+
+		:param issue: path to the issue's xml folder
+		:param status: DONE or FAILED
+		:param code: exit code of the run
+		"""
+		self._append({'type': 'issue', 'issue': self.issue_key(issue), 'status': status, 'code': code})
+
+	def issue_status(self, issue: str) -> Optional[str]:
+		"""
+		Returns the last recorded status of the issue at path issue, or None
+		if it hasn't finished.
+		"""
+		entry = self.issues.get(self.issue_key(issue))
+		return None if entry is None else entry['status']
+
+	def record_file(self, issue, filename: str, info: Optional[Dict]=None) -> None:
+		"""
+		Records that filename (in issue) has been written.
+
+		:param issue: the issue the file belongs to
+		:param filename: name of the completed file
+		:param info: extra details needed to resume without rereading the file
+		"""
+		stat = issue.stat(filename)
+		entry = {'type': 'file', 'issue': self.issue_key(issue.path), 'file': filename,
+				 'sha256': issue.sha256(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+		if info is not None:
+			entry['info'] = info
+		self._append(entry)
+
+	def completed_file(self, issue, filename: str) -> Optional[Dict]:
+		"""
+		Returns the journal entry of filename if it was completed and hasn't
+		changed since (by size and modification time, or failing those, by
+		hash). Returns None otherwise.
+
+		:param issue: the issue the file belongs to
+		:param filename: name of the file
+		:returns: the file's journal entry, or None
+		"""
+		entry = self.files.get((self.issue_key(issue.path), filename))
+		if entry is None:
+			return None
+
+		try:
+			stat = issue.stat(filename)
+		except FileNotFoundError:
+			return None
+		if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+			return entry
+		return entry if issue.sha256(filename) == entry['sha256'] else None
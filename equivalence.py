@@ -0,0 +1,557 @@
+import re
+import time
+import random
+import importlib
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Tuple
+from language_packs import LanguagePack
+from regions import find_regions
+from rule_profile import RuleProfile
+from species_index import SpeciesIndex, dictionary_sources
+from species_link import (insertSpeciesLinks, insert_species_links_batch, species_prefilter, get_species_link,
+						  get_species_block_spans)
+from transforms import (TXT_SUBSTITUTIONS, REG_SUBSTITUTIONS, EMPTY_TAG, SUB_COUNT, TEXT_SUB_REGIONS, HEADER_REGIONS,
+						common_text_subs, surround_headers, text_subs_prefilter, contains_any, header_guard)
+
+# Headers are formatted as for a journal with bold headers and one linebreak
+# before each (as in profile-rules.py)
+HEADER_TAGS = ('<br/><b>', '<b>', '</b>')
+
+# An implementation of one of the targets. run takes a list of texts and
+# returns the list of outputs, so engines that work on a whole issue at once
+# can be compared too. documented is None, or the engine's known differences
+# from the reference (which don't fail the check).
+Engine = namedtuple('Engine', ['name', 'run', 'documented'])
+
+# A known difference of an engine from the reference: what it is, and a
+# function telling whether it explains how the engine's output for an input
+# differs from the reference's, explains(input, reference output, output)
+Documented = namedtuple('Documented', ['description', 'explains'])
+
+# Result of comparing one engine with the reference over the inputs: the names
+# of the inputs with undocumented and documented differences
+Comparison = namedtuple('Comparison', ['engine', 'seconds', 'differences', 'documented', 'reproducers'])
+
+
+# REFERENCE IMPLEMENTATIONS #
+# The straightforward versions of the engines: every rule applied to the text
+# of its regions, with no guards, prefilters, indexes or batching. They are the
+# behaviour any faster engine must reproduce byte for byte, so they should
+# only change along with the behaviour itself.
+
+def reference_text_subs(text: str) -> str:
+	"""
+	Reference version of transforms.common_text_subs. The regions' text is
+	joined by NUL characters (which no rule matches), so each rule is
+	applied to all of it at once, as it was to the whole file.
+	"""
+	regions = [r for r in find_regions(text) if r[2] in TEXT_SUB_REGIONS]
+	joined = '\x00'.join(text[start:end] for (start, end, _, _) in regions)
+	for (old, new) in TXT_SUBSTITUTIONS:
+		joined = joined.replace(old, new)
+	for (pattern, repl, _) in REG_SUBSTITUTIONS:
+		joined = re.sub(pattern.pattern, repl, joined, SUB_COUNT)
+	joined = re.sub(EMPTY_TAG.pattern, '', joined, SUB_COUNT)
+
+	result = ''
+	position = 0
+	for ((start, end, _, _), block) in zip(regions, joined.split('\x00')):
+		result += text[position:start] + block
+		position = end
+	return result + text[position:]
+
+
+def reference_surround_headers(text: str, front: str, special_front: str, back: str,
+							   packs: Dict[str, LanguagePack]) -> str:
+	"""
+	Reference version of transforms.surround_headers.
+	"""
+	def apply_packs(text: str, packs: List[LanguagePack]) -> str:
+		for pack in packs:
+			for header in pack.headers():
+				if header.lower() not in [h.lower() for h in pack.intro_headers]:
+					text = text.replace(header, "\n" + front + header + back)
+				else:
+					text = text.replace(header, "\n" + special_front + header + back)
+			for key in pack.substitutions.keys():
+				text = text.replace(key, pack.substitutions[key])
+		return text
+
+	result = ''
+	position = 0
+	for (start, end, region, lang) in find_regions(text):
+		if region in HEADER_REGIONS:
+			result += text[position:start] + apply_packs(text[start:end], [packs[lang]] if lang in packs else list(packs.values()))
+			position = end
+	return result + text[position:]
+
+
+def reference_remove_blank_chars(text: str) -> str:
+	text = text.replace('\n', ' ')
+	while '  ' in text:
+		text = text.replace('  ', ' ')
+	return text
+
+
+def reference_species_links(text: str, species_list: List[str]) -> str:
+	"""
+	Reference version of species_link.insertSpeciesLinks: every species of
+	the dictionaries is searched for in every title/abstract block.
+
+	:param text: the text to insert species links in
+	:param species_list: the lines of the species dictionaries, in load order
+	:returns: text with species links inserted
+	"""
+	pre_title = text[:text.index("<title")]
+	main_body = text[text.index("<title"):text.rindex("<keyword")]
+	post_abstract = text[text.rindex("<keyword"):]
+
+	start_title_indices = [m.start() for m in re.finditer("<title", main_body)]
+	end_abstract_indices = [m.start() for m in re.finditer("</abstract>", main_body)]
+
+	for j in range(len(start_title_indices) - 1, -1, -1):
+		genus_to_species = dict()
+		body = main_body[start_title_indices[j]:end_abstract_indices[j]]
+
+		# Every full and short name of every species
+		for species in species_list:
+			if not re.search(r'.* .*', species):
+				continue
+
+			pseudospecies = False
+			if species[0] == '*':
+				species = species[1:]
+				pseudospecies = True
+
+			parts = species.split(' ')
+			genus = ('*' if pseudospecies else '') + parts[0]
+			genus_to_species.setdefault(genus, [])
+			if parts[1] not in genus_to_species[genus]:
+				genus_to_species[genus].append(parts[1])
+
+			matches = [m.span() for m in re.finditer(re.escape(parts[0]) + r' *\n? *' + re.escape(parts[1]), body, re.IGNORECASE)]
+			for i in range(len(matches) - 1, -1, -1):
+				spec = reference_remove_blank_chars(body[matches[i][0]:matches[i][1]])
+				if i == 0 and not pseudospecies:
+					body = body[:matches[i][0]] + get_species_link(spec) + body[matches[i][1]:]
+				else:
+					body = body[:matches[i][0]] + f'<i>{spec}</i>' + body[matches[i][1]:]
+
+			short_parts = f'''{parts[0][0]}. {' '.join(parts[1:])}'''.split(' ')
+			if len(short_parts) > 1:
+				short_matches = [m.span() for m in re.finditer(re.escape(short_parts[0]) + r' *\n? *' + re.escape(' '.join(parts[1:])), body, re.IGNORECASE)]
+				for i in range(len(short_matches) - 1, -1, -1):
+					spec = reference_remove_blank_chars(body[short_matches[i][0]:short_matches[i][1]])
+					body = body[:short_matches[i][0]] + f'<i>{spec}</i>' + body[short_matches[i][1]:]
+
+		# Link a genus on its own before its species' first link, and
+		# italicise it everywhere else
+		for genus in genus_to_species.keys():
+			if genus[0] != '*':
+				master_reg = (r'<taxon genus="' + re.escape(genus) + r'" species="('
+							  + '|'.join(re.escape(s) for s in genus_to_species[genus]) + ')"')
+				matches = [m.span() for m in re.finditer(master_reg, body, re.IGNORECASE)]
+				if len(matches) > 0:
+					first_genus = re.search(re.escape(genus), body[:matches[0][0]], re.IGNORECASE)
+					if first_genus is not None and first_genus.end() < matches[0][0]:
+						body = body[:first_genus.start()] + get_species_link(body[first_genus.start():first_genus.end()]) + body[first_genus.end():]
+
+			matches = [m.span() for m in re.finditer(r' ' + re.escape(genus.replace('*', '')) + r'[ \n\.,\?\!]', body, re.IGNORECASE)]
+			for i in range(len(matches) - 1, -1, -1):
+				body = body[:matches[i][0]] + ' <i>' + body[matches[i][0] + 1:matches[i][1] - 1] + "</i>" + body[matches[i][1] - 1] + body[matches[i][1]:]
+
+		main_body = main_body[:start_title_indices[j]] + body + main_body[end_abstract_indices[j]:]
+
+	return pre_title + main_body + post_abstract
+
+
+def read_species_list(root: str='.') -> List[str]:
+	"""
+	Returns the lines of every species dictionary, in load order.
+	"""
+	species_list = []
+	for source in dictionary_sources(root):
+		with open(source) as f:
+			species_list += [line.strip() for line in f.read().splitlines()]
+	return species_list
+
+
+def run_together_names(species_list: List[str]) -> Callable[[str, str, str], bool]:
+	"""
+	Returns a function telling whether two outputs for a text only differ in
+	the title/abstract blocks of the text that contain a name of one of the
+	species in species_list that isn't written as separate words: a full
+	name with nothing between genus and epithet ('Ilexparaguariensis'), or a
+	full or short name joined to the words around it ('SIlex paraguariensis',
+	'I. paraguariensis-like'). The reference links or italicises these,
+	while the indexed engines only find names made of whole words, which
+	changes which later mention of the species in the block is linked. Any
+	difference outside those blocks isn't explained.
+	"""
+	names = []
+	for species in species_list:
+		if ' ' not in species:
+			continue
+		parts = species.lstrip('*').split(' ')
+		names.append((re.compile(re.escape(parts[0]) + r'( *\n? *)' + re.escape(parts[1]), re.IGNORECASE), True))
+		names.append((re.compile(re.escape(parts[0][0] + '.') + r'( *\n? *)' + re.escape(' '.join(parts[1:])), re.IGNORECASE), False))
+
+	def joined(text: str, i: int) -> bool:
+		return 0 <= i < len(text) and (text[i].isalnum() or text[i] in '_-')
+
+	def run_together(block: str) -> bool:
+		for (pattern, full) in names:
+			for match in pattern.finditer(block):
+				if joined(block, match.start() - 1) or joined(block, match.end()) or (full and match.group(1) == ''):
+					return True
+		return False
+
+	def explains(text: str, expected: str, actual: str) -> bool:
+		if isinstance(expected, Failure) or isinstance(actual, Failure):
+			return False
+		(regions, expected_regions, actual_regions) = (find_regions(t) for t in (text, expected, actual))
+		if not len(regions) == len(expected_regions) == len(actual_regions):
+			return False
+
+		# The regions (titles and abstracts) in a block with a run-together
+		# name (blocks overlap when the titles come before the abstracts)
+		offset = text.index('<title')
+		excused = set()
+		for (start, end) in get_species_block_spans(text[offset:text.rindex('<keyword')]):
+			if run_together(text[offset + start:offset + end]):
+				excused.update(i for (i, region) in enumerate(regions) if offset + start <= region[0] < offset + end)
+
+		# Everything else, in and around the regions, must be the same
+		(expected_position, actual_position) = (0, 0)
+		for (i, (a, b)) in enumerate(zip(expected_regions, actual_regions)):
+			if expected[expected_position:a[0]] != actual[actual_position:b[0]]:
+				return False
+			if i not in excused and expected[a[0]:a[1]] != actual[b[0]:b[1]]:
+				return False
+			(expected_position, actual_position) = (a[1], b[1])
+		return expected[expected_position:] == actual[actual_position:]
+	return explains
+
+
+# TARGETS #
+
+def each(function: Callable[[str], str]) -> Callable[[List[str]], List[str]]:
+	return lambda texts: [function(text) for text in texts]
+
+
+def load_candidate(spec: str) -> Tuple[str, Callable]:
+	"""
+	Imports a candidate engine given as target=module:function. The function
+	must take the same arguments as the target's current engine (see
+	build_targets). If it has a documented_differences attribute (a
+	description, or a Documented), its differences from the reference (all of
+	them, or those the Documented explains) are reported but don't fail the
+	check.
+
+	:param spec: the candidate, e.g. textsubs=fast_subs:common_text_subs
+	:returns: (target, function)
+	"""
+	try:
+		(target, name) = spec.split('=', 1)
+		(module, function) = name.split(':', 1)
+	except ValueError:
+		raise ValueError(f'Candidate \'{spec}\' should be given as <target>=<module>:<function>')
+	return (target, getattr(importlib.import_module(module), function))
+
+
+def build_targets(index: SpeciesIndex, packs: Dict[str, LanguagePack], root: str='.',
+				  candidates: Optional[List[Tuple[str, Callable]]]=None) -> Dict[str, Tuple[Engine, List[Engine]]]:
+	"""
+	Returns the reference engine and the candidate engines of each target:
+	  species   insertSpeciesLinks(text, index)
+	  textsubs  common_text_subs(text)
+	  headers   surround_headers(text, front, special_front, back, packs)
+	Extra candidates take the same arguments as the target's function.
+
+	:param index: the species index to link with
+	:param packs: the language packs to format headers with
+	:param root: the folder containing the species dictionaries
+	:param candidates: extra (target, function) candidates (see load_candidate)
+	:returns: dict of target names to (reference, candidates)
+	"""
+	species_list = read_species_list(root)
+	header_literals = header_guard(packs)
+	whole_words = Documented('names are only found when written as separate words', run_together_names(species_list))
+
+	targets = {
+		'species': (
+			Engine('reference', each(lambda t: reference_species_links(t, species_list)), None), [
+				Engine('insertSpeciesLinks', each(lambda t: insertSpeciesLinks(t, index)), whole_words),
+				Engine('batch', lambda texts: insert_species_links_batch(texts, index), whole_words),
+				Engine('prefiltered', each(lambda t: insertSpeciesLinks(t, index) if species_prefilter(t, index) else t), whole_words),
+			]),
+		'textsubs': (
+			Engine('reference', each(reference_text_subs), None), [
+				Engine('common_text_subs', each(common_text_subs), None),
+				Engine('prefiltered', each(lambda t: common_text_subs(t) if text_subs_prefilter(t) else t), None),
+				Engine('profiled', each(lambda t: common_text_subs(t, RuleProfile())), None),
+			]),
+		'headers': (
+			Engine('reference', each(lambda t: reference_surround_headers(t, *HEADER_TAGS, packs)), None), [
+				Engine('surround_headers', each(lambda t: surround_headers(t, *HEADER_TAGS, packs)), None),
+				Engine('prefiltered', each(lambda t: surround_headers(t, *HEADER_TAGS, packs)
+										   if contains_any(t, header_literals) else t), None),
+				Engine('profiled', each(lambda t: surround_headers(t, *HEADER_TAGS, packs, RuleProfile())), None),
+			]),
+	}
+
+	arguments = {'species': lambda f: lambda t: f(t, index),
+				 'textsubs': lambda f: f,
+				 'headers': lambda f: lambda t: f(t, *HEADER_TAGS, packs)}
+	for (target, function) in candidates or []:
+		if target not in targets:
+			raise ValueError(f'Unknown target \'{target}\' (one of {", ".join(targets)})')
+		documented = getattr(function, 'documented_differences', None)
+		if isinstance(documented, str):
+			documented = Documented(documented, lambda text, expected, actual: True)
+		targets[target][1].append(Engine(f'{function.__module__}.{function.__name__}', each(arguments[target](function)),
+										 documented))
+	return targets
+
+
+# INPUTS #
+
+FILLER = ('the of and in was were study plant extract samples effect activity analysis with from for by on '
+		  'water treated levels leaves seeds growth').split()
+FORMULAE = ('H2O2', 'H2O', 'H20', 'H2SO4', 'NH4+', 'SO42-', 'CO2', 'LD50', 'IC50', '5 x 10-3', '2 &#215; 10-4',
+			'10 mg ml-1', '3 g L-1', 'kg ha-1', '3/cm2', '4/m3', '&lt;i&gt;x&lt;/i&gt;', '&lt;sup&gt;2&lt;/sup&gt;',
+			'&lt;!--', '--&gt;', "\\'", 'hyphen-\n ation', '<i></i>')
+LANGS = ('en', 'es', 'fr', 'pt', 'de')
+
+
+def species_names(entry) -> List[str]:
+	"""
+	Returns the ways a dictionary species may be written in an abstract.
+	"""
+	(genus, species) = (entry.genus, entry.species)
+	return [f'{genus} {species}', f'{genus[0]}. {species}', genus, f'{genus.lower()} {species}',
+			f'{genus}\n{species}', f'{genus}   {species}', f'{genus[0]}.{species}', f'{genus.upper()} {species.upper()}',
+			f'{genus} sp.', f'{genus} spp.', f'({genus})', f'{genus},']
+
+
+def vocabulary(index: SpeciesIndex, packs: Dict[str, LanguagePack], size: int=200, rng: Optional[random.Random]=None) -> List[str]:
+	"""
+	Returns the words articles are generated from: filler, chemical formulae
+	and units, headers and substitutions of every language pack, and the
+	names (in every written form) of size species from the index.
+	"""
+	rng = rng or random.Random(0)
+	entries = index.entries()
+	words = list(FILLER) + list(FORMULAE)
+	for pack in packs.values():
+		words += pack.headers() + list(pack.substitutions.keys())
+	for entry in rng.sample(entries, min(size, len(entries))):
+		words += species_names(entry)
+	return words
+
+
+def generate_article(rng: random.Random, words: List[str], code: str='hn') -> str:
+	"""
+	Returns a random (unprocessed) Bioline article: a title and an abstract
+	for one or more languages, then their keywords. The title and abstract
+	of each language come in turn, or every title comes before the abstracts
+	(whose title/abstract blocks overlap).
+	"""
+	def sentence() -> str:
+		return ' '.join(rng.choice(words) if rng.random() < 0.4 else rng.choice(FILLER)
+						for _ in range(rng.randint(4, 24))) + '.'
+
+	langs = ['en'] + rng.sample(LANGS[1:], rng.randint(0, 2))
+	lines = [f'<article id="{code}xxx" lang="en" content="pdf" volume="1" number="1" month="1" year="2019" pages="1-1" '
+			 'version="xml" accepted-date="" bioline-date="20190510" type="AA">',
+			 '  <author seq="1">Doe, Jane</author>', '  <authors seq="1">', '    <lastname>Doe</lastname>',
+			 '    <firstname>Jane</firstname>', '  </authors>']
+	titles = [f'  <title lang="{lang}">{sentence()}</title>' for lang in langs]
+	abstracts = [f'  <abstract lang="{lang}">' + '\n'.join(sentence() for _ in range(rng.randint(1, 6))) + '</abstract>'
+				 for lang in langs]
+	if rng.random() < 0.3:
+		lines += titles + abstracts
+	else:
+		for (title, abstract) in zip(titles, abstracts):
+			lines += [title, abstract]
+	for lang in langs:
+		lines.append(f'  <keyword lang="{lang}">{"; ".join(rng.sample(words, 3))}</keyword>')
+	lines += ['  <index>2019 JOURNAL V1N1 hnxxx</index>', '  <copyright>Someone</copyright>', '</article>']
+	return '\n'.join(lines)
+
+
+ABSTRACT_TEXT = re.compile(r'<(title|abstract)[^>]*>(.*?)</\1>', re.DOTALL)
+
+
+def fuzz_article(rng: random.Random, text: str, words: List[str], mutations: int=8) -> str:
+	"""
+	Returns text with random mutations made inside its titles and abstracts
+	(so the article keeps the structure every engine needs): words inserted,
+	spans deleted, duplicated or case-swapped, and whitespace added.
+	"""
+	for _ in range(mutations):
+		spans = [m.span(2) for m in ABSTRACT_TEXT.finditer(text)]
+		if len(spans) == 0:
+			break
+		(start, end) = rng.choice(spans)
+		i = rng.randint(start, end)
+		j = min(end, i + rng.randint(1, 40))
+		mutation = rng.randrange(6)
+		if mutation == 0:
+			text = text[:i] + rng.choice(words) + text[i:]
+		elif mutation == 1:
+			text = text[:i] + ' ' + rng.choice(words) + ' ' + text[i:]
+		elif mutation == 2:
+			text = text[:i] + text[j:]
+		elif mutation == 3:
+			text = text[:j] + text[i:j] + text[j:]
+		elif mutation == 4:
+			text = text[:i] + text[i:j].swapcase() + text[j:]
+		else:
+			text = text[:i] + rng.choice(('\n', '  ', ' \n ', '-\n', '.')) + text[i:]
+	return text
+
+
+def generated_inputs(index: SpeciesIndex, packs: Dict[str, LanguagePack], count: int, seed: int=0) -> List[Tuple[str, str]]:
+	"""
+	Returns count generated articles, half of them fuzzed.
+
+	:returns: list of (name, text) pairs
+	"""
+	rng = random.Random(seed)
+	words = vocabulary(index, packs, rng=rng)
+	inputs = []
+	for i in range(count):
+		text = generate_article(rng, words)
+		if i % 2 == 1:
+			text = fuzz_article(rng, text, words)
+			inputs.append((f'fuzzed-{seed}-{i}', text))
+		else:
+			inputs.append((f'generated-{seed}-{i}', text))
+	return inputs
+
+
+# COMPARISON #
+
+class Failure(str):
+	"""
+	The outcome of an engine that raised an exception (the exception's type),
+	in place of its output.
+	"""
+
+
+def outcome(engine: Engine, texts: List[str]) -> List[str]:
+	"""
+	Returns the outputs of engine for texts, with an exception in place of
+	the output of any text it fails on.
+	"""
+	try:
+		return engine.run(texts)
+	except Exception:
+		results = []
+		for text in texts:
+			try:
+				results.append(engine.run([text])[0])
+			except Exception as ex:
+				results.append(Failure(type(ex).__name__))
+		return results
+
+
+def minimise(text: str, differs: Callable[[str], bool]) -> str:
+	"""
+	Shrinks text while differs(text) still holds: lines, then words, are
+	removed in ever smaller chunks, keeping every removal that preserves the
+	difference.
+
+	:param text: the input that shows a difference
+	:param differs: whether the engines differ on an input
+	:returns: the smallest input found that shows the difference
+	"""
+	for split in (lambda t: t.splitlines(keepends=True), lambda t: re.findall(r'\s+|\S+', t)):
+		units = split(text)
+		chunk = max(1, len(units) // 2)
+		while True:
+			i = 0
+			while i < len(units):
+				trial = units[:i] + units[i + chunk:]
+				if differs(''.join(trial)):
+					units = trial
+				else:
+					i += chunk
+			if chunk == 1:
+				break
+			chunk //= 2
+		text = ''.join(units)
+	return text
+
+
+def first_difference(a: str, b: str, context: int=40) -> Tuple[int, str, str]:
+	"""
+	Returns the position where a and b first differ, and the text of each
+	around it.
+	"""
+	i = 0
+	while i < min(len(a), len(b)) and a[i] == b[i]:
+		i += 1
+	start = max(0, i - context)
+	return (i, a[start:i + context], b[start:i + context])
+
+
+def compare(reference: Engine, engine: Engine, inputs: List[Tuple[str, str]],
+			expected: List[str], reproducers: int=3) -> Comparison:
+	"""
+	Runs engine over inputs and compares its outputs with the reference's.
+
+	:param reference: the reference engine
+	:param engine: the engine to check
+	:param inputs: (name, text) pairs
+	:param expected: the reference's outputs for inputs
+	:param reproducers: how many differences to minimise
+	:returns: the time the engine took, the names of the inputs it differs
+			  on (other than as documented, and as documented), and minimal
+			  reproducers of the first few undocumented differences as
+			  (name, input, reference output, engine output)
+	"""
+	texts = [text for (_, text) in inputs]
+	start = time.perf_counter()
+	outputs = outcome(engine, texts)
+	seconds = time.perf_counter() - start
+
+	def documented(text: str, expected: str, actual: str) -> bool:
+		return engine.documented is not None and engine.documented.explains(text, expected, actual)
+
+	differences = []
+	explained = []
+	for ((name, text), a, b) in zip(inputs, expected, outputs):
+		if a != b:
+			(explained if documented(text, a, b) else differences).append(name)
+
+	found = []
+	references = dict()
+	for ((name, text), a, b) in zip(inputs, expected, outputs):
+		if name not in differences or len(found) >= reproducers:
+			continue
+
+		def differs(trial: str) -> bool:
+			# Only inputs the reference can process count, as removing lines
+			# may break the structure of the article
+			if trial not in references:
+				references[trial] = outcome(reference, [trial])[0]
+			ref = references[trial]
+			if isinstance(ref, Failure):
+				return False
+			output = outcome(engine, [trial])[0]
+			return output != ref and not documented(trial, ref, output)
+
+		small = minimise(text, differs) if not isinstance(a, Failure) else text
+		found.append((name, small, outcome(reference, [small])[0], outcome(engine, [small])[0]))
+	return Comparison(engine, seconds, differences, explained, found)
+
+
+def time_engine(engine: Engine, inputs: List[Tuple[str, str]]) -> Tuple[List[str], float]:
+	"""
+	Returns the outputs of engine for inputs and the seconds it took.
+	"""
+	start = time.perf_counter()
+	outputs = outcome(engine, [text for (_, text) in inputs])
+	return (outputs, time.perf_counter() - start)
@@ -0,0 +1,258 @@
+import os
+import sys
+import math
+import time
+import random
+import getopt
+from typing import Callable, Dict, List, Optional, Tuple
+from colours import colours
+from report import RunReport
+from xml import xml
+from article import remove_NA_authors
+from authors import normalise_authors
+from language_packs import get_language_packs
+from species_index import get_species_index
+from species_link import find_species_links, remove_species_link, unlink_species, insertSpeciesLinks, species_prefilter
+from species_fuzzy import get_fuzzy_matcher, find_misspelled_species
+from transforms import surround_headers, compile_text_rules
+from equivalence import HEADER_TAGS, species_names
+from stages import StageTimeout, time_limit
+
+USAGE = ('USAGE: python fuzz-patterns.py [-t <TARGET>] [-n <LENGTH>] [-s <SEED>] [-b <SECONDS>] [-l <LANGPACK>] [-u <RULES>]\n'
+		 '                               [-o <FOLDER>] [-r <REPORT>]')
+
+LANG_FOLDER = './lang'
+
+# Inputs start at about START_LENGTH characters and double up to the maximum
+# length. A stage is flagged if its time grows faster than n^MAX_EXPONENT over
+# the last doubling and it takes at least FLAG_SECONDS on the longest input.
+START_LENGTH = 1000
+MAX_LENGTH = 32000
+MAX_EXPONENT = 1.5
+FLAG_SECONDS = 0.02
+BUDGET = 2
+
+# Characters XML patterns care about, for the random pumps
+PUNCTUATION = '<>="/ \n\t-.,;:()aA1'
+
+# Lines around the text of an article-wrapped input
+ARTICLE = ('<article id="hnxxx" lang="en" content="pdf" volume="1" number="1" month="1" year="2019" pages="1-1" '
+		   'version="xml" accepted-date="" bioline-date="20190510" type="AA">\n'
+		   '  <author seq="1">{text}</author>\n  <authors seq="1">\n    <lastname>{text}</lastname>\n'
+		   '    <firstname>Jane</firstname>\n  </authors>\n  <title lang="en">{text}</title>\n'
+		   '  <abstract lang="en">{text}</abstract>\n  <keyword lang="en">{text}</keyword>\n'
+		   '  <index>2019 JOURNAL V1N1 hnxxx</index>\n  <copyright>Someone</copyright>\n</article>')
+
+
+def families(rng: random.Random, index, packs) -> Dict[str, Tuple[str, str, str]]:
+	"""
+	Returns the families of adversarial inputs: each is a prefix, a pump
+	repeated to make the input longer, and a suffix. They aim at the places a
+	regex may backtrack: unterminated attributes and tags, runs of the
+	characters a pattern repeats, and near-misses of what it looks for.
+
+	:param rng: random number generator
+	:param index: the species index (for species names)
+	:param packs: the language packs (for headers)
+	:returns: dict of family names to (prefix, pump, suffix)
+	"""
+	entry = rng.choice(index.entries())
+	(genus, species) = (entry.genus, entry.species)
+	headers = [h for pack in packs.values() for h in pack.headers()] or ['Methods']
+	return {
+		'quotes': ('<abstract lang="en">', '">"', ''),
+		'attributes': ('<article', ' id="x"', ' broken'),
+		'open-attribute': ('<title lang="', 'a ', ''),
+		'unclosed-tags': ('', '<i', ''),
+		'nested-italics': ('', '<i>', genus),
+		'open-taxa': ('', '<taxon genus="', ''),
+		'taxa': ('', f'<taxon genus="{genus}" species="{species}" sub-prefix="" sub-species="">{genus} {species}</taxon> ', ''),
+		# (after the full name, so the species' pattern is searched for)
+		'spaces': (f'{genus} {species} {genus}', ' ', 'x'),
+		'newlines': (f'{genus} {species} {genus}', ' \n', 'x'),
+		'hyphens': ('', 'a-', ''),
+		'words': ('', 'a', ''),
+		'names': ('', ' '.join(rng.choice(species_names(entry)) for _ in range(4)) + ' ', ''),
+		'initials': ('', f'{genus[0]}. ', species),
+		'headers': ('', rng.choice(headers) + ': ', ''),
+		'na': ('<title lang="en">', 'n/a ', '</title>'),
+		'particles': ('', 'de la ', 'x'),
+		'random': ('', ''.join(rng.choice(PUNCTUATION) for _ in range(16)), ''),
+	}
+
+
+def targets(index, packs, rule_paths: List[str]) -> Dict[str, Tuple[Callable[[str], object], bool]]:
+	"""
+	Returns the stages fuzzed: each is a function of the input, and whether
+	the input is wrapped in an article (rather than given as a line).
+	"""
+	rules = compile_text_rules(rule_paths)
+	matcher = get_fuzzy_matcher(index, 2)
+	return {
+		'xml.get_tag': (xml.get_tag, False),
+		'xml.get_attributes': (xml.get_attributes, False),
+		'xml.get_inner_xml': (xml.get_inner_xml, False),
+		'xml.set_inner_xml': (lambda t: xml.set_inner_xml(t, 'x'), False),
+		'xml.remove_NA': (xml.remove_NA, False),
+		'authors.remove_NA': (lambda t: remove_NA_authors(t.split('\n')), True),
+		'authors.normalise': (lambda t: normalise_authors(t.split('\n'), True, True), True),
+		'species.find_links': (find_species_links, False),
+		'species.remove_links': (remove_species_link, False),
+		'species.unlink': (lambda t: unlink_species(t, index), False),
+		'species.link': (lambda t: insertSpeciesLinks(t, index), True),
+		'species.prefilter': (lambda t: species_prefilter(t, index), True),
+		'species.fuzzy': (lambda t: find_misspelled_species(t, matcher), True),
+		'textsubs': (rules.apply, True),
+		'headers': (lambda t: surround_headers(t, *HEADER_TAGS, packs), True),
+	}
+
+
+def build_input(family: Tuple[str, str, str], length: int, wrap: bool) -> str:
+	(prefix, pump, suffix) = family
+	text = prefix + pump * max(1, (length - len(prefix) - len(suffix)) // max(len(pump), 1)) + suffix
+	return ARTICLE.format(text=text) if wrap else text
+
+
+def time_call(function: Callable[[str], object], text: str, budget: float) -> Optional[float]:
+	"""
+	Returns the seconds function(text) takes (the best of up to 3 runs, for
+	fast runs), or None if it runs out of budget. Errors (e.g. on malformed
+	input) count as finishing.
+	"""
+	best = None
+	for _ in range(3):
+		started = time.perf_counter()
+		try:
+			with time_limit(budget):
+				function(text)
+		except StageTimeout:
+			return None
+		except Exception:
+			pass
+		seconds = time.perf_counter() - started
+		best = seconds if best is None else min(best, seconds)
+		if seconds > 0.05:
+			break
+	return best
+
+
+def fuzz(function: Callable[[str], object], wrap: bool, family: Tuple[str, str, str], max_length: int, budget: float) -> Dict:
+	"""
+	Times function on inputs of the family of doubling length, and estimates
+	how its time grows with the length of the input (as n^exponent).
+
+	:returns: dict of the lengths and times, the exponent of the last
+			  doubling (None if too fast to tell), and whether it timed out
+	"""
+	(lengths, times) = ([], [])
+	length = START_LENGTH
+	while length <= max_length:
+		text = build_input(family, length, wrap)
+		seconds = time_call(function, text, budget)
+		if seconds is None:
+			return {'lengths': lengths + [len(text)], 'seconds': times, 'exponent': None, 'timed_out': True}
+		lengths.append(len(text))
+		times.append(seconds)
+		length *= 2
+
+	exponent = None
+	if len(times) >= 2 and times[-2] > 0.001:
+		exponent = math.log(times[-1] / times[-2]) / math.log(lengths[-1] / lengths[-2])
+	return {'lengths': lengths, 'seconds': times, 'exponent': exponent, 'timed_out': False}
+
+
+def flagged(result: Dict) -> bool:
+	return result['timed_out'] or (result['exponent'] is not None and result['exponent'] > MAX_EXPONENT
+								   and result['seconds'][-1] >= FLAG_SECONDS)
+
+
+# Feed every regex-heavy stage adversarial inputs of growing length, and flag
+# any whose time grows super-linearly with the length of its input (as from
+# catastrophic backtracking), or that runs out of its budget. Exits 1 if any
+# stage is flagged.
+if __name__ == '__main__':
+	only = []
+	max_length = MAX_LENGTH
+	seed = 0
+	budget = BUDGET
+	pack_paths = [os.path.join(LANG_FOLDER, f) for f in sorted(os.listdir(LANG_FOLDER))] if os.path.isdir(LANG_FOLDER) else []
+	rule_paths = []
+	output = None
+	report_path = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 't:n:s:b:l:u:o:r:', ['target=', 'length=', 'seed=', 'budget=', 'langpack=',
+																	  'rules=', 'output=', 'report='])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-t', '--target'):
+			only.append(arg)
+		if opt in ('-n', '--length'):
+			max_length = int(arg)
+		if opt in ('-s', '--seed'):
+			seed = int(arg)
+		if opt in ('-b', '--budget'):
+			budget = float(arg)
+		if opt in ('-l', '--langpack'):
+			pack_paths.append(arg)
+		if opt in ('-u', '--rules'):
+			rule_paths.append(arg)
+		if opt in ('-o', '--output'):
+			output = arg
+		if opt in ('-r', '--report'):
+			report_path = arg.replace('\\', '/')
+
+	try:
+		packs = get_language_packs(pack_paths)
+	except (OSError, ValueError) as ex:
+		print(f'{colours.RED}LANGUAGE PACK ERROR (ERR 004):{colours.ENDC} {str(ex)}')
+		exit(4)
+	try:
+		stages = targets(get_species_index(), packs, rule_paths)
+	except (OSError, ValueError) as ex:
+		print(f'{colours.RED}RULE PACK ERROR (ERR 007):{colours.ENDC} {str(ex)}')
+		exit(7)
+	inputs = families(random.Random(seed), get_species_index(), packs)
+	if output is not None:
+		os.makedirs(output, exist_ok=True)
+
+	print(f'{colours.YELLOW}Fuzzing {len(stages)} stages with {len(inputs)} input families '
+		  f'({START_LENGTH} to {max_length} chars, seed {seed}){colours.ENDC}')
+	report = RunReport(report_path)
+	results = report.section('fuzz')
+	failed = False
+	for (name, (function, wrap)) in stages.items():
+		# (-t also selects every stage starting with TARGET, e.g. -t xml)
+		if len(only) > 0 and not any(name == t or name.startswith(t + '.') for t in only):
+			continue
+
+		results[name] = dict()
+		worst = None
+		for (family_name, family) in inputs.items():
+			result = fuzz(function, wrap, family, max_length, budget)
+			results[name][family_name] = result
+			if flagged(result):
+				failed = True
+				growth = 'timed out' if result['timed_out'] else f'n^{result["exponent"]:.2f}'
+				print(f'  {colours.RED}{name:22} {family_name:16} {growth}{colours.ENDC} at {result["lengths"][-1]} chars')
+				if output is not None:
+					path = os.path.join(output, f'{name}-{family_name}.txt')
+					with open(path, 'w') as f:
+						f.write(build_input(family, result['lengths'][-1], wrap))
+					print(f'    saved as {path}')
+			if not result['timed_out'] and (worst is None or result['seconds'][-1] > worst[1]['seconds'][-1]):
+				worst = (family_name, result)
+
+		if worst is not None:
+			(family_name, result) = worst
+			exponent = f'n^{result["exponent"]:.2f}' if result['exponent'] is not None else 'too fast to tell'
+			print(f'{name:24} slowest: {family_name:16} {result["seconds"][-1] * 1000:8.1f} ms at '
+				  f'{result["lengths"][-1]} chars ({exponent})')
+
+	report.write()
+	if failed:
+		print(f'\n{colours.RED}Some stages take super-linear time on adversarial inputs{colours.ENDC}')
+		exit(1)
+	print(f'\n{colours.GREEN}Every stage takes linear time on every input family{colours.ENDC}')
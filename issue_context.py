@@ -0,0 +1,753 @@
+import copy
+import time
+import sqlite3
+import difflib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+from article import update_index, already_processed, article_info, process_article, DISCREPANCY_TYPES
+from checkpoint import CheckpointJournal
+from issue_io import open_issue, extract_implicit_info, ISSUE_PATH
+from journal_profile import JournalProfile, read_journal_profile
+from rule_packs import RulePackError
+from species_index import get_species_index
+from species_link import insert_species_links_batch, species_prefilter
+from species_hits import SpeciesHits, HITS_FILE
+from report import RunReport
+from pipeline import StageQueue, QueueClosed, init_worker, transform_in_worker, WORKERS, QUEUE_DEPTH, LINK_BATCH
+from stages import StageMonitor, StageTimeout, time_limit, STAGE_BUDGET, FILE_BUDGET
+from colours import colours
+from xml import xml
+
+# Exit codes of preprocessing an issue
+UNKNOWN_TOKEN = 1
+PATH_FORMAT = 2
+LANGUAGE_PACK = 4
+ISSUE_NOT_FOUND = 5
+NO_CONFIGURATION = 6
+RULE_PACK = 7
+DRY_RUN_CHANGES = 10
+
+
+class IssueError(Exception):
+	"""
+	An issue that can't be preprocessed, with the exit code and the (coloured)
+	heading it is reported under.
+	"""
+
+	def __init__(self, code: int, heading: str, message: str) -> None:
+		super().__init__(message)
+		self.code = code
+		self.heading = heading
+
+
+class IssueContext:
+	"""
+	Everything about one issue being preprocessed: the issue itself, what was
+	inferred from its path, its journal's profile, and what has been found in
+	its files so far. Every step of preprocessing an issue takes its context,
+	so several issues can be preprocessed at once (e.g. on threads) in the
+	same process.
+	"""
+
+	def __init__(self, issue, volume: str, number: str, year: str, journal_code: str,
+				 report: RunReport, trace_memory: bool=False, journal: Optional[CheckpointJournal]=None,
+				 resume: bool=False, dry_run: bool=False, stage_budget: Optional[float]=STAGE_BUDGET,
+				 file_budget: Optional[float]=FILE_BUDGET, out: Callable[[str], None]=print) -> None:
+		"""
+		:param issue: the issue's files (see issue_io.open_issue)
+		:param volume: the issue's volume (inferred from its path)
+		:param number: the issue's number
+		:param year: the issue's year
+		:param journal_code: the issue's journal code
+		:param report: the run report of the issue
+		:param trace_memory: whether to trace the memory used by each stage
+		:param journal: checkpoint journal to record written files in (only
+						used for issues that can be resumed)
+		:param resume: whether to skip files the journal has completed
+		:param dry_run: whether to only show what would change
+		:param stage_budget: seconds each stage may take on a file
+		:param file_budget: seconds the stages of a file may take together
+		:param out: prints a line of output
+		"""
+		self.issue = issue
+		self.path = issue.path
+		self.volume = volume
+		self.number = number
+		self.year = year
+		self.journal_code = journal_code
+		self.profile = None
+		self.species_index = None
+
+		self.report = report
+		self.monitor = StageMonitor(report, trace_memory, stage_budget, file_budget)
+		self.journal = journal if issue.resumable else None
+		self.resume = resume
+		self.dry_run = dry_run
+		self.out = out
+
+		# Discrepancy dictionaries: the volume, number and year of each file
+		self.file_to_volume = dict()
+		self.file_to_number = dict()
+		self.file_to_year = dict()
+
+		# Lines for the proofer to check, per file
+		self.file_to_notes = dict()
+
+		# Files processed and written (or on a dry run, shown), in order
+		self.written = []
+		self.files_changed = 0
+
+	def log(self, message: str='') -> None:
+		self.out(message)
+
+	def name(self) -> str:
+		return f'{self.journal_code}{self.volume}({self.number})'
+
+	def expected(self) -> Dict[str, str]:
+		"""
+		Returns the volume, number and year every file of the issue should have.
+		"""
+		return {'volume': self.volume, 'number': self.number, 'year': self.year}
+
+	def discrepancies(self, disc_type: str) -> Dict[str, str]:
+		"""
+		Returns the files whose disc_type (volume, number or year) differs
+		from the issue's, and their (wrong) values.
+		"""
+		d = {'volume': self.file_to_volume, 'number': self.file_to_number, 'year': self.file_to_year}[disc_type]
+		expected = self.expected()[disc_type]
+		return {key: d[key] for key in d.keys() if d[key] != expected}
+
+	def use_profile(self, profile: JournalProfile) -> None:
+		"""
+		Sets the journal profile the issue is preprocessed with, compiling it,
+		and opens the species index if the profile needs it.
+
+		:param profile: the journal's profile
+		:raises IssueError: if a language or rule pack of the profile can't be
+							loaded
+		"""
+		if profile.language_packs is None:
+			try:
+				profile.compile()
+			except RulePackError as ex:
+				raise IssueError(RULE_PACK, 'RULE PACK ERROR (ERR 007):', str(ex))
+			except (OSError, ValueError) as ex:
+				raise IssueError(LANGUAGE_PACK, 'LANGUAGE PACK ERROR (ERR 004):', str(ex))
+		self.profile = profile
+
+		# Record the rules text substitutions are made with, and how long they
+		# took to compile (once per process for each set of rule packs)
+		if profile.text_subs:
+			self.report.set('text_rules', profile.text_rules.summary())
+			if len(profile.text_rules.packs) > 0:
+				self.log(f'{len(profile.text_rules.rules)} text rules from {", ".join(profile.text_rules.packs)} '
+						 f'(compiled in {profile.text_rules.compile_seconds * 1000:.1f} ms)\n')
+
+		# Record which version of the species dictionary the output was linked with
+		if profile.uses_species_index():
+			self.species_index = get_species_index()
+			self.log(f'Species dictionary version {self.species_index.content_hash[:12]}\n')
+			self.report.set('species_dictionary', self.species_index.content_hash)
+
+
+def open_issue_context(path: str, output: Optional[str]=None, report_path: Optional[str]=None, **kwargs) -> IssueContext:
+	"""
+	Opens the issue at path (see issue_io.open_issue) and infers its volume,
+	number, year and journal from its path.
+
+	:param path: path to the issue's xml folder (ending in /)
+	:param output: where to write a processed archive
+	:param report_path: file to append the issue's run report to
+	:param kwargs: the rest of IssueContext's arguments
+	:raises IssueError: if the issue can't be opened or its path is invalid
+	:returns: the issue's context (without a profile)
+	"""
+	# Open the issue's folder, or the issue inside an archive
+	try:
+		issue = open_issue(path, output)
+	except (OSError, ValueError) as ex:
+		raise IssueError(ISSUE_NOT_FOUND, 'ISSUE NOT FOUND (ERR 005):', str(ex))
+
+	# Make sure path meets the pattern: .../jjv(n)/xml/
+	if not ISSUE_PATH.match(issue.path):
+		issue.close(save=False)
+		raise IssueError(PATH_FORMAT, 'FILEPATH FORMAT ERROR (ERR 002):',
+						 'Filepath should end with /jjvv(n)/xml (regex .*\\/[a-z]{2}\\d+\\(.+\\)\\/xml\\/$)')
+
+	# Determine volume, year, issue, and number based on the path to the xml folder
+	(volume, number, year, journal_code) = extract_implicit_info(issue.path, issue.names())
+
+	# Metrics for this run are appended to the report file (if one was given)
+	report = RunReport(report_path)
+	report.set('issue', f'{journal_code}{volume}({number})')
+	report.set('path', issue.path)
+	return IssueContext(issue, volume, number, year, journal_code, report, **kwargs)
+
+
+def load_profile(ctx: IssueContext, ask_profile: Optional[Callable[[str], JournalProfile]]=None) -> JournalProfile:
+	"""
+	Reads the profile of the issue's journal from its .config file.
+
+	:param ctx: the issue's context
+	:param ask_profile: called with the journal code to get the profile from
+						the user if the journal has no .config file
+	:raises IssueError: if the .config file has an unknown token, or is
+						missing and there is no ask_profile
+	:returns: the journal's profile
+	"""
+	try:
+		profile = read_journal_profile(ctx.journal_code)
+		ctx.log(f'Loading configuration for \'{ctx.journal_code}\'...\n')
+		return profile
+	except ValueError as ex: #UNKNOWN TOKEN
+		raise IssueError(UNKNOWN_TOKEN, 'UNKNOWN TOKEN (ERR 001):', str(ex))
+	except FileNotFoundError:
+		if ask_profile is None:
+			raise IssueError(NO_CONFIGURATION, 'NO CONFIGURATION (ERR 006):',
+							 f'No config/{ctx.journal_code}.config for journal \'{ctx.journal_code}\'')
+		return ask_profile(ctx.journal_code)
+
+
+def checkpointed(ctx: IssueContext, filename: str) -> Optional[Dict]:
+	"""
+	Returns the checkpoint journal's entry for a file the interrupted run
+	being resumed already completed, or None if the file must be processed.
+
+	:param ctx: the issue's context
+	:param filename: name of the xml file
+	"""
+	if ctx.resume and ctx.journal is not None:
+		return ctx.journal.completed_file(ctx.issue, filename)
+	return None
+
+
+def resume_file(ctx: IssueContext, filename: str, entry: Dict) -> None:
+	"""
+	Records a file the interrupted run already completed from its checkpoint
+	journal entry, without reading it again.
+
+	:param ctx: the issue's context
+	:param filename: name of the xml file
+	:param entry: the file's entry in the checkpoint journal
+	"""
+	ctx.log("Already processed " + filename + " (checkpoint)...")
+	ctx.report.add('files_resumed')
+	info = entry.get('info', dict())
+	ctx.file_to_volume[filename] = info.get('volume')
+	ctx.file_to_number[filename] = info.get('number')
+	ctx.file_to_year[filename] = info.get('year')
+	if len(info.get('notes', [])) > 0:
+		ctx.file_to_notes[filename] = info['notes']
+
+
+def start_file(ctx: IssueContext, filename: str, original: str) -> bool:
+	"""
+	Returns True if a file must be processed, or False if it already was.
+
+	:param ctx: the issue's context
+	:param filename: name of the xml file
+	:param original: contents of the xml file
+	"""
+	# Check if this file as already been processed
+	if already_processed(filename, original):
+		ctx.log("Already processed " + filename + "...")
+		ctx.report.add('files_skipped')
+		return False
+
+	ctx.log("Processing " + filename + "...")
+	ctx.report.add('files_processed')
+	return True
+
+
+def finish_file(ctx: IssueContext, filename: str, body: str, notes: List[str]) -> None:
+	"""
+	Records the volume, number and year of a processed file, and its notes.
+
+	:param ctx: the issue's context
+	:param filename: name of the xml file
+	:param body: the processed contents of the file
+	:param notes: lines for the proofer to check
+	"""
+	# Add elements to our discrepancy dictionaries
+	info = article_info(body)
+	ctx.file_to_volume[filename] = info['volume']
+	ctx.file_to_number[filename] = info['number']
+	ctx.file_to_year[filename] = info['year']
+	if len(notes) > 0:
+		ctx.file_to_notes[filename] = notes
+
+
+def link_pending(ctx: IssueContext, pending: List[tuple]) -> None:
+	"""
+	Adds species links to processed files, in place. The title/abstract
+	blocks of every file are searched for species together, skipping files
+	without a single genus or species epithet in them. If that runs out of
+	time (the stage budget of all the files together), each file is linked
+	on its own within its budget instead.
+
+	:param ctx: the issue's context
+	:param pending: list of (filename, original, processed) of the files
+	"""
+	to_link = [i for i in range(len(pending)) if species_prefilter(pending[i][2], ctx.species_index)]
+	for _ in range(len(pending) - len(to_link)):
+		ctx.monitor.skipped('species')
+	species_stats = ctx.report.section('species')
+	before = copy.deepcopy(species_stats)
+	ctx.monitor.begin_file(None)
+	try:
+		with ctx.monitor.measure('species'), time_limit(ctx.monitor.budget(len(to_link))):
+			linked = insert_species_links_batch([pending[i][2] for i in to_link], ctx.species_index, stats=species_stats)
+	except StageTimeout:
+		ctx.log(f'{colours.YELLOW}Linking species ran out of time; linking each file on its own{colours.ENDC}')
+		linked = []
+		for i in to_link:
+			(filename, _, body) = pending[i]
+			# (statistics of a file that runs out of time are left out)
+			species_stats.clear()
+			species_stats.update(before)
+			ctx.monitor.begin_file(filename)
+			result = ctx.monitor.attempt('species', insert_species_links_batch, [body], ctx.species_index, None, species_stats)
+			if result is None:
+				ctx.file_to_notes.setdefault(filename, []).append('Stage \'species\' skipped: ran out of its time budget')
+				linked.append(body)
+			else:
+				linked.append(result[0])
+				before = copy.deepcopy(species_stats)
+		species_stats.clear()
+		species_stats.update(before)
+
+	for (i, text) in zip(to_link, linked):
+		(filename, original, body) = pending[i]
+		if text != body:
+			ctx.monitor.changed('species')
+		pending[i] = (filename, original, text)
+
+
+def log_species(ctx: IssueContext) -> None:
+	species_stats = ctx.report.section('species')
+	ctx.log(f"Found {len(species_stats.get('species_found', dict()))} species in {species_stats.get('blocks', 0)} "
+			f"title/abstract blocks ({species_stats.get('links_added', 0)} links added)")
+
+
+def record_species_hits(ctx: IssueContext, path: str=HITS_FILE) -> None:
+	"""
+	Adds how often each dictionary entry matched in the issue's files to the
+	persistent hit counts (see species_hits). Failing to record them doesn't
+	fail the issue.
+
+	:param ctx: the issue's context
+	:param path: path to the hit counts' database
+	"""
+	species_stats = ctx.report.section('species')
+	if species_stats.get('blocks', 0) == 0:
+		return
+	try:
+		hits = SpeciesHits(path)
+		hits.add(species_stats.get('hits', dict()), species_stats['blocks'])
+		hits.close()
+	except sqlite3.Error as ex:
+		ctx.log(f'{colours.YELLOW}Couldn\'t record species hits in {path}:{colours.ENDC} {str(ex)}')
+
+
+def write_file(ctx: IssueContext, filename: str, original: str, body: str,
+			   out: Optional[Callable[[str], None]]=None) -> None:
+	"""
+	Writes a processed file (or on a dry run, shows how it'd change),
+	recording it in the checkpoint journal.
+
+	:param ctx: the issue's context
+	:param filename: name of the xml file
+	:param original: contents of the file before processing
+	:param body: the processed contents of the file
+	:param out: prints a line of a dry run's diff (defaults to ctx.out)
+	"""
+	ctx.written.append(filename)
+	if body != original:
+		ctx.files_changed += 1
+
+	# If we're in a dry run, only show what would change
+	if ctx.dry_run:
+		print_diff(filename, original, body, out if out is not None else ctx.out)
+	else:
+		# Otherwise, write processed lines back to file
+		ctx.issue.write(filename, body)
+
+		if ctx.journal is not None:
+			ctx.journal.record_file(ctx.issue, filename, {
+				'volume': ctx.file_to_volume[filename], 'number': ctx.file_to_number[filename],
+				'year': ctx.file_to_year[filename], 'notes': ctx.file_to_notes.get(filename, [])})
+
+
+def process_pipelined(ctx: IssueContext, filenames: List[str], workers: int=WORKERS, depth: int=QUEUE_DEPTH) -> None:
+	"""
+	Processes, links and writes the files of the issue in a pipeline of
+	three stages joined by queues of depth files: a reader thread, the
+	transforms (on this thread, or in workers processes), and a writer
+	thread. So reading and writing files overlap with transforming them,
+	without more than a few files ever being held in memory. Species are
+	linked LINK_BATCH files at a time, on this thread.
+
+	Files are logged, and their volumes, numbers, years and notes recorded,
+	in the order of filenames, just as if they were processed one at a time.
+	A dry run's diffs are shown once every file has been processed. How
+	full each queue got, and how long each stage waited on the others, go
+	in the run report.
+
+	:param ctx: the issue's context
+	:param filenames: names of the xml files to process, in order
+	:param workers: number of processes to transform files in (1 for this
+					thread)
+	:param depth: the most files each queue holds
+	"""
+	reads = StageQueue('read', depth)
+	writes = StageQueue('write', depth)
+	errors = []
+	diffs = []
+	timing = {'transform_wait_seconds': 0.0, 'write_seconds': 0.0}
+
+	def read() -> None:
+		# When resuming, files the interrupted run already completed aren't
+		# read again
+		try:
+			try:
+				for filename in filenames:
+					entry = checkpointed(ctx, filename)
+					if entry is not None:
+						reads.put((filename, None, entry, 0.0))
+						continue
+					started = time.perf_counter()
+					original = ctx.issue.read(filename)
+					reads.put((filename, original, None, time.perf_counter() - started))
+			except Exception as ex:
+				# (raised on the transform stage's thread)
+				reads.put(ex)
+			reads.put(None)
+		except QueueClosed:
+			pass
+
+	def write() -> None:
+		try:
+			for item in iter(writes.get, None):
+				started = time.perf_counter()
+				write_file(ctx, *item, out=diffs.append)
+				timing['write_seconds'] += time.perf_counter() - started
+		except QueueClosed:
+			pass
+		except Exception as ex:
+			errors.append(ex)
+			writes.close()
+
+	# Processed files waiting for their species links, and files being
+	# transformed in other processes, in order
+	batch = []
+	in_flight = deque()
+
+	def link_batch() -> None:
+		if ctx.profile.species_links and len(batch) > 0:
+			link_pending(ctx, batch)
+		for item in batch:
+			writes.put(item)
+		batch.clear()
+
+	def finish(filename: str, original: str, body: str, notes: List[str]) -> None:
+		finish_file(ctx, filename, body, notes)
+		batch.append((filename, original, body))
+		if len(batch) >= LINK_BATCH:
+			link_batch()
+
+	def collect() -> None:
+		(filename, original, future) = in_flight.popleft()
+		started = time.perf_counter()
+		(body, notes, metrics) = future.result()
+		timing['transform_wait_seconds'] += time.perf_counter() - started
+		ctx.monitor.merge(metrics)
+		finish(filename, original, body, notes)
+
+	# (the memory of other processes isn't traced)
+	if ctx.monitor.trace_memory:
+		workers = 1
+	pool = None
+	if workers > 1:
+		pool = ProcessPoolExecutor(workers, initializer=init_worker,
+								   initargs=(ctx.profile, ctx.year, ctx.monitor.stage_budget, ctx.monitor.file_budget))
+	reader = threading.Thread(target=read, daemon=True)
+	writer = threading.Thread(target=write, daemon=True)
+	reader.start()
+	writer.start()
+	processed = 0
+	try:
+		for item in iter(reads.get, None):
+			if isinstance(item, Exception):
+				raise item
+			(filename, original, entry, seconds) = item
+			if entry is not None:
+				# (files are recorded in order, so those being transformed
+				# come first)
+				while len(in_flight) > 0:
+					collect()
+				resume_file(ctx, filename, entry)
+				continue
+
+			ctx.monitor.add_seconds('read', seconds)
+			if not start_file(ctx, filename, original):
+				continue
+			processed += 1
+			if pool is None:
+				ctx.monitor.begin_file(filename)
+				notes = []
+				body = process_article(filename, original, ctx.profile, ctx.year, ctx.monitor, notes, ctx.species_index)
+				finish(filename, original, body, notes)
+			else:
+				in_flight.append((filename, original, pool.submit(transform_in_worker, filename, original)))
+				if len(in_flight) >= depth:
+					collect()
+		while len(in_flight) > 0:
+			collect()
+		link_batch()
+		writes.put(None)
+		writer.join()
+	except QueueClosed:
+		# The writer failed
+		raise errors[0]
+	finally:
+		reads.close()
+		writes.close()
+		if pool is not None:
+			pool.shutdown(cancel_futures=True)
+	if len(errors) > 0:
+		raise errors[0]
+
+	if ctx.profile.species_links and processed > 0:
+		log_species(ctx)
+	for line in diffs:
+		ctx.out(line)
+
+	pipeline = {'workers': workers, 'read_queue': reads.summary(), 'write_queue': writes.summary()}
+	pipeline.update({key: round(seconds, 6) for (key, seconds) in timing.items()})
+	ctx.report.set('pipeline', pipeline)
+
+
+def print_discrepancy_report(ctx: IssueContext, disc_type: str) -> Dict[str, str]:
+	"""
+	Displays a message to the user listing all the errors found of type
+	disc_type as well as what the expected value should be.
+
+	:param ctx: the issue's context
+	:param disc_type: the type of discrepencies (number, volume, or year)
+	:returns: dict of the files with the discrepancy to their (wrong) values
+	"""
+
+	ctx.log(f'{colours.RED}Journal {disc_type} discrepancies:{colours.ENDC}')
+	expected = ctx.expected()[disc_type]
+
+	problems = ctx.discrepancies(disc_type)
+	for key in problems.keys():
+		ctx.log(key + ": Expected " + disc_type + "=\"" + str(expected) +
+				"\" but got " + disc_type + "=\"" + str(problems[key]) + "\"")
+	ctx.log("")
+	return problems
+
+
+def fix_discrepencies(ctx: IssueContext, files: Dict[str, str], disc_type: str) -> None:
+	"""
+	For each file in files, the incorrect attribute (disc_type) is updated
+	with the correct value for the issue.
+
+	:param ctx: the issue's context
+	:param files: a 'discrepancy dictionary' mapping filenames to their value
+				  for disc_type (only the keys are used)
+	:param disc_type: the type of discrepencies (number, volume, year)
+	:returns: None
+	"""
+	expected = ctx.expected()[disc_type]
+
+	# Loop through each file that needs fixing
+	for filename in files.keys():
+		ctx.log("Fixing " + filename + "...")
+
+		# read in file contents
+		lines = ctx.issue.read(filename).splitlines()
+
+		# replace the incorrect attribute with the expected one
+		lines[0] = xml.set_attribute(disc_type, expected, lines[0])
+
+		# If volume or number or were changed, we also need to update the index
+		# tag
+		if disc_type == "volume" or disc_type == "number":
+			# Locate the index line. Should always be 3rd last line
+			lines[-3] = update_index(lines[-3], disc_type[0], expected)
+		# If the year was updated, we also need to change the index tag
+		if disc_type == "year":
+			lines[-3] = update_index(lines[-3], 'y', expected)
+
+		# Rejoin all lines on newline and write to file
+		body = "\n".join(lines)
+		ctx.issue.write(filename, body)
+	ctx.log("")
+
+
+def resolve_discrepancies(ctx: IssueContext, confirm: Callable[[], bool]) -> None:
+	"""
+	Reports the files whose volume, number or year differ from the issue's,
+	fixing each kind of discrepancy if confirm() says to.
+
+	:param ctx: the issue's context
+	:param confirm: asked whether to fix the discrepancies just reported
+	"""
+	for disc_type in DISCREPANCY_TYPES:
+		if len(ctx.discrepancies(disc_type)) > 0:
+			problems = print_discrepancy_report(ctx, disc_type)
+			if confirm():
+				fix_discrepencies(ctx, problems, disc_type)
+
+
+def write_problems_file(ctx: IssueContext) -> None:
+	"""
+	Generates proofing file to be filled out by Proofing Student, listing
+	every file of the issue along with any lines the preprocessor wants the
+	proofer to check.
+
+	:param ctx: the issue's context
+	:returns: None
+	"""
+	file_body = "Proofed by: \n\n"
+	for file in ctx.file_to_volume.keys():
+		file_body += file[:len(file)-4] + ":\n"
+		for note in ctx.file_to_notes.get(file, []):
+			file_body += "  " + note + "\n"
+		file_body += "\n"
+
+	ctx.issue.write("../" + ctx.name() + " Problems.txt", file_body)
+
+
+def print_diff(filename: str, before: str, after: str, out: Callable[[str], None]=print) -> None:
+	"""
+	Prints a (coloured) unified diff of the changes made to a file, without
+	any context lines.
+
+	:param filename: name of the changed file
+	:param before: file contents before preprocessing
+	:param after: file contents after preprocessing
+	:param out: prints a line of output
+	"""
+	diff = difflib.unified_diff(before.splitlines(), after.splitlines(),
+								f'a/{filename}', f'b/{filename}', n=0, lineterm='')
+	for line in diff:
+		if line.startswith('+++') or line.startswith('---'):
+			out(line)
+		elif line.startswith('+'):
+			out(f'{colours.GREEN}{line}{colours.ENDC}')
+		elif line.startswith('-'):
+			out(f'{colours.RED}{line}{colours.ENDC}')
+		else:
+			out(f'{colours.CYAN}{line}{colours.ENDC}')
+
+
+def preprocess_issue(path: str, output: Optional[str]=None, report_path: Optional[str]=None,
+					 trace_memory: bool=False, journal: Optional[CheckpointJournal]=None, resume: bool=False,
+					 dry_run: bool=False, stage_budget: Optional[float]=STAGE_BUDGET,
+					 file_budget: Optional[float]=FILE_BUDGET, workers: int=WORKERS, queue_depth: int=QUEUE_DEPTH,
+					 confirm: Optional[Callable[[], bool]]=None,
+					 ask_profile: Optional[Callable[[str], JournalProfile]]=None,
+					 on_report: Optional[Callable[[Dict], None]]=None, out: Callable[[str], None]=print) -> int:
+	"""
+	Preprocesses the issue at path from start to finish, as preprocess.py
+	does. Everything about the issue is kept in its own context, so this can
+	be run for several issues at once on threads.
+
+	:param path: path to the issue's xml folder (ending in /)
+	:param output: where to write a processed archive (see issue_io)
+	:param report_path: file to append the issue's run report to
+	:param trace_memory: whether to trace the memory used by each stage
+	:param journal: checkpoint journal to record written files in
+	:param resume: whether to skip files the journal has completed
+	:param dry_run: whether to only show what would change
+	:param stage_budget: seconds each stage may take on a file (None for no
+						 limit)
+	:param file_budget: seconds the stages of a file may take together (None
+						for no limit)
+	:param workers: number of processes to transform files in (1 to
+					transform them on the calling thread)
+	:param queue_depth: the most files held between two stages of the
+						pipeline (see process_pipelined)
+	:param confirm: asked whether to fix each kind of discrepancy (if None,
+					discrepancies are only reported)
+	:param ask_profile: gets the journal's profile from the user if it has no
+						.config file (if None, the issue fails)
+	:param on_report: called with the metrics of the issue's run report once
+					  it is written
+	:param out: prints a line of output
+	:returns: the exit code (0 on success)
+	"""
+	try:
+		ctx = open_issue_context(path, output, report_path, trace_memory=trace_memory, journal=journal,
+								 resume=resume, dry_run=dry_run, stage_budget=stage_budget,
+								 file_budget=file_budget, out=out)
+		try:
+			ctx.use_profile(load_profile(ctx, ask_profile))
+		except IssueError:
+			ctx.issue.close(save=False)
+			raise
+	except IssueError as ex:
+		out(f'{colours.RED}{ex.heading}{colours.ENDC} {str(ex)}')
+		return ex.code
+
+	ctx.log(f'{colours.YELLOW}Starting XML processing{colours.ENDC}')
+	# Read, process and write each xml file in the directory
+	filenames = [filename for filename in ctx.issue.names() if filename.endswith(".xml")]
+	process_pipelined(ctx, filenames, workers, queue_depth)
+	if not dry_run:
+		record_species_hits(ctx)
+
+	ctx.log(f"{colours.GREEN}Completed XML processing!{colours.ENDC}")
+	ctx.report.set('files_changed', ctx.files_changed)
+
+	# Stages that ran out of time were skipped, leaving their files for the
+	# proofer (they are noted in the proofing file)
+	if len(ctx.monitor.over_budget) > 0:
+		ctx.log(f"\n{colours.RED}Stages skipped for running out of their time budget:{colours.ENDC}")
+		for (f, stages) in ctx.monitor.over_budget.items():
+			ctx.log(f"  {f}: {', '.join(stages)}")
+	ctx.monitor.finish()
+
+	# Show which files needed the most memory
+	if trace_memory:
+		ctx.log(f"\n{colours.YELLOW}Peak memory by file{colours.ENDC}")
+		for (f, peak, stage) in ctx.monitor.top_files():
+			ctx.log(f"  {f}: {peak / 1024:.1f} KiB ({stage})")
+
+	# A dry run writes nothing. Summarise the pending changes and exit non-zero
+	# if there are any, so a dry run can be used as a check.
+	if dry_run:
+		ctx.log(f"\n{colours.YELLOW}Dry run: {ctx.files_changed} file(s) would change{colours.ENDC}")
+		for stage in ctx.monitor.stage_changes.keys():
+			ctx.log(f"  {stage}: {ctx.monitor.stage_changes[stage]} file(s)")
+		for stage in ctx.monitor.stage_skips.keys():
+			ctx.log(f"  {stage}: skipped for {ctx.monitor.stage_skips[stage]} file(s) with nothing to do")
+		ctx.report.write()
+		if on_report is not None:
+			on_report(ctx.report.metrics)
+		ctx.issue.close(save=False)
+		return DRY_RUN_CHANGES if ctx.files_changed > 0 else 0
+
+	ctx.log(f"\n{colours.YELLOW}Generating proofing file{colours.ENDC}")
+	write_problems_file(ctx)
+	ctx.log(f"{colours.GREEN}Proofing file generated!{colours.ENDC}")
+	ctx.report.write()
+	if on_report is not None:
+		on_report(ctx.report.metrics)
+
+	ctx.log(f"\n{colours.YELLOW}Performing Discrepancy Analysis{colours.ENDC}")
+	resolve_discrepancies(ctx, confirm if confirm is not None else lambda: False)
+	ctx.log(f'{colours.GREEN}Discrepancies resolved!{colours.ENDC}')
+
+	# Issues read from an archive are written to a new archive (or folder)
+	output = ctx.issue.close()
+	if output is not None:
+		ctx.log(f'Processed issue written to {colours.GREEN}{output}{colours.ENDC}')
+
+	ctx.log('\nPlease proceed to manual processing of each file.')
+	return 0
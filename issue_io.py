@@ -0,0 +1,476 @@
+import io
+import os
+import re
+import copy
+import time
+import gzip
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import posixpath
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+try:
+	import fcntl
+except ImportError:
+	# (Windows: output archives aren't locked)
+	fcntl = None
+
+# Archives an issue can be read from, by extension. A path into an archive is
+# the archive's path followed by the path of the issue inside it, e.g.
+# .../batch.zip/hn11(2)/xml/
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# XML files may also be individually gzip-compressed (hn19000.xml.gz)
+GZIP_EXTENSION = '.gz'
+
+# Encoding of the files inside archives
+ENCODING = 'utf-8'
+
+# Path of an issue's xml folder: .../jjvv(n)/xml/
+ISSUE_PATH = re.compile(r'.*\/[a-z]{2}\d+\(.+\)\/xml\/$')
+
+
+def archive_extension(path: str) -> Optional[str]:
+	"""
+	Returns the archive extension of path, or None if path isn't an archive.
+	"""
+	for extension in ZIP_EXTENSIONS + TAR_EXTENSIONS:
+		if path.lower().endswith(extension):
+			return extension
+	return None
+
+
+def split_archive_path(path: str) -> Tuple[Optional[str], str]:
+	"""
+	Splits path into the path of the archive it points into and the path
+	inside the archive. If path doesn't point into an archive, the archive
+	is None.
+
+	>>> split_archive_path('/in/batch.zip/hn11(2)/xml/')
+	('/in/batch.zip', 'hn11(2)/xml/')
+
+	:param path: path to an issue's xml folder
+	:returns: (archive path, path inside the archive)
+	"""
+	parts = path.replace('\\', '/').split('/')
+	for i in range(1, len(parts) + 1):
+		prefix = '/'.join(parts[:i])
+		if archive_extension(prefix) is not None and os.path.isfile(prefix):
+			return (prefix, '/'.join(parts[i:]))
+	return (None, path)
+
+
+def year_of(filename: str) -> str:
+	"""
+	Returns the year of an xml file, from its name. XML files are ALWAYS of
+	the form JJYY###.xml
+
+	:param filename: name of the xml file
+	:returns: the (four digit) year
+	"""
+	year = filename[2:4]
+	return "19" + year if int(year) > 80 else "20" + year
+
+
+def extract_implicit_info(path: str, filenames: List[str]) -> Tuple[str, str, str, str]:
+	"""
+	(str, list) -> (str, str, str, str)
+	Returns the volume, number, year, and journal code for this particular
+	journal by extracting info from the directory structure and file-naming
+	conventions for Bioline tickets.
+
+	:param path: filepath matching .*/\w\w\d+(\d+)/ (possibly inside an
+				 archive)
+	:param filenames: names of the xml files in the folder at path
+	:returns: volume, number, year, and journal code for this issue
+	"""
+
+	# Filepath looks like .../.../jjVV(N)/
+	folder = path[:-5]
+	folder = folder[folder.rindex("/")+1:]
+
+	# Pull out the journal code, volume, and issue
+	inf_journal_code = folder[0:2].lower()
+	inf_volume = folder[2:folder.index("(")]
+	inf_number = folder[folder.index("(")+1:folder.index(")")]
+
+	# Nest a level deeper and get the year
+	for filename in filenames:
+		return (inf_volume, inf_number, year_of(filename), inf_journal_code)
+
+
+def read_text(data: bytes) -> str:
+	# Newlines are translated as open() would in text mode
+	return io.TextIOWrapper(io.BytesIO(data), encoding=ENCODING).read()
+
+
+class DirectoryIssue:
+	"""
+	The xml files of an issue in a folder on disk, read and written in place.
+	Files ending in .xml.gz are decompressed when read (and compressed again
+	when written), and are named without the .gz.
+	"""
+
+	resumable = True
+
+	def __init__(self, path: str) -> None:
+		"""
+		:param path: path to the issue's xml folder (ending in /)
+		"""
+		if not os.path.isdir(path):
+			raise FileNotFoundError(f'No such xml folder: {path}')
+		self.path = path
+		self._compressed = set()
+
+	def names(self) -> List[str]:
+		"""
+		Returns the names of the issue's xml files, in directory order.
+		"""
+		names = []
+		for filename in os.listdir(self.path):
+			if filename.endswith('.xml' + GZIP_EXTENSION):
+				filename = filename[:-len(GZIP_EXTENSION)]
+				self._compressed.add(filename)
+			if filename.endswith('.xml'):
+				names.append(filename)
+		return names
+
+	def _stored(self, name: str) -> str:
+		# Path of the file name as stored (compressed or not)
+		return self.path + name + (GZIP_EXTENSION if name in self._compressed else '')
+
+	def read(self, name: str) -> str:
+		if name in self._compressed:
+			with gzip.open(self._stored(name), 'rt') as f:
+				return f.read()
+		with open(self._stored(name)) as f:
+			return f.read()
+
+	def write(self, name: str, text: str) -> None:
+		"""
+		Writes text to the file name. name is relative to the xml folder, so
+		'../x.txt' is written to the issue folder.
+		"""
+		if name in self._compressed:
+			with gzip.open(self._stored(name), 'wt') as f:
+				f.write(text)
+			return
+		with open(self._stored(name), 'w') as f:
+			f.write(text)
+
+	def stat(self, name: str) -> os.stat_result:
+		"""
+		Returns the os.stat of the file name as stored (the .xml.gz file of a
+		compressed one).
+
+		:raises FileNotFoundError: if there is no such file
+		"""
+		return os.stat(self._stored(name))
+
+	def sha256(self, name: str) -> str:
+		"""
+		Returns the sha256 (hex) of the file name as stored.
+
+		:raises FileNotFoundError: if there is no such file
+		"""
+		with open(self._stored(name), 'rb') as f:
+			return hashlib.sha256(f.read()).hexdigest()
+
+	def close(self, save: bool=True) -> Optional[str]:
+		"""
+		Nothing to do, as files are written in place.
+
+		:returns: None (there is no separate output)
+		"""
+		return None
+
+
+class MemoryIssue:
+	"""
+	The xml files of an issue held in memory (e.g. sent to the preprocessing
+	service). Written files replace them in memory; nothing is saved.
+	"""
+
+	resumable = False
+
+	def __init__(self, path: str, files: Dict[str, str]) -> None:
+		"""
+		:param path: path to name the issue's xml folder by (ending in /)
+		:param files: dict of the names of the issue's xml files to their
+					  contents
+		"""
+		self.path = path
+		self.files = dict(files)
+
+	def names(self) -> List[str]:
+		return [name for name in self.files if name.endswith('.xml')]
+
+	def read(self, name: str) -> str:
+		return self.files[name]
+
+	def write(self, name: str, text: str) -> None:
+		self.files[name] = text
+
+	def close(self, save: bool=True) -> Optional[str]:
+		return None
+
+
+@contextmanager
+def output_lock(path: str):
+	"""
+	Context manager holding an exclusive lock on the output archive at path
+	(through the file path.lock), so that issues of one archive processed at
+	once, on threads or by queue workers, update it one after another.
+
+	:param path: path to the output archive
+	"""
+	if fcntl is None:
+		yield
+		return
+	with open(path + '.lock', 'a') as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ArchiveMembers:
+	"""
+	The files of a zip or tar archive, read straight from the archive
+	(nothing is extracted to disk).
+	"""
+
+	def __init__(self, path: str) -> None:
+		"""
+		:param path: path to the archive
+		"""
+		self.path = path
+		# The ZipInfo or TarInfo of each member, in archive order
+		if archive_extension(path) in ZIP_EXTENSIONS:
+			self._zip = zipfile.ZipFile(path)
+			self._tar = None
+			self.infos = {info.filename: info for info in self._zip.infolist() if not info.is_dir()}
+		else:
+			self._zip = None
+			self._tar = tarfile.open(path, 'r:*')
+			self.infos = {m.name: m for m in self._tar.getmembers() if m.isfile()}
+		self.names = list(self.infos)
+
+	def read(self, member: str) -> bytes:
+		if self._zip is not None:
+			return self._zip.read(member)
+		with self._tar.extractfile(self.infos[member]) as f:
+			return f.read()
+
+	def close(self) -> None:
+		if self._zip is not None:
+			self._zip.close()
+		else:
+			self._tar.close()
+
+
+class ArchiveIssue:
+	"""
+	The xml files of an issue inside a zip or tar archive. Members are read
+	straight from the archive, and written files are held until the issue is
+	closed, when a processed copy of the whole archive (or the processed
+	issue, as a folder tree) is written to the output. If the output archive
+	already exists (e.g. another issue of the archive was processed into it
+	before), it is updated: only this issue's written files change. The
+	output is locked while it is updated (see output_lock).
+	"""
+
+	resumable = False
+
+	def __init__(self, archive: str, inner: str, output: Optional[str]=None) -> None:
+		"""
+		:param archive: path to the archive
+		:param inner: path of the issue's xml folder inside the archive (if
+					  empty, the archive must contain exactly one issue)
+		:param output: path of the processed archive (by extension) or of a
+					   folder to write the processed issue's tree to. Defaults
+					   to a .processed copy of the archive alongside it.
+		"""
+		self.archive = archive
+		self.extension = archive_extension(archive)
+		if output is None:
+			output = archive[:-len(self.extension)] + '.processed' + self.extension
+		self.output = output
+		self._written = dict()
+
+		self._source = ArchiveMembers(archive)
+		members = self._source.names
+		self._members = members
+
+		if inner == '':
+			folders = sorted({posixpath.dirname(m) + '/' for m in members
+							  if m.endswith('.xml') and posixpath.basename(posixpath.dirname(m)) == 'xml'})
+			if len(folders) != 1:
+				raise FileNotFoundError(f'{archive} contains {len(folders)} issues; give the path of one of them')
+			inner = folders[0]
+		if not inner.endswith('/'):
+			inner += '/'
+		self.inner = inner
+		self.path = archive + '/' + inner
+
+		if not any(m.startswith(inner) for m in members):
+			raise FileNotFoundError(f'No such xml folder in {archive}: {inner}')
+
+	def names(self) -> List[str]:
+		"""
+		Returns the names of the issue's xml files, in archive order.
+		"""
+		names = []
+		for member in self._members:
+			if posixpath.dirname(member) + '/' == self.inner:
+				filename = posixpath.basename(member)
+				if filename.endswith('.xml' + GZIP_EXTENSION):
+					filename = filename[:-len(GZIP_EXTENSION)]
+				if filename.endswith('.xml'):
+					names.append(filename)
+		return names
+
+	def _member(self, name: str) -> str:
+		return posixpath.normpath(self.inner + name)
+
+	def _read_member(self, member: str) -> bytes:
+		return self._source.read(member)
+
+	def read(self, name: str) -> str:
+		member = self._member(name)
+		if member in self._written:
+			return self._written[member]
+		if member + GZIP_EXTENSION in self._members:
+			return read_text(gzip.decompress(self._read_member(member + GZIP_EXTENSION)))
+		return read_text(self._read_member(member))
+
+	def write(self, name: str, text: str) -> None:
+		"""
+		Stores text as the new contents of the file name (relative to the xml
+		folder) until the issue is closed.
+		"""
+		self._written[self._member(name)] = text
+
+	def _processed_members(self) -> Dict[str, bytes]:
+		# Written files keep their compression
+		processed = dict()
+		for (member, text) in self._written.items():
+			if member + GZIP_EXTENSION in self._members:
+				processed[member + GZIP_EXTENSION] = gzip.compress(text.encode(ENCODING))
+			else:
+				processed[member] = text.encode(ENCODING)
+		return processed
+
+	def close(self, save: bool=True) -> Optional[str]:
+		"""
+		Writes the output (if save) and closes the archive.
+
+		:param save: False to discard the written files (e.g. on a dry run)
+		:returns: path to the output, or None if nothing was saved
+		"""
+		try:
+			if not save:
+				return None
+			processed = self._processed_members()
+			if archive_extension(self.output) is None:
+				self._save_tree(processed)
+			else:
+				# An earlier output is updated rather than replaced, by one
+				# issue at a time
+				with output_lock(self.output):
+					previous = ArchiveMembers(self.output) if os.path.isfile(self.output) else None
+					try:
+						self._save_archive(processed, previous or self._source)
+					finally:
+						if previous is not None:
+							previous.close()
+			return self.output
+		finally:
+			self._source.close()
+
+	def _entries(self, processed: Dict[str, bytes], base: ArchiveMembers):
+		# Every file of base (the archive, or an earlier output), in order,
+		# with the processed files' new contents, then any files only in the
+		# archive, and new files (e.g. the problems file) last. Each comes
+		# with its ZipInfo or TarInfo in base or the archive (None if new).
+		processed = dict(processed)
+		for member in base.names:
+			yield (member, processed.pop(member) if member in processed else base.read(member), base.infos[member])
+		for member in self._members:
+			if member not in base.infos:
+				yield (member, processed.pop(member) if member in processed else self._read_member(member),
+					   self._source.infos[member])
+		for (member, data) in processed.items():
+			yield (member, data, None)
+
+	def _save_tree(self, processed: Dict[str, bytes]) -> None:
+		# Only the issue itself (its folder, including the problems file) is
+		# written out
+		issue_folder = posixpath.dirname(self.inner.rstrip('/')) + '/'
+		for (member, data, _) in self._entries(processed, self._source):
+			if member.startswith(issue_folder):
+				path = os.path.join(self.output, *member.split('/'))
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				with open(path, 'wb') as f:
+					f.write(data)
+
+	def _save_archive(self, processed: Dict[str, bytes], base: ArchiveMembers) -> None:
+		# Written to a temporary file of its own next to the output (with the
+		# archive's permissions), which then replaces the output
+		(fd, tmp_path) = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(self.output) or '.')
+		os.close(fd)
+		try:
+			os.chmod(tmp_path, os.stat(self.archive).st_mode & 0o777)
+			if archive_extension(self.output) in ZIP_EXTENSIONS:
+				self._save_zip(processed, base, tmp_path)
+			else:
+				self._save_tar(processed, base, tmp_path)
+			os.replace(tmp_path, self.output)
+		except BaseException:
+			os.remove(tmp_path)
+			raise
+
+	def _save_zip(self, processed: Dict[str, bytes], base: ArchiveMembers, tmp_path: str) -> None:
+		with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as out:
+			for (member, data, info) in self._entries(processed, base):
+				# Keep the member's timestamp (and other details) if it came
+				# from a zip
+				if not isinstance(info, zipfile.ZipInfo):
+					info = member
+				out.writestr(info, data, zipfile.ZIP_DEFLATED)
+
+	def _save_tar(self, processed: Dict[str, bytes], base: ArchiveMembers, tmp_path: str) -> None:
+		modes = {'.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz', '.tar.bz2': 'w:bz2', '.tar.xz': 'w:xz'}
+		with tarfile.open(tmp_path, modes[archive_extension(self.output)]) as out:
+			for (member, data, info) in self._entries(processed, base):
+				# Keep the member's mode, owner, etc. if it came from a tar
+				if isinstance(info, tarfile.TarInfo):
+					info = copy.copy(info)
+				else:
+					info = tarfile.TarInfo(member)
+					info.mtime = time.time()
+				info.size = len(data)
+				out.addfile(info, io.BytesIO(data))
+
+
+def open_issue(path: str, output: Optional[str]=None):
+	"""
+	Opens the issue at path: an xml folder on disk, or one inside a zip or tar
+	archive (see split_archive_path).
+
+	:param path: path to the issue's xml folder (ending in /), or to an
+				 archive containing a single issue
+	:param output: where to write a processed archive (see ArchiveIssue)
+	:returns: a DirectoryIssue or ArchiveIssue
+	"""
+	(archive, inner) = split_archive_path(path)
+	if archive is None:
+		return DirectoryIssue(path)
+	try:
+		return ArchiveIssue(archive, inner, output)
+	except (zipfile.BadZipFile, tarfile.TarError) as ex:
+		raise ValueError(f'{archive} is not a readable archive ({str(ex)})')
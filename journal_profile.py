@@ -0,0 +1,157 @@
+import os
+from typing import Dict, Optional, Tuple
+from language_packs import get_language_packs
+from rule_packs import RulePackError
+from transforms import header_guard, compile_text_rules
+
+# Folder holding each journal's <code>.config file
+CONFIG_FOLDER = 'config'
+
+
+def bval(b: str) -> bool:
+	'''
+	Converts a string to boolean with custom True-words
+
+	:param b: string to be made into a bool
+	:returns: truth value of the string passed in
+	'''
+	return b.lower() in ['y', 'yes', 'true']
+
+
+class JournalProfile:
+	"""
+	How a journal's issues are preprocessed: the settings of its .config file,
+	along with what is derived from them (its language packs, header tags,
+	header guard and compiled text rules), so they are only worked out once
+	per journal.
+	"""
+
+	def __init__(self, code: str) -> None:
+		self.code = code
+		self.copyright = 'default'
+		self.text_subs = False
+		self.before_newline_count = 0
+		self.after_newline_count = 0
+		self.bold_headers = False
+		self.italic_headers = False
+		self.species_links = False
+		self.split_keywords = True
+		self.fuzzy_species = 0
+		self.language_pack_paths = []
+		self.rule_pack_paths = []
+		self.swap_names = False
+		self.generate_authors = False
+
+		self.language_packs = None
+		self.header_literals = None
+		self.text_rules = None
+
+	def set(self, token: str, value: str) -> None:
+		"""
+		Sets the setting for a token of a .config file.
+
+		:param token: the config token (e.g. TEXTSUBS)
+		:param value: the token's value, as written in the file
+		:raises ValueError: if the token is unknown
+		"""
+		if token == 'COPYRIGHT':
+			self.copyright = value
+		elif token == 'TEXTSUBS':
+			self.text_subs = bval(value)
+		elif token == 'NEWLINESBEFORE':
+			self.before_newline_count = int(value)
+		elif token == 'NEWLINESAFTER':
+			self.after_newline_count = int(value)
+		elif token == 'BOLD':
+			self.bold_headers = bval(value)
+		elif token == 'ITALIC':
+			self.italic_headers = bval(value)
+		elif token == 'SPECIESLINKS':
+			self.species_links = bval(value)
+		elif token == 'SPLITKEYWORDS':
+			self.split_keywords = bval(value)
+		elif token == 'FUZZYSPECIES':
+			self.fuzzy_species = int(value)
+		elif token == 'LANGPACKS':
+			self.language_pack_paths = [p.strip() for p in value.split(',') if p.strip() != '']
+		elif token == 'RULES':
+			self.rule_pack_paths = [p.strip() for p in value.split(',') if p.strip() != '']
+		elif token == 'SWAPNAMES':
+			self.swap_names = bval(value)
+		elif token == 'GENERATEAUTHORS':
+			self.generate_authors = bval(value)
+		else:
+			raise ValueError(f'Unknown token \'{token}\' in file \'{self.code}.config\'')
+
+	def compile(self) -> 'JournalProfile':
+		"""
+		Loads the journal's language packs and works out its header guard, and
+		compiles its text rules (shared with journals using the same rule
+		packs).
+
+		:raises RulePackError: if a rule pack can't be loaded
+		:raises OSError, ValueError: if a language pack can't be loaded
+		:returns: this profile
+		"""
+		self.language_packs = get_language_packs(self.language_pack_paths)
+		self.header_literals = header_guard(self.language_packs)
+		try:
+			self.text_rules = compile_text_rules(self.rule_pack_paths)
+		except OSError as ex:
+			raise RulePackError(str(ex))
+		return self
+
+	def header_tags(self) -> Optional[Tuple[str, str, str]]:
+		"""
+		Returns the (front, special front, back) tags that abstract headers are
+		surrounded with, or None if the journal's headers aren't formatted.
+		"""
+		before = '<br/>' * self.before_newline_count
+		after = '<br/>' * self.after_newline_count
+		if (self.bold_headers and self.italic_headers):
+			return (before + '<b><i>', '<b><i>', '</i></b>' + after)
+		elif self.bold_headers:
+			return (before + '<b>', '<b>', '</b>' + after)
+		elif self.italic_headers:
+			return (before + '<i>', '<i>', '</i>' + after)
+		elif self.before_newline_count > 0:
+			return (before, '', after)
+		return None
+
+	def uses_species_index(self) -> bool:
+		return self.species_links or self.fuzzy_species > 0
+
+
+def read_journal_profile(code: str, root: str='.') -> JournalProfile:
+	"""
+	Reads the .config file of the journal code. The profile isn't compiled.
+
+	:param code: the journal code (e.g. hn)
+	:param root: the folder containing the config folder
+	:raises FileNotFoundError: if the journal has no .config file
+	:raises ValueError: if the file has an unknown token
+	:returns: the journal's profile
+	"""
+	profile = JournalProfile(code)
+	with open(os.path.join(root, CONFIG_FOLDER, f'{code}.config'), 'r') as config_f:
+		for line in config_f.readlines():
+			tokens = [t.strip() for t in line.split('=')]
+			if len(tokens[0]) > 0:
+				profile.set(tokens[0], tokens[1])
+	return profile
+
+
+def load_journal_profiles(root: str='.') -> Dict[str, JournalProfile]:
+	"""
+	Reads and compiles the profile of every journal with a .config file.
+
+	:param root: the folder containing the config folder
+	:raises ValueError, OSError: if a profile can't be read or compiled
+	:returns: dict of journal codes to compiled profiles
+	"""
+	profiles = dict()
+	for filename in sorted(os.listdir(os.path.join(root, CONFIG_FOLDER))):
+		if filename.endswith('.config'):
+			code = filename[:-len('.config')]
+			profiles[code] = read_journal_profile(code, root).compile()
+	return profiles
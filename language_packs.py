@@ -0,0 +1,113 @@
+from typing import List, Dict, Optional
+
+
+class LanguagePack:
+	"""
+	The abstract section headers of one language, plus any substitutions to
+	make after the headers have been formatted. Intro headers are formatted
+	without a preceding linebreak.
+	"""
+
+	def __init__(self, lang: str, intro_headers: List[str], common_headers: List[str],
+				 method_headers: List[str], substitutions: Optional[Dict[str, str]]=None) -> None:
+		self.lang = lang
+		self.intro_headers = intro_headers
+		self.common_headers = common_headers
+		self.method_headers = method_headers
+		self.substitutions = substitutions if substitutions is not None else dict()
+
+	def headers(self) -> List[str]:
+		return self.intro_headers + self.common_headers + self.method_headers
+
+	def merged(self, other: 'LanguagePack') -> 'LanguagePack':
+		"""
+		Returns a new pack with the headers and substitutions of other added
+		after those of this pack.
+		"""
+		substitutions = dict(self.substitutions)
+		substitutions.update(other.substitutions)
+		return LanguagePack(self.lang, self.intro_headers + other.intro_headers,
+							self.common_headers + other.common_headers,
+							self.method_headers + other.method_headers, substitutions)
+
+
+# N.B.: headers are applied in the order listed, so a header that contains
+# another (e.g. 'Aims' contains 'Aim') is only formatted as the first.
+BUILTIN_PACKS = {
+	'en': LanguagePack('en',
+		["background:", "Background:", "Background\n", "Context:", "Introduction:", "Introduction\n", 'BACKGROUND', 'Purpose:'],
+		["materials and methods:", "Materials and methods:", "Materials and Methods:", "Data and methods:", "Data Source &amp; Method:", "Data Source and Methods:",
+		 "result:", "results:",
+		 "Result:", "Results:", "Results\n", "conclusion:",
+		 "conclusions:", "Conclusion:", "Conclusions:",
+		 "Conclusions\n", "Objective:", "Objectives:", 'OBJECTIVES',
+		 "Discussion:", "Discussions:",
+		 "Aim", "Aims", 'FINDINGS', 'Findings:', 'MAIN CONCLUSION', 'MAIN CONCLUSIONS', 'RESULTS'],
+		["methods:", "method:", "Methods:", "Method:", "Method"
+		 "Methods\n", "Methodology:", 'METHODS'],
+		# I know this is a bit of a cheap way to fix the problem of METHODS
+		# getting extra headers applied to it when its in MATERIALS AND
+		# METHODS. But it works for now.
+		{"<br/><b>Materials and \n<br/><b>Methods:</b></b>": "<br/><b>Materials and Methods:</b>",
+		 "<br/><b>Materials and \n<br/><b>methods:</b></b>": "<br/><b>Materials and methods:</b>"}),
+	'es': LanguagePack('es', [],
+		["Antecedente:", "Objetivo:", "M&#233;todos:", "Resultados:", "Conclusiones:"], []),
+	# (French abstracts also use the headers spelled as in English)
+	'fr': LanguagePack('fr', ["Introduction:"],
+		["Objectif:", "Objectifs:", "M&#233;thodologie:", "R&#233;sultats:", "Discussion:", "Conclusion:", "Conclusions:"], []),
+}
+
+def load_language_pack(path: str) -> LanguagePack:
+	"""
+	Reads a language pack file. Each line is one of:
+		LANG=<code>         the lang attribute the pack applies to
+		INTRO=<header>      an intro header (no preceding linebreak)
+		HEADER=<header>     any other section header
+		METHOD=<header>     a methods section header
+		SUB=<old> => <new>  a substitution to make after formatting headers
+	Header and substitution text may use \\n for a newline. Blank lines and
+	lines starting with # are ignored.
+
+	:param path: path to the language pack file
+	:returns: the language pack
+	"""
+	pack = LanguagePack('', [], [], [])
+	with open(path) as f:
+		for line in f.read().splitlines():
+			if len(line.strip()) == 0 or line.startswith('#'):
+				continue
+			(key, value) = line.split('=', 1)
+			(key, value) = (key.strip(), value.strip().replace('\\n', '\n'))
+			if key == 'LANG':
+				pack.lang = value
+			elif key == 'INTRO':
+				pack.intro_headers.append(value)
+			elif key == 'HEADER':
+				pack.common_headers.append(value)
+			elif key == 'METHOD':
+				pack.method_headers.append(value)
+			elif key == 'SUB':
+				(old, new) = value.split(' => ', 1)
+				pack.substitutions[old] = new
+			else:
+				raise ValueError(f'Unknown token \'{key}\' in language pack \'{path}\'')
+
+	if pack.lang == '':
+		raise ValueError(f'Language pack \'{path}\' has no LANG')
+	return pack
+
+
+def get_language_packs(paths: List[str]) -> Dict[str, LanguagePack]:
+	"""
+	Returns the built-in language packs with the packs at paths registered on
+	top of them. A pack for a language that already has one extends it.
+
+	:param paths: paths to extra language pack files
+	:returns: dict mapping lang codes to language packs
+	"""
+	packs = dict(BUILTIN_PACKS)
+	for path in paths:
+		pack = load_language_pack(path)
+		packs[pack.lang] = packs[pack.lang].merged(pack) if pack.lang in packs else pack
+	return packs
+
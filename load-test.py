@@ -0,0 +1,154 @@
+import io
+import os
+import sys
+import json
+import time
+import getopt
+import zipfile
+import threading
+import urllib.error
+import urllib.request
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from colours import colours
+
+USAGE = 'USAGE: python load-test.py -p <PATH> [-u <URL>] [-n <REQUESTS>] [-c <CLIENTS>] [-i]'
+
+DEFAULT_URL = 'http://127.0.0.1:8750'
+
+# Seconds to wait for a response before counting the request as failed
+TIMEOUT_SECONDS = 120
+
+
+def issue_bundle(path: str) -> bytes:
+	"""
+	Returns a zip of the issue whose xml folder is at path, as it would be
+	uploaded (jjvv(n)/xml/*.xml).
+
+	:param path: path to the issue's xml folder (ending in /)
+	:returns: the zip's bytes
+	"""
+	issue_folder = os.path.basename(os.path.dirname(path[:-1]))
+	data = io.BytesIO()
+	with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as bundle:
+		for filename in sorted(os.listdir(path)):
+			if filename.endswith('.xml'):
+				bundle.write(path + filename, f'{issue_folder}/xml/{filename}')
+	return data.getvalue()
+
+
+def build_requests(path: str, issues: bool) -> List[Tuple[str, bytes]]:
+	"""
+	Returns the requests to send, round robin: one per xml file in the folder
+	at path, or the whole issue.
+
+	:param path: path to an issue's xml folder (ending in /)
+	:param issues: True to send the whole issue as a bundle
+	:returns: list of (url path, body) pairs
+	"""
+	if issues:
+		return [('/issue', issue_bundle(path))]
+	requests = []
+	for filename in sorted(os.listdir(path)):
+		if filename.endswith('.xml'):
+			with open(path + filename, 'rb') as f:
+				requests.append((f'/article?filename={filename}', f.read()))
+	return requests
+
+
+def send(url: str, body: bytes) -> Tuple[int, float]:
+	"""
+	POSTs body to url.
+
+	:returns: (HTTP status, or 0 if the request failed outright, seconds taken)
+	"""
+	start = time.perf_counter()
+	request = urllib.request.Request(url, data=body, method='POST')
+	try:
+		with urllib.request.urlopen(request, timeout=TIMEOUT_SECONDS) as response:
+			json.loads(response.read())
+			status = response.status
+	except urllib.error.HTTPError as ex:
+		ex.read()
+		status = ex.code
+	except (urllib.error.URLError, OSError):
+		status = 0
+	return (status, time.perf_counter() - start)
+
+
+def percentile(values: List[float], p: float) -> float:
+	values = sorted(values)
+	if len(values) == 0:
+		return 0.0
+	return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+# Send many requests to a running service.py, from several clients at once,
+# and report its throughput and latency, and how many requests it turned away
+if __name__ == '__main__':
+	path = None
+	url = DEFAULT_URL
+	count = 100
+	clients = 8
+	issues = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'p:u:n:c:i', ['path=', 'url=', 'requests=', 'clients=', 'issues'])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-p', '--path'):
+			path = arg.replace('\\', '/')
+		if opt in ('-u', '--url'):
+			url = arg.rstrip('/')
+		if opt in ('-n', '--requests'):
+			count = int(arg)
+		if opt in ('-c', '--clients'):
+			clients = int(arg)
+		if opt in ('-i', '--issues'):
+			issues = True
+
+	if path is None:
+		print(USAGE)
+		exit(3)
+	if not path.endswith('/'):
+		path += '/'
+
+	requests = build_requests(path, issues)
+	if len(requests) == 0:
+		print(f'{colours.RED}No xml files in {path}{colours.ENDC}')
+		exit(5)
+
+	print(f'{colours.YELLOW}Sending {count} request(s) to {url} from {clients} client(s){colours.ENDC}')
+	results = []
+	lock = threading.Lock()
+
+	def client(i: int) -> None:
+		(endpoint, body) = requests[i % len(requests)]
+		result = send(url + endpoint, body)
+		with lock:
+			results.append(result)
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(clients) as pool:
+		list(pool.map(client, range(count)))
+	elapsed = time.perf_counter() - start
+
+	statuses = dict()
+	for (status, _) in results:
+		statuses[status] = statuses.get(status, 0) + 1
+	latencies = [seconds for (status, seconds) in results if status == 200]
+
+	print(f'\n{len(results)} request(s) in {elapsed:.2f} s ({len(results) / elapsed:.1f} requests/s)')
+	print(f'{len(latencies) / elapsed:.1f} successful requests/s')
+	for status in sorted(statuses):
+		label = 'connection failed' if status == 0 else f'HTTP {status}'
+		colour = colours.GREEN if status == 200 else colours.RED
+		print(f'  {colour}{label}{colours.ENDC}: {statuses[status]}')
+	if len(latencies) > 0:
+		print(f'Latency (ms): p50 {percentile(latencies, 50) * 1000:.1f}, p90 {percentile(latencies, 90) * 1000:.1f}, '
+			  f'p99 {percentile(latencies, 99) * 1000:.1f}, max {max(latencies) * 1000:.1f}')
+
+	# Any failures other than the service turning requests away (503) are errors
+	exit(0 if all(status in (200, 503) for status in statuses) else 1)
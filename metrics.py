@@ -0,0 +1,247 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Prefix of every exported metric
+PREFIX = 'bioline_bulk'
+
+# Seconds between writes of the metrics file (and status lines)
+DEFAULT_INTERVAL = 15
+
+# Number of most recent issues the per-stage moving averages are taken over
+WINDOW = 20
+
+# Outcomes of the files of an issue, by their counter in its run report
+FILE_OUTCOMES = {'processed': 'files_processed', 'skipped': 'files_skipped', 'resumed': 'files_resumed'}
+
+# The queues of an issue's pipeline (see issue_context.process_pipelined), by
+# their summary in its run report
+PIPELINE_QUEUES = {'read': 'read_queue', 'write': 'write_queue'}
+
+
+def format_duration(seconds: Optional[float]) -> str:
+	"""
+	Returns seconds as e.g. 1h02m or 4m05s ('?' if unknown).
+	"""
+	if seconds is None:
+		return '?'
+	seconds = int(seconds)
+	if seconds >= 3600:
+		return f'{seconds // 3600}h{seconds % 3600 // 60:02}m'
+	return f'{seconds // 60}m{seconds % 60:02}s'
+
+
+class BulkMetrics:
+	"""
+	Live counters of a bulk run: issues done, failed and remaining, files by
+	outcome, throughput, an ETA, the moving average time per file of each
+	stage, and how long the stages of the issues' pipelines waited on each
+	other. Issues are counted as they finish, from their run reports.
+
+	Once started, the counters are written every interval seconds to a file in
+	the Prometheus text format (for the node exporter's textfile collector),
+	and/or printed as a one-line status.
+	"""
+
+	def __init__(self, remaining: int, path: Optional[str]=None, status_line: bool=False,
+				 interval: float=DEFAULT_INTERVAL, labels: Optional[Dict[str, str]]=None) -> None:
+		"""
+		:param remaining: number of issues the run has to preprocess
+		:param path: file to write the metrics to (should end in .prom)
+		:param status_line: whether to print a status line every interval
+		:param interval: seconds between writes
+		:param labels: labels to add to every metric (e.g. the worker)
+		"""
+		self.path = path
+		self.status_line = status_line
+		self.interval = interval
+		self.labels = labels if labels is not None else dict()
+
+		self.started = time.time()
+		self.last_progress = self.started
+		self.remaining = remaining
+		self.running = 0
+		self.issues_done = 0
+		self.issues_failed = 0
+		self.files = {outcome: 0 for outcome in FILE_OUTCOMES}
+		self.files_changed = 0
+		self.files_over_budget = 0
+
+		# Seconds spent waiting on each pipeline queue, by (queue, side): put
+		# for the stage before it waiting for space, get for the stage after
+		# it waiting for files. And the most files each queue held.
+		self.queue_seconds = {(queue, side): 0.0 for queue in PIPELINE_QUEUES for side in ('put', 'get')}
+		self.queue_max_depth = {queue: 0 for queue in PIPELINE_QUEUES}
+
+		# (seconds, files processed) of each stage, for the last WINDOW issues
+		self.stages = dict()
+
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._thread = None
+
+	def issue_started(self) -> None:
+		with self._lock:
+			self.running += 1
+
+	def issue_finished(self, code: int, report: Optional[Dict]=None) -> None:
+		"""
+		Counts an issue that finished with exit code code.
+
+		:param code: the exit code of preprocessing the issue
+		:param report: the metrics of the issue's run report, if it has one
+		"""
+		with self._lock:
+			self.running = max(0, self.running - 1)
+			self.remaining = max(0, self.remaining - 1)
+			self.last_progress = time.time()
+			if code == 0:
+				self.issues_done += 1
+			else:
+				self.issues_failed += 1
+			if report is None:
+				return
+
+			for (outcome, counter) in FILE_OUTCOMES.items():
+				self.files[outcome] += report.get(counter, 0)
+			self.files_changed += report.get('files_changed', 0)
+			self.files_over_budget += len(report.get('files_over_budget', dict()))
+			for (queue, key) in PIPELINE_QUEUES.items():
+				summary = report.get('pipeline', dict()).get(key, dict())
+				self.queue_seconds[(queue, 'put')] += summary.get('put_stall_seconds', 0)
+				self.queue_seconds[(queue, 'get')] += summary.get('get_wait_seconds', 0)
+				self.queue_max_depth[queue] = max(self.queue_max_depth[queue], summary.get('max_depth', 0))
+			processed = report.get('files_processed', 0)
+			for (stage, seconds) in report.get('stage_seconds', dict()).items():
+				self.stages.setdefault(stage, deque(maxlen=WINDOW)).append((seconds, processed))
+
+	def set_remaining(self, remaining: int) -> None:
+		# (e.g. when other workers take issues from a shared queue)
+		with self._lock:
+			self.remaining = remaining
+
+	def snapshot(self) -> Dict:
+		"""
+		Returns the current value of every metric.
+		"""
+		with self._lock:
+			now = time.time()
+			elapsed = max(now - self.started, 1e-9)
+			finished = self.issues_done + self.issues_failed
+			stage_averages = dict()
+			for (stage, window) in self.stages.items():
+				files = sum(f for (_, f) in window)
+				if files > 0:
+					stage_averages[stage] = sum(s for (s, _) in window) / files
+			return {
+				'started': self.started,
+				'last_progress': self.last_progress,
+				'elapsed': elapsed,
+				'issues_done': self.issues_done,
+				'issues_failed': self.issues_failed,
+				'issues_running': self.running,
+				'issues_remaining': self.remaining,
+				'files': dict(self.files),
+				'files_changed': self.files_changed,
+				'files_over_budget': self.files_over_budget,
+				'files_per_second': self.files['processed'] / elapsed,
+				'eta': elapsed / finished * self.remaining if finished > 0 else None,
+				'stage_seconds_per_file': stage_averages,
+				'queue_seconds': dict(self.queue_seconds),
+				'queue_max_depth': dict(self.queue_max_depth),
+			}
+
+	def prometheus(self) -> str:
+		"""
+		Returns the metrics in the Prometheus text exposition format.
+		"""
+		snapshot = self.snapshot()
+
+		def labelled(extra: Optional[Dict[str, str]]=None) -> str:
+			labels = dict(self.labels)
+			labels.update(extra or dict())
+			if len(labels) == 0:
+				return ''
+			return '{' + ','.join(f'{k}="{v}"' for (k, v) in labels.items()) + '}'
+
+		metrics: List[Tuple[str, str, str, List[Tuple[Optional[Dict[str, str]], float]]]] = [
+			('issues_done_total', 'counter', 'Issues preprocessed successfully.', [(None, snapshot['issues_done'])]),
+			('issues_failed_total', 'counter', 'Issues that failed to preprocess.', [(None, snapshot['issues_failed'])]),
+			('issues_running', 'gauge', 'Issues being preprocessed.', [(None, snapshot['issues_running'])]),
+			('issues_remaining', 'gauge', 'Issues left to preprocess (including running ones).', [(None, snapshot['issues_remaining'])]),
+			('files_total', 'counter', 'Files by outcome (processed, skipped as already processed, resumed from a checkpoint).',
+				[({'outcome': outcome}, count) for (outcome, count) in snapshot['files'].items()]),
+			('files_changed_total', 'counter', 'Files changed by preprocessing.', [(None, snapshot['files_changed'])]),
+			('files_over_budget_total', 'counter', 'Files with a stage skipped for running out of its time budget.',
+				[(None, snapshot['files_over_budget'])]),
+			('files_per_second', 'gauge', 'Files processed per second since the run started.', [(None, snapshot['files_per_second'])]),
+			('eta_seconds', 'gauge', 'Estimated seconds until the run finishes (-1 if unknown).',
+				[(None, snapshot['eta'] if snapshot['eta'] is not None else -1)]),
+			('stage_seconds_per_file', 'gauge', f'Mean seconds per processed file of each stage, over the last {WINDOW} issues.',
+				[({'stage': stage}, seconds) for (stage, seconds) in sorted(snapshot['stage_seconds_per_file'].items())]),
+			('queue_wait_seconds_total', 'counter', 'Seconds the stages of issue pipelines waited on each queue between them '
+				'(side put: for space, as the next stage fell behind; side get: for files, as the previous stage fell behind).',
+				[({'queue': queue, 'side': side}, seconds) for ((queue, side), seconds) in sorted(snapshot['queue_seconds'].items())]),
+			('queue_max_depth', 'gauge', 'Most files each queue between the stages of an issue pipeline has held.',
+				[({'queue': queue}, depth) for (queue, depth) in sorted(snapshot['queue_max_depth'].items())]),
+			('started_timestamp_seconds', 'gauge', 'When the run started.', [(None, snapshot['started'])]),
+			('last_progress_timestamp_seconds', 'gauge', 'When an issue last finished (or the run started).',
+				[(None, snapshot['last_progress'])]),
+		]
+
+		lines = []
+		for (name, kind, description, samples) in metrics:
+			lines.append(f'# HELP {PREFIX}_{name} {description}')
+			lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+			for (labels, value) in samples:
+				lines.append(f'{PREFIX}_{name}{labelled(labels)} {round(value, 6)}')
+		return '\n'.join(lines) + '\n'
+
+	def status(self) -> str:
+		"""
+		Returns a one-line summary of the run's progress.
+		"""
+		snapshot = self.snapshot()
+		files = snapshot['files']
+		stages = ' '.join(f'{stage} {seconds * 1000:.1f}ms'
+						  for (stage, seconds) in sorted(snapshot['stage_seconds_per_file'].items()))
+		return (f'[bulk] {snapshot["issues_done"] + snapshot["issues_failed"]} done ({snapshot["issues_failed"]} failed), '
+				f'{snapshot["issues_remaining"]} left | {files["processed"]} files, {snapshot["files_per_second"]:.1f}/s, '
+				f'{files["skipped"]} already processed, {files["resumed"]} resumed | ETA {format_duration(snapshot["eta"])}'
+				+ (f' | {stages}' if stages else ''))
+
+	def write(self) -> None:
+		"""
+		Writes the metrics file (replacing it atomically, so the exporter never
+		reads half a file) and prints the status line, as configured.
+		"""
+		if self.path is not None:
+			tmp_path = f'{self.path}.{os.getpid()}.tmp'
+			with open(tmp_path, 'w') as f:
+				f.write(self.prometheus())
+			os.replace(tmp_path, self.path)
+		if self.status_line:
+			print(self.status(), flush=True)
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self.write()
+
+	def start(self) -> None:
+		"""
+		Starts writing the metrics every interval seconds, in the background.
+		"""
+		self.write()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		"""
+		Stops the background writes, writing the final metrics.
+		"""
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+		self.write()
@@ -0,0 +1,206 @@
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+from species_index import SpeciesEntry
+from species_link import get_species_block_spans, remove_species_link, WORD
+
+# Default location of the index, next to the species dictionaries
+INDEX_FILE = './species_occurrences.db'
+
+# Kinds of token: a word (any of which may be a genus), and a pair of
+# adjacent words (any of which may be a full 'genus species' name, or a short
+# 'g species' one)
+WORD_TOKEN = 'w'
+PAIR_TOKEN = 'p'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	size INTEGER NOT NULL,
+	mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+	token TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	file INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	PRIMARY KEY (token, kind, file)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tokens_by_file ON tokens(file);
+CREATE TABLE IF NOT EXISTS names (
+	name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+'''
+
+TAG = re.compile(r'<[^>]*>')
+
+
+def block_tokens(block: str) -> Set[Tuple[str, str]]:
+	"""
+	Returns the tokens of a title/abstract block: each (lowercase) word and
+	pair of adjacent words, as find_species_candidates_batch looks them up in
+	the species index. Species links are removed first, and the words are
+	taken both with and without tags (a name may be split by italics that
+	unlinking drops), so the tokens don't depend on the dictionary the block
+	was linked with.
+
+	:param block: the title/abstract block
+	:returns: set of (token, kind)
+	"""
+	unlinked = remove_species_link(block)
+	tokens = set()
+	for text in (unlinked, TAG.sub('', unlinked)):
+		words = [w.lower() for w in WORD.findall(text)]
+		tokens.update((word, WORD_TOKEN) for word in words)
+		tokens.update((f'{a} {b}', PAIR_TOKEN) for (a, b) in zip(words, words[1:]))
+	return tokens
+
+
+def text_blocks(text: str) -> List[Tuple[int, int]]:
+	"""
+	Returns the spans of the title/abstract blocks of an article, as
+	insertSpeciesLinks splits it.
+	"""
+	offset = text.index('<title')
+	main_body = text[offset:text.rindex('<keyword')]
+	return [(offset + start, offset + end) for (start, end) in get_species_block_spans(main_body)]
+
+
+def entry_name(entry: SpeciesEntry) -> str:
+	"""
+	Returns the name of entry as written in the dictionaries.
+	"""
+	return ('*' if entry.pseudospecies else '') + f'{entry.genus} {entry.species}'
+
+
+def name_tokens(name: str, genus_changed: bool) -> List[Tuple[str, str]]:
+	"""
+	Returns the tokens at least one of which a block must contain for adding
+	(or removing) name to change how the block is linked: its full or short
+	name, or, if its genus is new to (or gone from) the dictionary, the genus
+	on its own, which is italicised wherever it occurs.
+
+	:param name: the species name, as written in the dictionaries
+	:param genus_changed: whether the genus has no other species in one of
+						  the two dictionaries
+	:returns: list of (token, kind)
+	"""
+	(genus, species) = name.lstrip('*').lower().split(' ', 1)
+	tokens = [(f'{genus} {species}', PAIR_TOKEN), (f'{genus[0]} {species}', PAIR_TOKEN)]
+	if genus_changed:
+		tokens.append((genus, WORD_TOKEN))
+	return tokens
+
+
+def changed_names(current: Set[str], linked: Set[str]) -> List[Tuple[str, bool]]:
+	"""
+	Returns the names added to or removed from the dictionaries since the
+	files were linked, and whether each one's genus was added or removed.
+
+	:param current: the names in the current dictionaries
+	:param linked: the names the files were linked with
+	:returns: sorted list of (name, genus changed)
+	"""
+	def genus(name: str) -> str:
+		return name.lstrip('*').split(' ', 1)[0].lower()
+
+	(current_genera, linked_genera) = ({genus(n) for n in current}, {genus(n) for n in linked})
+	return [(name, (genus(name) in current_genera) != (genus(name) in linked_genera))
+			for name in sorted(current ^ linked)]
+
+
+class OccurrenceIndex:
+	"""
+	Persistent index of the words and word pairs in the title/abstract blocks
+	of processed xml files, in a SQLite database. Given the species added to
+	the dictionaries, it finds the files whose links they could change
+	without reading every file again. It also records the dictionary names
+	the indexed files were last linked with.
+	"""
+
+	def __init__(self, path: str=INDEX_FILE) -> None:
+		"""
+		:param path: path to the index's database (created if missing)
+		"""
+		self.path = path
+		self._db = sqlite3.connect(path, timeout=30)
+		self._db.execute('PRAGMA foreign_keys = ON')
+		self._db.executescript(SCHEMA)
+
+	def close(self) -> None:
+		self._db.close()
+
+	def is_current(self, path: str) -> bool:
+		"""
+		Returns True if the file at path is indexed and unchanged since.
+		"""
+		stat = os.stat(path)
+		row = self._db.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+		return row is not None and row == (stat.st_size, stat.st_mtime_ns)
+
+	def add(self, path: str, text: str) -> int:
+		"""
+		Indexes (or reindexes) the file at path, whose contents are text.
+
+		:param path: path to the xml file
+		:param text: contents of the file
+		:returns: the number of distinct tokens in the file
+		"""
+		tokens = set()
+		for (start, end) in text_blocks(text):
+			tokens |= block_tokens(text[start:end])
+
+		stat = os.stat(path)
+		with self._db:
+			self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+			file = self._db.execute('INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)',
+									(path, stat.st_size, stat.st_mtime_ns)).lastrowid
+			self._db.executemany('INSERT INTO tokens (token, kind, file) VALUES (?, ?, ?)',
+								 ((token, kind, file) for (token, kind) in tokens))
+		return len(tokens)
+
+	def remove_missing(self) -> int:
+		"""
+		Forgets indexed files that no longer exist.
+
+		:returns: the number of files forgotten
+		"""
+		missing = [(path,) for (path,) in self._db.execute('SELECT path FROM files') if not os.path.exists(path)]
+		with self._db:
+			self._db.executemany('DELETE FROM files WHERE path = ?', missing)
+		return len(missing)
+
+	def files_with(self, tokens: Iterable[Tuple[str, str]]) -> Dict[str, Set[Tuple[str, str]]]:
+		"""
+		Returns the indexed files containing any of tokens, and which.
+
+		:param tokens: (token, kind) pairs
+		:returns: dict of file paths to the tokens found in them
+		"""
+		found = dict()
+		for (token, kind) in set(tokens):
+			for (path,) in self._db.execute('SELECT files.path FROM tokens JOIN files ON files.id = tokens.file '
+											'WHERE tokens.token = ? AND tokens.kind = ?', (token, kind)):
+				found.setdefault(path, set()).add((token, kind))
+		return found
+
+	def counts(self) -> Tuple[int, int]:
+		"""
+		Returns the number of files and of tokens indexed.
+		"""
+		return (self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0],
+				self._db.execute('SELECT COUNT(*) FROM tokens').fetchone()[0])
+
+	def linked_names(self) -> Set[str]:
+		"""
+		Returns the dictionary names (as entry_name gives them) the indexed
+		files were last linked with, or an empty set if none were recorded.
+		"""
+		return {name for (name,) in self._db.execute('SELECT name FROM names')}
+
+	def set_linked_names(self, names: Iterable[str]) -> None:
+		with self._db:
+			self._db.execute('DELETE FROM names')
+			self._db.executemany('INSERT OR IGNORE INTO names (name) VALUES (?)', ((name,) for name in names))
+
@@ -0,0 +1,153 @@
+import time
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+from article import process_article
+from journal_profile import JournalProfile
+from report import RunReport
+from species_index import get_species_index
+from stages import StageMonitor
+
+# Default number of processes files are transformed in (1 transforms them on
+# the thread preprocessing the issue), and of files each queue between the
+# stages of the pipeline holds
+WORKERS = 1
+QUEUE_DEPTH = 8
+
+# Number of transformed files whose species are linked together (linking
+# files together is faster than one at a time, but the writer waits for the
+# whole batch)
+LINK_BATCH = 16
+
+# Seconds a blocked put or get waits before checking whether the queue was
+# closed (e.g. because the stage at its other end failed)
+POLL_SECONDS = 0.1
+
+
+class QueueClosed(Exception):
+	"""
+	A put or get on a stage queue that was closed.
+	"""
+
+
+class StageQueue:
+	"""
+	A bounded queue between two stages of the pipeline. A stage putting into
+	a full queue waits for the next stage to catch up (backpressure), so at
+	most depth files are ever held between two stages. It measures how long
+	each side waited, and how many files it held.
+	"""
+
+	def __init__(self, name: str, depth: int) -> None:
+		"""
+		:param name: name of the queue (for the run report)
+		:param depth: the most items the queue holds
+		"""
+		self.name = name
+		self.depth = depth
+		self._queue = queue.Queue(depth)
+		self._closed = threading.Event()
+
+		# Seconds the producer waited for space (the consumer was slower) and
+		# the consumer waited for items (the producer was slower)
+		self.put_stall_seconds = 0.0
+		self.get_wait_seconds = 0.0
+		self.max_depth = 0
+		self._depths = 0
+		self._puts = 0
+
+	def close(self) -> None:
+		"""
+		Closes the queue, so any put or get raises QueueClosed from now on.
+		"""
+		self._closed.set()
+
+	def put(self, item) -> None:
+		"""
+		Adds item to the queue, waiting while it is full.
+
+		:raises QueueClosed: if the queue is (or gets) closed
+		"""
+		try:
+			self._queue.put_nowait(item)
+		except queue.Full:
+			started = time.perf_counter()
+			self._wait(lambda: self._queue.put(item, timeout=POLL_SECONDS), queue.Full)
+			self.put_stall_seconds += time.perf_counter() - started
+
+		depth = self._queue.qsize()
+		self.max_depth = max(self.max_depth, depth)
+		self._depths += depth
+		self._puts += 1
+
+	def get(self):
+		"""
+		Removes and returns the next item of the queue, waiting while it is
+		empty.
+
+		:raises QueueClosed: if the queue is (or gets) closed
+		"""
+		try:
+			return self._queue.get_nowait()
+		except queue.Empty:
+			started = time.perf_counter()
+			item = self._wait(lambda: self._queue.get(timeout=POLL_SECONDS), queue.Empty)
+			self.get_wait_seconds += time.perf_counter() - started
+			return item
+
+	def _wait(self, attempt, retry):
+		# Repeats attempt until it doesn't raise retry, or the queue is closed
+		while True:
+			if self._closed.is_set():
+				raise QueueClosed(self.name)
+			try:
+				return attempt()
+			except retry:
+				pass
+
+	def summary(self) -> Dict:
+		# For run reports
+		return {'depth': self.depth, 'max_depth': self.max_depth,
+				'mean_depth': round(self._depths / self._puts, 3) if self._puts > 0 else 0,
+				'put_stall_seconds': round(self.put_stall_seconds, 6), 'get_wait_seconds': round(self.get_wait_seconds, 6)}
+
+
+# What each transform process needs to transform the files of an issue, set
+# once when the process starts (see init_worker)
+_worker = dict()
+
+
+def init_worker(profile: JournalProfile, year: str, stage_budget: Optional[float], file_budget: Optional[float]) -> None:
+	"""
+	Prepares a transform process for the files of an issue (as the
+	initializer of its process pool).
+
+	:param profile: the (compiled) profile of the issue's journal
+	:param year: the year of the issue
+	:param stage_budget: seconds each stage may take on a file
+	:param file_budget: seconds the stages of a file may take together
+	"""
+	_worker['profile'] = profile
+	_worker['year'] = year
+	_worker['budgets'] = (stage_budget, file_budget)
+	_worker['species_index'] = get_species_index() if profile.uses_species_index() else None
+
+
+def transform_in_worker(filename: str, original: str) -> Tuple[str, List[str], Dict]:
+	"""
+	Runs process_article on a file in a transform process. The file's stages
+	are measured by a monitor of its own, whose results the issue's monitor
+	adds to its own (see StageMonitor.merge).
+
+	:param filename: name of the xml file
+	:param original: contents of the xml file
+	:returns: the processed contents of the file, its notes, and the metrics
+			  of its monitor
+	"""
+	report = RunReport()
+	monitor = StageMonitor(report, False, *_worker['budgets'])
+	monitor.begin_file(filename)
+	notes = []
+	body = process_article(filename, original, _worker['profile'], _worker['year'], monitor, notes,
+						   _worker['species_index'])
+	return (body, notes, report.metrics)
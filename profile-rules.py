@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import getopt
+from colours import colours
+from report import RunReport
+from rule_profile import RuleProfile
+from language_packs import get_language_packs
+from transforms import surround_headers, contains_any, header_guard, compile_text_rules
+
+USAGE = 'USAGE: python profile-rules.py (-p <PATH> | -f <FILE>) [-l <LANGPACK>] [-u <RULES>] [-n <REPEAT>] [-t <TOP>] [-r <REPORT>]'
+
+# Headers are formatted as for a journal with bold headers and one linebreak
+# before each, so the substitutions that rely on those tags are exercised
+HEADER_TAGS = ('<br/><b>', '<b>', '</b>')
+
+
+def read_corpus(paths: list) -> list:
+	"""
+	Returns the contents of every xml file in the folders at paths.
+
+	:param paths: paths to folders of xml files
+	:returns: list of (filename, contents) pairs
+	"""
+	corpus = []
+	for path in paths:
+		path = path.replace('\\', '/')
+		if not path.endswith('/'):
+			path += '/'
+		for filename in sorted(os.listdir(path)):
+			if filename.endswith('.xml'):
+				with open(path + filename) as f:
+					corpus.append((filename, f.read()))
+	return corpus
+
+
+# Measure the cost of each text substitution and header rule over a corpus of
+# xml files, as preprocess.py would apply them (headers, then text subs, each
+# skipped for files its prefilter rules out). Nothing is written back to the
+# files.
+if __name__ == '__main__':
+	paths = []
+	pack_paths = []
+	rule_paths = []
+	repeat = 1
+	top = None
+	report_path = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'p:f:l:u:n:t:r:', ['path=', 'file=', 'langpack=', 'rules=', 'repeat=', 'top=',
+																 'report='])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-p', '--path'):
+			paths.append(arg)
+		if opt in ('-f', '--file'):
+			with open(arg) as f:
+				paths += [line.strip() for line in f.readlines() if line.strip() != '']
+		if opt in ('-l', '--langpack'):
+			pack_paths.append(arg)
+		if opt in ('-u', '--rules'):
+			rule_paths.append(arg)
+		if opt in ('-n', '--repeat'):
+			repeat = int(arg)
+		if opt in ('-t', '--top'):
+			top = int(arg)
+		if opt in ('-r', '--report'):
+			report_path = arg.replace('\\', '/')
+
+	if len(paths) == 0:
+		print(USAGE)
+		exit(3)
+
+	try:
+		packs = get_language_packs(pack_paths)
+	except (OSError, ValueError) as ex:
+		print(f'{colours.RED}LANGUAGE PACK ERROR (ERR 004):{colours.ENDC} {str(ex)}')
+		exit(4)
+
+	try:
+		text_rules = compile_text_rules(rule_paths)
+	except (OSError, ValueError) as ex:
+		print(f'{colours.RED}RULE PACK ERROR (ERR 007):{colours.ENDC} {str(ex)}')
+		exit(7)
+	if len(rule_paths) > 0:
+		print(f'Compiled {len(text_rules.rules)} text rules in {text_rules.compile_seconds * 1000:.2f} ms')
+
+	corpus = read_corpus(paths)
+	print(f'{colours.YELLOW}Profiling rules over {len(corpus)} file(s), {repeat} time(s) each{colours.ENDC}\n')
+
+	report = RunReport(report_path)
+	profile = RuleProfile()
+	header_literals = header_guard(packs)
+	start = time.perf_counter()
+	for _ in range(repeat):
+		for (filename, text) in corpus:
+			ran = contains_any(text, header_literals)
+			profile.stage('headers', ran)
+			if ran:
+				text = surround_headers(text, *HEADER_TAGS, packs, profile)
+			ran = text_rules.prefilter(text)
+			profile.stage('textsubs', ran)
+			if ran:
+				text_rules.apply(text, profile)
+	elapsed = time.perf_counter() - start
+
+	rules = profile.slowest()
+	total = sum(stats.seconds for stats in rules)
+	print(f'{"ms":>9} {"%":>5} {"matches":>8} {"replaced":>8} {"skipped":>8} {"MB":>8}  {"kind":10} rule')
+	for stats in rules[:top]:
+		name = stats.name.replace('\n', '\\n')
+		share = 100 * stats.seconds / total if total > 0 else 0
+		print(f'{stats.seconds * 1000:9.2f} {share:5.1f} {stats.matches:8} {stats.replacements:8} {stats.skipped:8} '
+			  f'{stats.bytes / 1e6:8.2f}  {stats.kind:10} {name}')
+	print(f'\n{colours.GREEN}{len(rules)} rules took {total * 1000:.2f} ms '
+		  f'({elapsed * 1000:.2f} ms including profiling){colours.ENDC}')
+
+	# Rules that never matched are candidates for pruning
+	unmatched = [stats for stats in rules if stats.matches == 0]
+	if len(unmatched) > 0:
+		print(f'{colours.YELLOW}{len(unmatched)} rule(s) never matched{colours.ENDC}')
+
+	# How often each stage's prefilter let it be skipped
+	print()
+	for (stage, counts) in profile.stages.items():
+		files = counts['ran'] + counts['skipped']
+		print(f'{stage}: skipped for {counts["skipped"]} of {files} file(s) ({100 * counts["skipped"] / files:.1f}%)')
+
+	if report_path is not None:
+		report.set('rule_profile_files', len(corpus) * repeat)
+		report.set('rule_profile', profile.as_list())
+		report.set('rule_profile_stages', profile.stages)
+		report.set('text_rules', text_rules.summary())
+		report.write()
@@ -0,0 +1,76 @@
+import re
+from typing import List, Optional, Sequence, Tuple
+
+# The regions of an article text transforms may apply to: the text inside its
+# <title>, <abstract> and <keyword> elements. Everything else (the <article>
+# tag, authors, <index>, <copyright>, and the tags themselves) is metadata no
+# transform should touch.
+TITLE = 'title'
+ABSTRACT = 'abstract'
+KEYWORD = 'keyword'
+REGIONS = (TITLE, ABSTRACT, KEYWORD)
+
+REGION_OPEN = re.compile(r'<(title|abstract|keyword)( [^>]*)?>')
+LANG = re.compile(r' lang="([^"]*)"')
+
+# A region: the span of the text inside the element, the region, and the
+# element's lang attribute (None if it has none)
+Region = Tuple[int, int, str, Optional[str]]
+
+
+def find_regions(text: str) -> List[Region]:
+	"""
+	Returns the span, region and language of the text inside every <title>,
+	<abstract> and <keyword> element in text.
+
+	:param text: the text to search
+	:returns: list of (start, end, region, lang) tuples, in order
+	"""
+	regions = []
+	match = REGION_OPEN.search(text)
+	while match is not None:
+		position = match.end()
+		# (an empty element, <keyword lang="en"/>, has no text)
+		if not match.group(0).endswith('/>'):
+			close = text.find('</' + match.group(1) + '>', match.end())
+			if close == -1:
+				break
+			lang = LANG.search(match.group(2) or '')
+			regions.append((match.end(), close, match.group(1), lang.group(1) if lang is not None else None))
+			position = close
+		match = REGION_OPEN.search(text, position)
+	return regions
+
+
+def parse_regions(value: str) -> Tuple[str, ...]:
+	"""
+	Returns the regions in a comma-separated list (e.g. 'title, abstract').
+
+	:param value: the list of regions
+	:raises ValueError: if one of them isn't a region
+	:returns: tuple of regions
+	"""
+	regions = tuple(r.strip().lower() for r in value.split(',') if r.strip() != '')
+	for region in regions:
+		if region not in REGIONS:
+			raise ValueError(f'Unknown region \'{region}\' (one of {", ".join(REGIONS)})')
+	return regions
+
+
+def replace_regions(text: str, regions: Sequence[Region], texts: Sequence[str]) -> str:
+	"""
+	Returns text with the text of each of regions (see find_regions) replaced
+	by the text at the same position in texts. The rest of text is kept as is.
+
+	:param text: the text the regions were found in
+	:param regions: the regions to replace the text of
+	:param texts: the new text of each region
+	:returns: the new text
+	"""
+	pieces = []
+	position = 0
+	for ((start, end, _, _), new) in zip(regions, texts):
+		pieces += [text[position:start], new]
+		position = end
+	pieces.append(text[position:])
+	return ''.join(pieces)
@@ -0,0 +1,104 @@
+import os
+import sys
+import getopt
+from colours import colours
+from typing import Set
+from species_index import get_species_index, read_dictionaries
+from species_link import find_species_links, validate_species_link, unlink_species, insert_species_links_batch
+
+USAGE = 'USAGE: python relink.py (-p <PATH> | -f <FILE>) [-o <DICTIONARY>] [-d]'
+
+
+def relink_folder(path: str, removed: Set[str], dry_run: bool) -> int:
+	"""
+	Relinks the species in every already processed xml file in the folder at
+	path, reporting any invalid species links found along the way.
+
+	:param path: path to a folder of xml files
+	:param removed: names removed from the dictionaries since the files were
+					linked (see species_link.unlink_species)
+	:param dry_run: if True, report what would change without writing
+	:returns: the number of files that were (or would be) changed
+	"""
+	index = get_species_index()
+
+	# Files are unlinked one by one, then linked again together
+	files = []
+	for filename in sorted(os.listdir(path)):
+		if not filename.endswith('.xml'):
+			continue
+
+		with open(path + filename) as f:
+			body = f.read()
+
+		# Files that haven't been preprocessed yet are linked by preprocess.py
+		if body.lstrip().startswith('<article id="' + filename[0:2] + 'xxx"'):
+			continue
+
+		for link in find_species_links(body):
+			for problem in validate_species_link(link):
+				print(f'{colours.RED}INVALID LINK:{colours.ENDC} {filename}: {problem}')
+
+		if '<title' not in body or '<keyword' not in body:
+			print(f'{colours.YELLOW}Skipping {filename}:{colours.ENDC} no <title>, <abstract>, or <keyword> tags')
+			continue
+		files.append((filename, body, unlink_species(body, index, removed)))
+
+	relinked_files = insert_species_links_batch([unlinked for (_, _, unlinked) in files], index)
+
+	changed = 0
+	for ((filename, body, _), relinked) in zip(files, relinked_files):
+		if relinked != body:
+			changed += 1
+			print(('Would relink ' if dry_run else 'Relinking ') + filename + '...')
+			if not dry_run:
+				with open(path + filename, 'w') as f:
+					f.write(relinked)
+	return changed
+
+
+# Strip and reinsert the species links of already processed issues, e.g.
+# after common_species.txt has been updated
+if __name__ == '__main__':
+	paths = []
+	previous = None
+	dry_run = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'p:f:o:d', ['path=', 'file=', 'old-dictionary=', 'dry-run'])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-p', '--path'):
+			paths.append(arg)
+		if opt in ('-f', '--file'):
+			with open(arg) as f:
+				paths += [line.strip() for line in f.readlines() if line.strip() != '']
+		if opt in ('-o', '--old-dictionary'):
+			previous = arg
+		if opt in ('-d', '--dry-run'):
+			dry_run = True
+
+	if len(paths) == 0:
+		print(USAGE)
+		exit(3)
+
+	# Names only in the dictionary the files were linked with lose their
+	# italics too
+	removed = set()
+	if previous is not None:
+		current = {(entry.genus, entry.species) for entry in get_species_index().entries()}
+		removed = {f'{entry.genus} {entry.species}' for entry in read_dictionaries([previous])
+				   if (entry.genus, entry.species) not in current}
+
+	total = 0
+	for path in paths:
+		path = path.replace('\\', '/')
+		if not path.endswith('/'):
+			path += '/'
+		print('--------------------------------')
+		print(f'{colours.YELLOW}Relinking species in {path}{colours.ENDC}')
+		total += relink_folder(path, removed, dry_run)
+
+	print(f'\n{colours.GREEN}{"Would relink" if dry_run else "Relinked"} {total} file(s){colours.ENDC}')
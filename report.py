@@ -0,0 +1,58 @@
+import json
+import time
+import threading
+from typing import Optional, Union, Dict
+
+Metric = Union[str, int, float, bool, list, dict, None]
+
+# Reports of issues preprocessed on threads are written one at a time
+_write_lock = threading.Lock()
+
+
+class RunReport:
+	"""
+	Collects the metrics of one preprocessing run (one issue) and appends them
+	to a report file as a single JSON line, so that many runs (e.g. a whole
+	bulk run) can share one report file.
+	"""
+
+	def __init__(self, path: Optional[str]=None) -> None:
+		self.path = path
+		self.metrics = {'started': time.strftime('%Y-%m-%dT%H:%M:%S')}
+		self._start = time.perf_counter()
+
+	def set(self, key: str, value: Metric) -> None:
+		"""
+		Records the metric key, replacing any previous value.
+
+		:param key: name of the metric
+		:param value: value of the metric (must be JSON serialisable)
+		"""
+		self.metrics[key] = value
+
+	def add(self, key: str, amount: Union[int, float]=1) -> None:
+		"""
+		Adds amount to the counter key (starting from 0).
+
+		:param key: name of the counter
+		:param amount: amount to add to the counter
+		"""
+		self.metrics[key] = self.metrics.get(key, 0) + amount
+
+	def section(self, key: str) -> Dict[str, Metric]:
+		"""
+		Returns the nested group of metrics named key, creating it if needed.
+
+		:param key: name of the group
+		:returns: dict of the metrics in the group
+		"""
+		return self.metrics.setdefault(key, dict())
+
+	def write(self) -> None:
+		"""
+		Appends the report to the report file (if there is one).
+		"""
+		self.metrics['seconds'] = round(time.perf_counter() - self._start, 3)
+		if self.path is not None:
+			with _write_lock, open(self.path, 'a') as f:
+				f.write(json.dumps(self.metrics) + '\n')
@@ -0,0 +1,87 @@
+import re
+from typing import List, Optional, Tuple
+from regions import REGIONS, parse_regions
+
+
+class RulePackError(ValueError):
+	"""
+	A rule pack that can't be loaded or compiled.
+	"""
+
+
+class RulePack:
+	"""
+	Text substitution rules for journals whose disciplines need more than the
+	built-in ones (see transforms.TXT_SUBSTITUTIONS), applied in order after
+	them. Each rule is a literal substitution, or a regex one with an
+	optional guard: literals at least one of which any match must contain.
+	Each applies to the text of its regions only (see regions.py).
+	"""
+
+	def __init__(self, name: str) -> None:
+		self.name = name
+		# (kind, old, new, guard, regions): kind is LITERAL or REGEX, guard is
+		# None (always search) or a tuple of literals, and regions the regions
+		# the rule applies to
+		self.rules: List[Tuple[str, str, str, Optional[Tuple[str, ...]], Tuple[str, ...]]] = []
+
+	def __len__(self) -> int:
+		return len(self.rules)
+
+
+def load_rule_pack(path: str) -> RulePack:
+	"""
+	Reads a rule pack file. Each line is one of:
+		LITERAL=<old> => <new>        replace every occurrence of old
+		REGEX=<pattern> => <repl>     replace every match of pattern (repl may
+		                              refer to groups as \\1 etc.)
+		GUARD=<literal>[, <literal>]  only search for the preceding REGEX in
+		                              text containing one of these literals
+		REGIONS=<region>[, <region>]  only apply the preceding rule to these of
+		                              title, abstract and keyword (by default,
+		                              rules apply to all three)
+	Text may use \\n for a newline. Blank lines and lines starting with # are
+	ignored. Rules are applied in the order listed.
+
+	:param path: path to the rule pack file
+	:raises RulePackError: if the file has an unknown token or region, or a
+						   pattern that isn't a valid regex
+	:returns: the rule pack
+	"""
+	pack = RulePack(path)
+	with open(path) as f:
+		for (number, line) in enumerate(f.read().splitlines(), 1):
+			if len(line.strip()) == 0 or line.startswith('#'):
+				continue
+			(key, value) = line.split('=', 1) if '=' in line else (line, '')
+			(key, value) = (key.strip(), value.strip().replace('\\n', '\n'))
+			if key in ('LITERAL', 'REGEX'):
+				if ' => ' not in value:
+					raise RulePackError(f'{key} without \' => \' on line {number} of rule pack \'{path}\'')
+				(old, new) = value.split(' => ', 1)
+				if key == 'REGEX':
+					try:
+						re.compile(old)
+					except re.error as ex:
+						raise RulePackError(f'Invalid regex on line {number} of rule pack \'{path}\': {str(ex)}')
+				pack.rules.append((key, old, new, None, REGIONS))
+			elif key == 'GUARD':
+				if len(pack.rules) == 0 or pack.rules[-1][0] != 'REGEX':
+					raise RulePackError(f'GUARD on line {number} of rule pack \'{path}\' doesn\'t follow a REGEX')
+				guard = tuple(g.strip() for g in value.split(',') if g.strip() != '')
+				(kind, old, new, _, regions) = pack.rules[-1]
+				pack.rules[-1] = (kind, old, new, guard, regions)
+			elif key == 'REGIONS':
+				if len(pack.rules) == 0:
+					raise RulePackError(f'REGIONS on line {number} of rule pack \'{path}\' doesn\'t follow a rule')
+				try:
+					regions = parse_regions(value)
+				except ValueError as ex:
+					raise RulePackError(f'{str(ex)} on line {number} of rule pack \'{path}\'')
+				if len(regions) == 0:
+					raise RulePackError(f'REGIONS without a region on line {number} of rule pack \'{path}\'')
+				(kind, old, new, guard, _) = pack.rules[-1]
+				pack.rules[-1] = (kind, old, new, guard, regions)
+			else:
+				raise RulePackError(f'Unknown token \'{key}\' in rule pack \'{path}\'')
+	return pack
@@ -0,0 +1,118 @@
+import re
+import time
+from typing import Dict, List
+
+
+class RuleStats:
+	"""
+	The cost of one rule, summed over every text it was applied to.
+	"""
+
+	def __init__(self, kind: str, name: str) -> None:
+		self.kind = kind
+		self.name = name
+		self.calls = 0
+		self.skipped = 0
+		self.seconds = 0.0
+		self.matches = 0
+		self.replacements = 0
+		self.bytes = 0
+
+	def as_dict(self) -> Dict:
+		return {'kind': self.kind, 'rule': self.name, 'calls': self.calls, 'skipped': self.skipped, 'seconds': self.seconds,
+				'matches': self.matches, 'replacements': self.replacements, 'bytes': self.bytes}
+
+
+class RuleProfile:
+	"""
+	Measures each rule applied by the text transforms (see transforms.py):
+	the time spent applying it, how often it matched, how many of those
+	matches were replaced, and how many bytes it scanned. Only the rule
+	itself is timed; counting its matches is done outside the timer.
+
+	It also counts how often each rule was skipped by its guard, and how often
+	each stage was skipped by its prefilter.
+	"""
+
+	def __init__(self) -> None:
+		self.rules = dict()
+		self.stages = dict()
+
+	def _stats(self, kind: str, name: str) -> RuleStats:
+		key = (kind, name)
+		if key not in self.rules:
+			self.rules[key] = RuleStats(kind, name)
+		return self.rules[key]
+
+	def literal(self, kind: str, name: str, text: str, old: str, new: str) -> str:
+		"""
+		Returns text.replace(old, new), measured as the rule name.
+
+		:param kind: the kind of rule (literal, header, ...)
+		:param name: the name of the rule
+		:param text: the text to apply the rule to
+		:param old: the text to replace
+		:param new: the replacement
+		:returns: text with the rule applied
+		"""
+		start = time.perf_counter()
+		result = text.replace(old, new)
+		elapsed = time.perf_counter() - start
+
+		stats = self._stats(kind, name)
+		matches = text.count(old)
+		stats.calls += 1
+		stats.seconds += elapsed
+		stats.matches += matches
+		stats.replacements += matches
+		stats.bytes += len(text.encode('utf-8'))
+		return result
+
+	def regex(self, kind: str, name: str, text: str, pattern: re.Pattern, repl: str, count: int=0) -> str:
+		"""
+		Returns pattern.sub(repl, text, count), measured as the rule name.
+
+		:param kind: the kind of rule (regex, ...)
+		:param name: the name of the rule
+		:param text: the text to apply the rule to
+		:param pattern: the compiled pattern to replace
+		:param repl: the replacement
+		:param count: the maximum number of replacements (0 for all)
+		:returns: text with the rule applied
+		"""
+		start = time.perf_counter()
+		(result, replacements) = pattern.subn(repl, text, count)
+		elapsed = time.perf_counter() - start
+
+		stats = self._stats(kind, name)
+		stats.calls += 1
+		stats.seconds += elapsed
+		stats.matches += sum(1 for _ in pattern.finditer(text))
+		stats.replacements += replacements
+		stats.bytes += len(text.encode('utf-8'))
+		return result
+
+	def skipped(self, kind: str, name: str) -> None:
+		"""
+		Records that the rule name was skipped (by its guard).
+		"""
+		self._stats(kind, name).skipped += 1
+
+	def stage(self, stage: str, ran: bool) -> None:
+		"""
+		Records whether stage ran or was skipped by its prefilter.
+		"""
+		counts = self.stages.setdefault(stage, {'ran': 0, 'skipped': 0})
+		counts['ran' if ran else 'skipped'] += 1
+
+	def slowest(self) -> List[RuleStats]:
+		"""
+		Returns the stats of every rule, most time spent first.
+		"""
+		return sorted(self.rules.values(), key=lambda s: s.seconds, reverse=True)
+
+	def as_list(self) -> List[Dict]:
+		"""
+		Returns the stats of every rule (slowest first) for a run report.
+		"""
+		return [stats.as_dict() for stats in self.slowest()]
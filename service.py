@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import signal
+import getopt
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Optional, Tuple
+from article import DISCREPANCY_TYPES
+from issue_context import IssueContext, process_pipelined
+from issue_io import MemoryIssue, open_issue, extract_implicit_info, year_of, ISSUE_PATH
+from journal_profile import JournalProfile, load_journal_profiles
+from species_index import get_species_index
+from report import RunReport
+from colours import colours
+
+USAGE = 'USAGE: python service.py [-H <HOST>] [-P <PORT>] [-c <CONCURRENCY>] [-r <REPORT>] [-v]'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+
+# Requests processed at once. Requests beyond this are turned away with a 503
+# (and a Retry-After) rather than queued, so a burst of uploads can't pile up
+# work faster than it is done.
+DEFAULT_CONCURRENCY = 4
+RETRY_AFTER_SECONDS = 1
+
+# Largest request body accepted (a whole issue bundle)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+def quiet(message: str) -> None:
+	# Requests don't print their progress
+	pass
+
+
+class ServiceError(Exception):
+	"""
+	A request that can't be processed, with the HTTP status to answer it with.
+	"""
+
+	def __init__(self, status: int, message: str) -> None:
+		super().__init__(message)
+		self.status = status
+
+
+class PreprocessService:
+	"""
+	Preprocesses articles and issues sent over HTTP (see PreprocessHandler).
+	Requests are processed in a pool of worker processes, one at a time on
+	each worker's main thread, so their stages are interrupted when they run
+	out of their time budget (see stages.time_limit) rather than blocking
+	the worker. Everything a request needs that doesn't depend on it (the
+	journal profiles, their language packs, and the species index) is loaded
+	once by each worker, when the service starts, and shared by its
+	requests. Nothing is written to disk: the processed xml is returned
+	instead.
+	"""
+
+	def __init__(self, root: str='.', concurrency: int=DEFAULT_CONCURRENCY, report_path: Optional[str]=None,
+				 pooled: bool=True) -> None:
+		"""
+		:param root: the folder containing the project files
+		:param concurrency: the number of requests processed at once
+		:param report_path: file to append a run report for each request to
+		:param pooled: whether to process requests in worker processes (if
+					   False, they are processed in this one; see run)
+		"""
+		self.root = root
+		self.profiles = load_journal_profiles(root)
+		self.species_index = None
+		if any(profile.uses_species_index() for profile in self.profiles.values()):
+			self.species_index = get_species_index(root)
+			if not pooled:
+				self.species_index.name_words()
+
+		self.concurrency = concurrency
+		self.report_path = report_path
+		self._slots = threading.BoundedSemaphore(concurrency)
+		self._lock = threading.Lock()
+		self.counters = {'active': 0, 'requests': 0, 'rejected': 0, 'failed': 0}
+		self._pool = self.start_pool() if pooled else None
+		self._pool_lock = threading.Lock()
+
+	def start_pool(self) -> ProcessPoolExecutor:
+		"""
+		Starts the worker processes, one per processing slot, and waits until
+		each has loaded what requests need. They are started afresh (not
+		forked from the service, whose other threads may hold locks).
+		"""
+		pool = ProcessPoolExecutor(self.concurrency, mp_context=multiprocessing.get_context('spawn'),
+								   initializer=init_request_worker, initargs=(self.root,))
+		list(pool.map(worker_ready, range(self.concurrency)))
+		return pool
+
+	def close(self) -> None:
+		if self._pool is not None:
+			self._pool.shutdown(cancel_futures=True)
+
+	def count(self, counter: str, amount: int=1) -> None:
+		with self._lock:
+			self.counters[counter] += amount
+
+	def acquire(self) -> bool:
+		"""
+		Takes one of the service's processing slots, if one is free.
+
+		:returns: False if the service is at its concurrency limit
+		"""
+		if not self._slots.acquire(blocking=False):
+			self.count('rejected')
+			return False
+		self.count('active')
+		self.count('requests')
+		return True
+
+	def release(self) -> None:
+		self.count('active', -1)
+		self._slots.release()
+
+	def status(self) -> Dict:
+		"""
+		Returns the service's status (for GET /health).
+		"""
+		with self._lock:
+			counters = dict(self.counters)
+		counters['concurrency'] = self.concurrency
+		counters['journals'] = sorted(self.profiles)
+		if self.species_index is not None:
+			counters['species_dictionary'] = self.species_index.content_hash
+		return counters
+
+	def profile(self, code: Optional[str]) -> JournalProfile:
+		if code is None or code.lower() not in self.profiles:
+			raise ServiceError(404, f'No configuration for journal \'{code}\'')
+		return self.profiles[code.lower()]
+
+	def process(self, ctx: IssueContext, profile: JournalProfile) -> Dict:
+		"""
+		Preprocesses the files of an issue through the same pipeline as
+		preprocess.py (see issue_context.process_pipelined), without fixing
+		discrepancies. The issue is held in memory, or is an archive that is
+		never saved, so the processed files are only written to it.
+
+		:param ctx: the context of the issue (whose volume and number may be
+					None to skip checking them)
+		:param profile: the profile of the issue's journal
+		:returns: the response: each file's processed xml and notes, and the
+				  files with discrepancies
+		"""
+		ctx.use_profile(profile)
+		filenames = ctx.issue.names()
+		originals = {filename: ctx.issue.read(filename) for filename in filenames}
+		process_pipelined(ctx, filenames)
+		ctx.monitor.finish()
+
+		processed = set(ctx.written)
+		files = []
+		for filename in filenames:
+			body = ctx.issue.read(filename)
+			files.append({'filename': filename, 'processed': filename in processed, 'changed': body != originals[filename],
+						  'notes': ctx.file_to_notes.get(filename, []), 'xml': body})
+
+		discrepancies = dict()
+		for disc_type in DISCREPANCY_TYPES:
+			if ctx.expected()[disc_type] is not None and len(ctx.discrepancies(disc_type)) > 0:
+				discrepancies[disc_type] = ctx.discrepancies(disc_type)
+		return {'journal': profile.code, 'files': files, 'discrepancies': discrepancies,
+				'stage_changes': ctx.monitor.stage_changes, 'over_budget': ctx.monitor.over_budget}
+
+	def article(self, query: Dict[str, str], body: bytes, report: RunReport) -> Dict:
+		"""
+		Preprocesses one article (POST /article?filename=...). Its journal is
+		the journal query parameter, or else the start of its filename; volume,
+		number and year parameters, if given, are checked against the
+		article's.
+		"""
+		filename = query.get('filename')
+		if filename is None or not filename.endswith('.xml'):
+			raise ServiceError(400, 'The filename parameter (e.g. hn19001.xml) is required')
+		profile = self.profile(query.get('journal', filename[0:2]))
+		try:
+			year = query['year'] if 'year' in query else year_of(filename)
+		except ValueError:
+			raise ServiceError(400, f'No year in filename {filename}; give the year parameter')
+
+		report.set('issue', filename)
+		issue = MemoryIssue(f'/upload/{profile.code}/xml/', {filename: body.decode('utf-8')})
+		ctx = IssueContext(issue, query.get('volume'), query.get('number'), year, profile.code, report, out=quiet)
+		return self.process(ctx, profile)
+
+	def issue(self, query: Dict[str, str], body: bytes, report: RunReport) -> Dict:
+		"""
+		Preprocesses a whole issue sent as a zip or tar bundle (POST /issue).
+		The path parameter is the issue's xml folder inside the bundle (only
+		needed if it holds several issues); the journal parameter overrides
+		the journal of the issue's folder name.
+		"""
+		suffix = '.zip' if body[:4] == b'PK\x03\x04' else '.tar'
+		(fd, bundle) = tempfile.mkstemp(suffix=suffix)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(body)
+			try:
+				issue = open_issue(bundle + '/' + query.get('path', ''))
+			except (OSError, ValueError) as ex:
+				raise ServiceError(400, str(ex).replace(bundle, '<bundle>'))
+
+			# The bundle's files are read, and written, in memory; the
+			# processed archive is never saved
+			try:
+				inner = issue.path[len(bundle):]
+				if not ISSUE_PATH.match(issue.path):
+					raise ServiceError(400, f'Issue folder {inner} should end with /jjvv(n)/xml/')
+				filenames = issue.names()
+				if len(filenames) == 0:
+					raise ServiceError(400, f'No xml files in {inner}')
+				(volume, number, year, journal_code) = extract_implicit_info(issue.path, filenames)
+				profile = self.profile(query.get('journal', journal_code))
+				report.set('issue', f'{journal_code}{volume}({number})')
+				ctx = IssueContext(issue, volume, number, year, journal_code, report, out=quiet)
+				response = self.process(ctx, profile)
+			finally:
+				issue.close(save=False)
+		finally:
+			os.remove(bundle)
+
+		response.update({'issue': ctx.name(), 'volume': volume, 'number': number, 'year': year})
+		return response
+
+	def run(self, endpoint: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict, Dict]:
+		"""
+		Processes a request in this process.
+
+		:param endpoint: the request's path (/article or /issue)
+		:param query: the request's query parameters
+		:param body: the request's body
+		:returns: the status and body of the response, and the metrics of the
+				  request's run report
+		"""
+		report = RunReport()
+		endpoints = {'/article': self.article, '/issue': self.issue}
+		try:
+			response = endpoints[endpoint](query, body, report)
+			status = 200
+		except ServiceError as ex:
+			(response, status) = ({'error': str(ex)}, ex.status)
+		except (ValueError, IndexError) as ex:
+			# Malformed xml (e.g. missing the lines every Bioline file has)
+			(response, status) = ({'error': f'Could not process: {str(ex)}'}, 422)
+		return (status, response, report.metrics)
+
+	def submit(self, endpoint: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict, Dict]:
+		"""
+		Processes a request in one of the worker processes (see run). If a
+		worker dies (e.g. killed for running out of memory), the request fails
+		and the workers are started again.
+		"""
+		pool = self._pool
+		try:
+			return pool.submit(run_request, endpoint, query, body).result()
+		except BrokenProcessPool:
+			with self._pool_lock:
+				if self._pool is pool:
+					pool.shutdown(wait=False)
+					self._pool = self.start_pool()
+			return (500, {'error': 'The process preprocessing the request stopped'}, dict())
+
+	def write_report(self, report: RunReport) -> None:
+		if self.report_path is not None:
+			report.path = self.report_path
+			with self._lock:
+				report.write()
+
+
+# The service of a worker process (see init_request_worker)
+_worker_service = None
+
+
+def init_request_worker(root: str) -> None:
+	"""
+	Loads what requests need in a worker process (the initializer of the
+	service's process pool). Interrupting the service stops its workers, so
+	they ignore the interrupt themselves.
+	"""
+	global _worker_service
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	_worker_service = PreprocessService(root, pooled=False)
+
+
+def worker_ready(_: int) -> bool:
+	return _worker_service is not None
+
+
+def run_request(endpoint: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict, Dict]:
+	return _worker_service.run(endpoint, query, body)
+
+
+class PreprocessHandler(BaseHTTPRequestHandler):
+	"""
+	Routes the service's requests:
+	  GET  /health                     status of the service
+	  POST /article?filename=<FILE>    preprocess one article's xml
+	  POST /issue                      preprocess a zip/tar bundle of an issue
+	Responses are JSON.
+	"""
+
+	server_version = 'BiolinePreprocessor/1.0'
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format: str, *args) -> None:
+		if self.server.verbose:
+			super().log_message(format, *args)
+
+	def send_json(self, status: int, response: Dict, headers: Optional[Dict[str, str]]=None) -> None:
+		data = json.dumps(response).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		for (header, value) in (headers or dict()).items():
+			self.send_header(header, value)
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self) -> None:
+		if urlparse(self.path).path != '/health':
+			self.send_json(404, {'error': f'No such endpoint: {self.path}'})
+			return
+		self.send_json(200, self.server.service.status())
+
+	def do_POST(self) -> None:
+		service = self.server.service
+		url = urlparse(self.path)
+		query = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+
+		# The body is always read, so the connection can be reused
+		length = int(self.headers.get('Content-Length', 0))
+		if length > MAX_BODY_BYTES:
+			self.close_connection = True
+			self.send_json(413, {'error': f'Request body larger than {MAX_BODY_BYTES} bytes'})
+			return
+		body = self.rfile.read(length)
+
+		if url.path not in ('/article', '/issue'):
+			self.send_json(404, {'error': f'No such endpoint: {url.path}'})
+			return
+		if not service.acquire():
+			self.send_json(503, {'error': 'Too many requests in progress; retry later'},
+						   {'Retry-After': str(RETRY_AFTER_SECONDS)})
+			return
+
+		report = RunReport()
+		report.set('request', url.path)
+		try:
+			(status, response, metrics) = service.submit(url.path, query, body)
+		finally:
+			service.release()
+		report.metrics.update(metrics)
+
+		if status != 200:
+			service.count('failed')
+		report.set('status', status)
+		service.write_report(report)
+		self.send_json(status, response)
+
+
+class PreprocessServer(ThreadingHTTPServer):
+	"""
+	Serves each connection on its own thread, all sharing one service.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, address: Tuple[str, int], service: PreprocessService, verbose: bool=False) -> None:
+		super().__init__(address, PreprocessHandler)
+		self.service = service
+		self.verbose = verbose
+
+
+# Run the preprocessing service until interrupted
+if __name__ == '__main__':
+	host = DEFAULT_HOST
+	port = DEFAULT_PORT
+	concurrency = DEFAULT_CONCURRENCY
+	report_path = None
+	verbose = False
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'H:P:c:r:v', ['host=', 'port=', 'concurrency=', 'report=', 'verbose'])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-H', '--host'):
+			host = arg
+		if opt in ('-P', '--port'):
+			port = int(arg)
+		if opt in ('-c', '--concurrency'):
+			concurrency = int(arg)
+		if opt in ('-r', '--report'):
+			report_path = arg.replace('\\', '/')
+		if opt in ('-v', '--verbose'):
+			verbose = True
+
+	try:
+		service = PreprocessService('.', concurrency, report_path)
+	except (OSError, ValueError) as ex:
+		# An unknown token in a .config file, or a language pack that can't
+		# be loaded
+		print(f'{colours.RED}CONFIGURATION ERROR:{colours.ENDC} {str(ex)}')
+		exit(1)
+
+	print(f'Loaded {len(service.profiles)} journal configuration(s)')
+	if service.species_index is not None:
+		print(f'Species dictionary version {service.species_index.content_hash[:12]}')
+
+	# Stopped like an interrupt, so the worker processes are stopped too
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	server = PreprocessServer((host, port), service, verbose)
+	print(f'{colours.GREEN}Serving on http://{host}:{port}/ ({concurrency} request(s) at a time){colours.ENDC}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
@@ -0,0 +1,163 @@
+import os
+import sys
+import getopt
+from typing import Dict, List
+from colours import colours
+from report import RunReport
+from species_index import SPECIES_FILE, read_dictionaries
+from species_link import FULL_HIT, SHORT_HIT, GENUS_HIT
+from species_hits import HITS_FILE, SpeciesHits, EntryHits
+from occurrence_index import entry_name
+
+USAGE = ('USAGE: python species-hits.py [-i <HITS>] [-s <DICTIONARY>] [-n <TOP>] [-c <SHARE>] [-m <MATCHES>] [-p <FILE>]\n'
+		 '                              [-r <REPORT>]')
+
+# Hot entries listed, and the share of an entry's matches (out of at least
+# MIN_MATCHES) that must differ in case from the dictionary for it to be
+# listed as a likely false positive
+TOP = 20
+CASE_SHARE = 0.5
+MIN_MATCHES = 3
+
+
+def matches(counts: Dict[str, tuple]) -> int:
+	# Matches by full or short name (genus hits are shared by the genus)
+	return counts[FULL_HIT][0] + counts[SHORT_HIT][0]
+
+
+def mismatches(counts: Dict[str, tuple]) -> int:
+	return counts[FULL_HIT][1] + counts[SHORT_HIT][1]
+
+
+def dead_entries(entry_hits: List[EntryHits]) -> List[EntryHits]:
+	"""
+	Returns the entries never matched by full or short name, in dictionary
+	order.
+	"""
+	return [(entry, counts) for (entry, counts) in entry_hits if matches(counts) == 0]
+
+
+def hot_entries(entry_hits: List[EntryHits], top: int) -> List[EntryHits]:
+	"""
+	Returns the top entries matched most often by full or short name.
+	"""
+	matched = [(entry, counts) for (entry, counts) in entry_hits if matches(counts) > 0]
+	return sorted(matched, key=lambda e: matches(e[1]), reverse=True)[:top]
+
+
+def false_positives(entry_hits: List[EntryHits], share: float, min_matches: int) -> List[EntryHits]:
+	"""
+	Returns the entries matched at least min_matches times, more than share
+	of them in a case different from the dictionary's (e.g. 'sida' for the
+	genus Sida, a word in Spanish and Portuguese), most suspicious first.
+	"""
+	suspects = [(entry, counts) for (entry, counts) in entry_hits
+				if matches(counts) >= min_matches and mismatches(counts) > share * matches(counts)]
+	return sorted(suspects, key=lambda e: (mismatches(e[1]) / matches(e[1]), matches(e[1])), reverse=True)
+
+
+def prune(dictionary: str, dead: List[EntryHits], output: str) -> int:
+	"""
+	Writes a copy of the dictionary without its dead entries to output.
+
+	:returns: the number of lines left out
+	"""
+	names = {entry_name(entry) for (entry, _) in dead}
+	with open(dictionary) as f:
+		lines = f.read().splitlines()
+	kept = [line for line in lines if line.strip() not in names]
+	with open(output, 'w') as f:
+		f.write('\n'.join(kept) + '\n')
+	return len(lines) - len(kept)
+
+
+def row(entry, counts: Dict[str, tuple]) -> str:
+	return (f'{counts[FULL_HIT][0]:8} {counts[SHORT_HIT][0]:8} {counts[GENUS_HIT][0]:8} '
+			f'{mismatches(counts):8}  {entry_name(entry)}')
+
+
+# List the entries of a species dictionary that never matched, that matched
+# most, and whose matches look like false positives, from the hit counts the
+# linker records as issues are preprocessed
+if __name__ == '__main__':
+	hits_path = HITS_FILE
+	dictionary = SPECIES_FILE
+	top = TOP
+	share = CASE_SHARE
+	min_matches = MIN_MATCHES
+	prune_path = None
+	report_path = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'i:s:n:c:m:p:r:', ['hits=', 'dictionary=', 'top=', 'case-share=', 'min-matches=',
+																  'prune=', 'report='])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-i', '--hits'):
+			hits_path = arg
+		if opt in ('-s', '--dictionary'):
+			dictionary = arg
+		if opt in ('-n', '--top'):
+			top = int(arg)
+		if opt in ('-c', '--case-share'):
+			share = float(arg)
+		if opt in ('-m', '--min-matches'):
+			min_matches = int(arg)
+		if opt in ('-p', '--prune'):
+			prune_path = arg
+		if opt in ('-r', '--report'):
+			report_path = arg.replace('\\', '/')
+
+	if not os.path.exists(hits_path):
+		print(f'{colours.RED}No species hits recorded in {hits_path}{colours.ENDC} (they are recorded as issues are preprocessed)')
+		exit(1)
+	hits = SpeciesHits(hits_path)
+	totals = hits.totals()
+	entry_hits = hits.entry_hits(read_dictionaries([dictionary]))
+	hits.close()
+
+	# Genera with one entry stop being italicised on their own if it's pruned
+	genus_entries = dict()
+	for (entry, _) in entry_hits:
+		genus_entries[entry.genus] = genus_entries.get(entry.genus, 0) + 1
+
+	print(f'{colours.YELLOW}Hits of the {len(entry_hits)} entries of {dictionary}{colours.ENDC} over {totals["blocks"]} '
+		  f'title/abstract blocks ({totals["runs"]} issue(s))\n')
+	header = f'{"full":>8} {"short":>8} {"genus":>8} {"case":>8}  entry'
+
+	hot = hot_entries(entry_hits, top)
+	print(f'{colours.CYAN}Hot entries{colours.ENDC} (most matched first)')
+	print(header)
+	for (entry, counts) in hot:
+		print(row(entry, counts))
+
+	suspects = false_positives(entry_hits, share, min_matches)
+	print(f'\n{colours.CYAN}Likely false positives{colours.ENDC} (over {share:.0%} of at least {min_matches} matches differ in case '
+		  f'from the dictionary): {len(suspects)}')
+	print(header)
+	for (entry, counts) in suspects:
+		print(row(entry, counts))
+
+	dead = dead_entries(entry_hits)
+	print(f'\n{colours.CYAN}Dead entries{colours.ENDC} (never matched by full or short name): {len(dead)} of {len(entry_hits)}')
+	for (entry, counts) in dead:
+		note = ''
+		if counts[GENUS_HIT][0] > 0 and genus_entries[entry.genus] == 1:
+			note = f' (only entry of its genus, which matched {counts[GENUS_HIT][0]} time(s) on its own)'
+		print(f'  {entry_name(entry)}{note}')
+
+	if report_path is not None:
+		report = RunReport(report_path)
+		report.set('species_hits', {
+			'dictionary': dictionary, 'blocks': totals['blocks'], 'runs': totals['runs'],
+			'hot': [{'entry': entry_name(e), FULL_HIT: c[FULL_HIT][0], SHORT_HIT: c[SHORT_HIT][0]} for (e, c) in hot],
+			'false_positives': [{'entry': entry_name(e), 'matches': matches(c), 'case_mismatches': mismatches(c)} for (e, c) in suspects],
+			'dead': [entry_name(e) for (e, _) in dead]})
+		report.write()
+
+	if prune_path is not None:
+		removed = prune(dictionary, dead, prune_path)
+		print(f'\n{colours.GREEN}Wrote {prune_path} without the {removed} dead entries{colours.ENDC} (review it before '
+			  f'replacing {dictionary}; an entry may only be dead because too few issues have been counted)')
@@ -0,0 +1,151 @@
+import re
+import threading
+from typing import List, Set, Tuple
+from species_index import SpeciesIndex, SpeciesEntry
+
+# Candidate binomials in abstracts: a capitalised word followed by a lowercase
+# one ('Ceasalpinia ferea'). Shorter words are too likely to be near-misses of
+# unrelated genera to be worth suggesting.
+CANDIDATE = re.compile(r'\b([A-Z][a-z]{3,})\s+([a-z][a-z-]{3,})\b')
+TAG = re.compile(r'<[^>]*>')
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+	"""
+	Returns the optimal string alignment distance between a and b (the
+	Levenshtein distance, but with a transposition of adjacent characters
+	counted as a single edit), or limit + 1 if it exceeds limit.
+
+	>>> edit_distance('ceasalpinia', 'caesalpinia', 2)
+	1
+
+	:param a: 1st string to compare
+	:param b: 2nd string to compare
+	:param limit: the largest distance of interest
+	:returns: the distance between a and b, capped at limit + 1
+	"""
+	if abs(len(a) - len(b)) > limit:
+		return limit + 1
+
+	prev_prev = None
+	prev = list(range(len(b) + 1))
+	for i in range(1, len(a) + 1):
+		row = [i] + [0] * len(b)
+		for j in range(1, len(b) + 1):
+			cost = 0 if a[i - 1] == b[j - 1] else 1
+			row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+			if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+				row[j] = min(row[j], prev_prev[j - 2] + 1)
+		if min(row) > limit:
+			return limit + 1
+		(prev_prev, prev) = (prev, row)
+	return min(prev[-1], limit + 1)
+
+
+def deletes(word: str, depth: int) -> Set[str]:
+	"""
+	Returns word along with every string that can be made by deleting up to
+	depth characters from it.
+
+	:param word: the word to generate deletes for
+	:param depth: the maximum number of characters to delete
+	:returns: set of deletes of word (including word)
+	"""
+	result = {word}
+	frontier = {word}
+	for _ in range(depth):
+		frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+		result |= frontier
+	return result
+
+
+class FuzzyMatcher:
+	"""
+	Suggests dictionary binomials for misspelled ones. Genera are found with a
+	SymSpell-style deletion dictionary (every genus is stored under each string
+	reachable by deleting up to max_distance characters from it, so a lookup is
+	a handful of dict probes rather than a scan of the dictionary), then the
+	species within each candidate genus are compared directly.
+	"""
+
+	def __init__(self, index: SpeciesIndex, max_distance: int) -> None:
+		self.index = index
+		self.max_distance = max_distance
+		self._deletes = dict()
+		for genus in index.genera():
+			for d in deletes(genus, max_distance):
+				self._deletes.setdefault(d, set()).add(genus)
+
+	def suggest(self, genus: str, species: str) -> List[Tuple[SpeciesEntry, int]]:
+		"""
+		Returns the dictionary entries within max_distance edits of the
+		binomial 'genus species' (summed over both words), closest first. Exact
+		matches are not returned.
+
+		:param genus: the (possibly misspelled) genus
+		:param species: the (possibly misspelled) species
+		:returns: list of (entry, distance) pairs
+		"""
+		(genus, species) = (genus.lower(), species.lower())
+
+		genera = set()
+		for d in deletes(genus, self.max_distance):
+			genera |= self._deletes.get(d, set())
+
+		suggestions = []
+		for candidate in genera:
+			genus_distance = edit_distance(genus, candidate, self.max_distance)
+			if genus_distance > self.max_distance:
+				continue
+			remaining = self.max_distance - genus_distance
+			for entry in self.index.species_of(candidate):
+				distance = genus_distance + edit_distance(species, entry.species.lower(), remaining)
+				if 0 < distance <= self.max_distance:
+					suggestions.append((entry, distance))
+		suggestions.sort(key=lambda s: (s[1], s[0].ordinal))
+		return suggestions
+
+
+_matchers = dict()
+_matchers_lock = threading.Lock()
+
+
+def get_fuzzy_matcher(index: SpeciesIndex, max_distance: int) -> FuzzyMatcher:
+	"""
+	Returns a fuzzy matcher over index, building it on first use.
+
+	:param index: the species index to match against
+	:param max_distance: the maximum edit distance of a suggestion
+	:returns: the fuzzy matcher
+	"""
+	key = (index.path, max_distance)
+	with _matchers_lock:
+		if key not in _matchers:
+			_matchers[key] = FuzzyMatcher(index, max_distance)
+		return _matchers[key]
+
+
+def find_misspelled_species(text: str, matcher: FuzzyMatcher) -> List[Tuple[str, str]]:
+	"""
+	Finds capitalised word pairs in text that are not in the species
+	dictionary but are within the matcher's edit distance of an entry in it.
+
+	:param text: the text to search (markup is ignored)
+	:param matcher: the fuzzy matcher to search with
+	:returns: list of (text as written, suggested species name) pairs
+	"""
+	found = []
+	seen = set()
+	for match in CANDIDATE.finditer(TAG.sub(' ', text)):
+		(genus, species) = match.groups()
+		if (genus, species) in seen:
+			continue
+		seen.add((genus, species))
+
+		if matcher.index.lookup(genus, species):
+			continue
+		suggestions = matcher.suggest(genus, species)
+		if suggestions:
+			entry = suggestions[0][0]
+			found.append((f'{genus} {species}', f'{entry.genus} {entry.species}'))
+	return found
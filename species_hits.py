@@ -0,0 +1,99 @@
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+from species_index import SpeciesEntry
+from species_link import FULL_HIT, SHORT_HIT, GENUS_HIT
+from occurrence_index import entry_name
+
+# Default location of the hit counts, next to the species dictionaries
+HITS_FILE = './species_hits.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hits (
+	name TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	matches INTEGER NOT NULL,
+	case_mismatches INTEGER NOT NULL,
+	PRIMARY KEY (name, kind)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS totals (
+	key TEXT PRIMARY KEY,
+	value INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Counts of one dictionary entry: matches by full name, by short name and of
+# its genus on its own, and how many of each differed in case from the
+# dictionary
+EntryHits = Tuple[SpeciesEntry, Dict[str, Tuple[int, int]]]
+
+
+class SpeciesHits:
+	"""
+	Persistent counts of how often each entry of the species dictionaries has
+	matched, by full name, by short name and by its genus on its own, over
+	every issue linked, in a SQLite database. Along with the matches, it
+	counts those whose case differs from the dictionary's, which the
+	(case-insensitive) linker may have linked by mistake.
+	"""
+
+	def __init__(self, path: str=HITS_FILE) -> None:
+		"""
+		:param path: path to the database (created if missing)
+		"""
+		self.path = path
+		self._db = sqlite3.connect(path, timeout=30)
+		self._db.executescript(SCHEMA)
+
+	def close(self) -> None:
+		self._db.close()
+
+	def add(self, hits: Dict[str, Dict[str, List[int]]], blocks: int) -> None:
+		"""
+		Adds the hits of a run (see species_link.add_hit) to the counts.
+
+		:param hits: dict of kinds to names to [matches, case mismatches]
+		:param blocks: the number of title/abstract blocks searched
+		"""
+		with self._db:
+			self._db.executemany('INSERT INTO hits (name, kind, matches, case_mismatches) VALUES (?, ?, ?, ?) '
+								 'ON CONFLICT (name, kind) DO UPDATE SET matches = matches + excluded.matches, '
+								 'case_mismatches = case_mismatches + excluded.case_mismatches',
+								 ((name, kind, matches, mismatches) for (kind, names) in hits.items()
+								  for (name, (matches, mismatches)) in names.items()))
+			self._db.executemany('INSERT INTO totals (key, value) VALUES (?, ?) '
+								 'ON CONFLICT (key) DO UPDATE SET value = value + excluded.value',
+								 (('blocks', blocks), ('runs', 1)))
+
+	def totals(self) -> Dict[str, int]:
+		"""
+		Returns the number of blocks searched and of runs counted.
+		"""
+		totals = {'blocks': 0, 'runs': 0}
+		totals.update(dict(self._db.execute('SELECT key, value FROM totals')))
+		return totals
+
+	def counts(self) -> Dict[str, Dict[str, Tuple[int, int]]]:
+		"""
+		Returns the counts of every name recorded.
+
+		:returns: dict of kinds to names to (matches, case mismatches)
+		"""
+		counts = {kind: dict() for kind in (FULL_HIT, SHORT_HIT, GENUS_HIT)}
+		for (name, kind, matches, mismatches) in self._db.execute('SELECT name, kind, matches, case_mismatches FROM hits'):
+			counts.setdefault(kind, dict())[name] = (matches, mismatches)
+		return counts
+
+	def entry_hits(self, entries: Iterable[SpeciesEntry]) -> List[EntryHits]:
+		"""
+		Returns the counts of each of entries (zero for those never matched).
+		An entry's genus hits are those of its genus, shared with the other
+		entries of the genus.
+
+		:param entries: dictionary entries
+		:returns: list of (entry, dict of kinds to (matches, case mismatches))
+		"""
+		counts = self.counts()
+		return [(entry, {FULL_HIT: counts[FULL_HIT].get(entry_name(entry), (0, 0)),
+						 SHORT_HIT: counts[SHORT_HIT].get(entry_name(entry), (0, 0)),
+						 GENUS_HIT: counts[GENUS_HIT].get(entry.genus, (0, 0))})
+				for entry in entries]
@@ -0,0 +1,343 @@
+import os
+import sys
+import mmap
+import getopt
+import threading
+import struct
+import hashlib
+from collections import namedtuple
+from typing import List, Set, Tuple
+try:
+	from colours import colours
+except ImportError:
+	# Loaded as part of a Sublime Text package
+	from .colours import colours
+
+# Species dictionaries. common_species.txt is always loaded first, followed by
+# any larger dictionaries (e.g. a full taxonomic dump) placed in DICTIONARY_DIR.
+# Every dictionary uses the same format: one 'Genus species' per line, with
+# pseudospecies (those not in the CRIA database) prefixed by an asterisk.
+SPECIES_FILE = './common_species.txt'
+DICTIONARY_DIR = './dictionaries'
+INDEX_FILE = './common_species.idx'
+
+# On-disk layout of the index:
+#   header         magic, format version, record count, genus count, and the
+#                  sha256 of the dictionaries the index was compiled from
+#   offsets        (count + 1) little-endian uint32 offsets into the records
+#   genus offsets  (genus count + 1) uint32 offsets into the genera
+#   records        utf-8 'key\tkind\tordinal\tname', sorted by key (bytewise).
+#                  Pseudospecies keep their asterisk in name.
+#   genera         utf-8 lowercase genus names, sorted
+# The offsets tables turn the records and genera into sorted arrays that can be
+# binary searched straight out of the memory map, so nothing but the pages
+# touched by a lookup is ever read.
+MAGIC = b'BSIX'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sIII32s')
+OFFSET = struct.Struct('<I')
+
+# Record kinds. Full records are keyed on 'genus species', short records on
+# 'g species' (the abbreviated 'G. species' form, sans period).
+FULL = 'f'
+SHORT = 's'
+
+SpeciesEntry = namedtuple('SpeciesEntry', ['genus', 'species', 'pseudospecies', 'ordinal'])
+
+
+def dictionary_sources(root: str='.') -> List[str]:
+	"""
+	Returns the paths of every species dictionary, in load order.
+
+	:param root: the folder containing the project files
+	:returns: list of paths to species dictionaries
+	"""
+	sources = [os.path.join(root, SPECIES_FILE)]
+	dictionary_dir = os.path.join(root, DICTIONARY_DIR)
+	if os.path.isdir(dictionary_dir):
+		sources += [os.path.join(dictionary_dir, f) for f in sorted(os.listdir(dictionary_dir))
+					if f.endswith('.txt')]
+	return sources
+
+
+def read_dictionaries(sources: List[str]) -> List[SpeciesEntry]:
+	"""
+	Parses the species dictionaries at sources into a list of entries, in the
+	order they appear (which is the order insertSpeciesLinks applies them in).
+
+	:param sources: paths to species dictionaries
+	:returns: list of species entries
+	"""
+	entries = []
+	for source in sources:
+		with open(source) as f:
+			for line in f.read().splitlines():
+				species = line.strip()
+
+				# EACH SPECIES MUST MATCH '.* .*'
+				if ' ' not in species:
+					continue
+
+				# A pseudospecies is denoted by a prefixed asterisk
+				pseudospecies = species[0] == '*'
+				parts = species.lstrip('*').split(' ')
+				entries.append(SpeciesEntry(parts[0], parts[1], pseudospecies, len(entries)))
+	return entries
+
+
+def dictionary_hash(sources: List[str]) -> bytes:
+	"""
+	Returns the sha256 digest of the species dictionaries at sources (their
+	names and contents, in load order). This identifies the dictionary version
+	an index was compiled from.
+
+	:param sources: paths to species dictionaries
+	:returns: 32 byte digest
+	"""
+	digest = hashlib.sha256()
+	for source in sources:
+		digest.update(os.path.basename(source).encode('utf-8') + b'\0')
+		with open(source, 'rb') as f:
+			digest.update(f.read())
+		digest.update(b'\0')
+	return digest.digest()
+
+
+def pack_offsets(items: List[bytes]) -> bytes:
+	offsets = [0]
+	for item in items:
+		offsets.append(offsets[-1] + len(item))
+	return struct.pack(f'<{len(offsets)}I', *offsets)
+
+
+def build_index(sources: List[str], path: str) -> int:
+	"""
+	Compiles the species dictionaries at sources into a sorted, memory-mappable
+	index at path.
+
+	:param sources: paths to species dictionaries
+	:param path: path to write the index to
+	:returns: the number of species entries indexed
+	"""
+	content_hash = dictionary_hash(sources)
+	entries = read_dictionaries(sources)
+
+	records = []
+	for entry in entries:
+		name = ('*' if entry.pseudospecies else '') + entry.genus + ' ' + entry.species
+		full_key = (entry.genus + ' ' + entry.species).lower()
+		short_key = (entry.genus[0] + ' ' + entry.species).lower()
+		for (key, kind) in ((full_key, FULL), (short_key, SHORT)):
+			records.append(f'{key}\t{kind}\t{entry.ordinal}\t{name}'.encode('utf-8'))
+	records.sort(key=lambda r: (r[:r.index(b'\t')], r))
+	genera = sorted({e.genus.lower().encode('utf-8') for e in entries})
+
+	# Write to a temporary file first so a concurrent reader never maps a
+	# half-written index
+	tmp_path = f'{path}.{os.getpid()}.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(records), len(genera), content_hash))
+		f.write(pack_offsets(records))
+		f.write(pack_offsets(genera))
+		f.write(b''.join(records))
+		f.write(b''.join(genera))
+	os.replace(tmp_path, path)
+	return len(entries)
+
+
+class SpeciesIndex:
+	"""
+	Read-only view of a species index built by build_index. Opening an index
+	only maps the file; records are decoded lazily as lookups touch them.
+	"""
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self._file = open(path, 'rb')
+		self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		(magic, version) = struct.unpack_from('<4sI', self._map, 0) if len(self._map) >= 8 else (None, None)
+		if magic != MAGIC or version != FORMAT_VERSION:
+			self.close()
+			raise ValueError(f'{path} is not a version {FORMAT_VERSION} species index')
+		(_, _, self.count, self.genus_count, content_hash) = HEADER.unpack_from(self._map, 0)
+		self.content_hash = content_hash.hex()
+
+		self._offsets_start = HEADER.size
+		self._genus_offsets_start = self._offsets_start + (self.count + 1) * OFFSET.size
+		self._records_start = self._genus_offsets_start + (self.genus_count + 1) * OFFSET.size
+		records_size = OFFSET.unpack_from(self._map, self._offsets_start + self.count * OFFSET.size)[0]
+		self._genera_start = self._records_start + records_size
+		# Entries of each genus looked up (only genera are cached, so the
+		# cache is bounded by the index however many words are looked up)
+		self._genus_cache = dict()
+		self._genera = None
+		self._name_words = None
+
+	def close(self) -> None:
+		self._map.close()
+		self._file.close()
+
+	def _record(self, i: int) -> bytes:
+		(start, end) = struct.unpack_from('<2I', self._map, self._offsets_start + i * OFFSET.size)
+		return self._map[self._records_start + start:self._records_start + end]
+
+	def _key(self, i: int) -> bytes:
+		record = self._record(i)
+		return record[:record.index(b'\t')]
+
+	def _lower_bound(self, key: bytes) -> int:
+		(lo, hi) = (0, self.count)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._key(mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def _scan(self, prefix: bytes, kind: str, exact: bool) -> List[SpeciesEntry]:
+		entries = []
+		i = self._lower_bound(prefix)
+		while i < self.count:
+			(key, record_kind, ordinal, name) = self._record(i).decode('utf-8').split('\t')
+			if not key.encode('utf-8').startswith(prefix) or (exact and len(key.encode('utf-8')) != len(prefix)):
+				break
+			if record_kind == kind:
+				pseudospecies = name[0] == '*'
+				(genus, species) = name.lstrip('*').split(' ', 1)
+				entries.append(SpeciesEntry(genus, species, pseudospecies, int(ordinal)))
+			i += 1
+		return entries
+
+	def lookup(self, first: str, second: str) -> List[SpeciesEntry]:
+		"""
+		Returns every entry whose full name ('Genus species') or short name
+		('G. species', given as first='G') matches the pair of words
+		first, second. Matching is case-insensitive.
+
+		:param first: genus (or genus initial) to look up
+		:param second: species to look up
+		:returns: list of matching entries
+		"""
+		key = (first + ' ' + second).lower().encode('utf-8')
+		return self._scan(key, SHORT if len(first) == 1 else FULL, True)
+
+	def genera(self) -> List[str]:
+		"""
+		Returns every (lowercase) genus in the index, sorted.
+
+		:returns: list of genera
+		"""
+		offsets = struct.unpack_from(f'<{self.genus_count + 1}I', self._map, self._genus_offsets_start)
+		blob = self._map[self._genera_start:self._genera_start + offsets[-1]].decode('utf-8')
+		return [blob[offsets[i]:offsets[i + 1]] for i in range(self.genus_count)]
+
+	def entries(self) -> List[SpeciesEntry]:
+		"""
+		Returns every entry in the index, in dictionary order. This reads the
+		whole index, so it is only meant for building derived tables.
+
+		:returns: list of all entries
+		"""
+		entries = []
+		for i in range(self.count):
+			(key, kind, ordinal, name) = self._record(i).decode('utf-8').split('\t')
+			if kind == FULL:
+				(genus, species) = name.lstrip('*').split(' ', 1)
+				entries.append(SpeciesEntry(genus, species, name[0] == '*', int(ordinal)))
+		entries.sort(key=lambda e: e.ordinal)
+		return entries
+
+	def name_words(self) -> Tuple[Set[str], Set[str]]:
+		"""
+		Returns the set of every (lowercase) genus, and of every (lowercase)
+		species epithet, in the index. Built on first use from the whole index.
+
+		:returns: (genera, species epithets)
+		"""
+		if self._name_words is None:
+			self._name_words = (set(self.genera()), {e.species.lower() for e in self.entries()})
+		return self._name_words
+
+	def species_of(self, genus: str) -> List[SpeciesEntry]:
+		"""
+		Returns every entry belonging to genus (case-insensitive), or an empty
+		list if genus is not a known genus.
+
+		:param genus: the genus to look up
+		:returns: list of entries in genus
+		"""
+		genus = genus.lower()
+		entries = self._genus_cache.get(genus)
+		if entries is None:
+			if self._genera is None:
+				self._genera = frozenset(self.genera())
+			if genus not in self._genera:
+				return []
+			entries = self._scan((genus + ' ').encode('utf-8'), FULL, False)
+			self._genus_cache[genus] = entries
+		return entries
+
+
+def open_index(path: str, sources: List[str]) -> SpeciesIndex:
+	"""
+	Opens the index at path, first compiling it from sources if it is missing,
+	was written by a different version of this module, or was compiled from
+	different dictionaries (by content hash).
+
+	:param path: path to the index
+	:param sources: paths to species dictionaries
+	:returns: the opened index
+	"""
+	try:
+		index = SpeciesIndex(path)
+		if index.content_hash == dictionary_hash(sources).hex():
+			return index
+		index.close()
+	except (FileNotFoundError, ValueError):
+		pass
+
+	print(f'{colours.YELLOW}Compiling species dictionary...{colours.ENDC}')
+	build_index(sources, path)
+	return SpeciesIndex(path)
+
+
+_species_indices = dict()
+_species_indices_lock = threading.Lock()
+
+
+def get_species_index(root: str='.') -> SpeciesIndex:
+	"""
+	Returns the species index, compiling it first if it is missing or stale.
+	The index is opened once and shared for the life of the process.
+
+	:param root: the folder containing the project files
+	:returns: the species index
+	"""
+	# (held while compiling, so threads wait for the one compiling the index)
+	with _species_indices_lock:
+		if root not in _species_indices:
+			_species_indices[root] = open_index(os.path.join(root, INDEX_FILE), dictionary_sources(root))
+		return _species_indices[root]
+
+
+# Compile the species dictionaries ahead of time
+if __name__ == '__main__':
+	output = INDEX_FILE
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'o:', ['output='])
+	except getopt.GetoptError:
+		print('USAGE: python species_index.py [-o <FILE>]')
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-o', '--output'):
+			output = arg.replace('\\', '/')
+
+	sources = dictionary_sources()
+	count = build_index(sources, output)
+	index = SpeciesIndex(output)
+	print(f'Compiled {count} species ({index.genus_count} genera) from {len(sources)} dictionaries into {output}')
+	print(f'Dictionary version: {colours.GREEN}{index.content_hash}{colours.ENDC}')
+	index.close()
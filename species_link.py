@@ -1,4 +1,11 @@
+import os
 import re
+from collections import namedtuple
+try:
+    from species_index import get_species_index
+except ImportError:
+    # Loaded as part of a Sublime Text package
+    from .species_index import get_species_index
 
 # Allows species links to be added to highlighted text
 # (as a Sublime Text plugin)
@@ -17,6 +24,56 @@ try:
                     # Otherwise, a species was highlighted, so insert a link for it
                     else:
                         view.replace(edit, region, get_species_link(view.substr(region)))
+
+    # Title/abstract blocks of the last linked version of each view, which
+    # don't need to be linked again unless they are edited
+    _linked_views = dict()
+
+    class SpeciesLinkDocumentCommand(sublime_plugin.TextCommand):
+        """
+        Inserts species links into the whole document. Linking runs on
+        Sublime's async thread so the editor stays responsive, and the result
+        is applied as a single edit (provided the document hasn't been changed
+        in the meantime).
+        """
+
+        def run(self, edit):
+            view = self.view
+            text = view.substr(sublime.Region(0, view.size()))
+            change_count = view.change_count()
+            root = os.path.dirname(os.path.abspath(__file__))
+            view.set_status('species_link', 'Linking species...')
+
+            def link():
+                try:
+                    linked = insertSpeciesLinks(text, get_species_index(root), _linked_views.get(view.id()))
+                except ValueError:
+                    # No <title>, <abstract>, or <keyword> tags to link between
+                    view.erase_status('species_link')
+                    sublime.status_message('Species links require <title>, <abstract>, and <keyword> tags')
+                    return
+                sublime.set_timeout(lambda: view.run_command('species_link_apply', {
+                    'text': linked, 'change_count': change_count}), 0)
+
+            sublime.set_timeout_async(link, 0)
+
+    class SpeciesLinkApplyCommand(sublime_plugin.TextCommand):
+        """
+        Replaces the document with the result of SpeciesLinkDocumentCommand.
+        Not meant to be invoked directly.
+        """
+
+        def run(self, edit, text, change_count):
+            view = self.view
+            view.erase_status('species_link')
+            if view.change_count() != change_count:
+                sublime.status_message('Document changed while linking species; run again to link it')
+                return
+
+            if text != view.substr(sublime.Region(0, view.size())):
+                view.replace(edit, sublime.Region(0, view.size()), text)
+            _linked_views[view.id()] = set(get_species_blocks(text))
+            sublime.status_message('Species links inserted')
 except ImportError:
     pass
 except NameError:
@@ -24,147 +81,423 @@ except NameError:
 
 
 # MAIN SPECIES LINK CODE #
-def insertSpeciesLinks(text):
+
+# Blanks between the genus (or its initial) and species of a name: spaces,
+# then at most one linebreak and more spaces. (Not ' *\n? *', whose two runs
+# of spaces can split a long run of spaces every possible way.)
+SEPARATOR = r' *(?:\n *)?'
+
+def insertSpeciesLinks(text, index=None, already_linked=None):
     """
-    (str) -> str
+    (str, SpeciesIndex, set) -> str
     Inserts species links into text where possible, and returns the new text.
     Requires text to match the following regex:
     .*<title.*</title>.*<abstract.*</abstract>.*<keyword.*</keyword>
 
     :param text: the text to insert species links in
+    :param index: the species index to link with (defaults to the project's)
+    :param already_linked: title/abstract blocks (as returned by
+                           get_species_blocks) to leave untouched
     :returns: text with species links inserted
     """
 
-    # Read in common species
-    f = open("./common_species.txt")
-    species_list = f.read().splitlines()
-    f.close()
+    return insert_species_links_batch([text], index, already_linked)[0]
+
+
+def insert_species_links_batch(texts, index=None, already_linked=None, stats=None):
+    """
+    (list, SpeciesIndex, set, dict) -> list
+    Inserts species links into each of texts (e.g. every file of an issue), as
+    insertSpeciesLinks would. The title/abstract blocks of all the texts are
+    searched for species in a single pass (see find_species_candidates_batch)
+    before each block is linked.
+
+    :param texts: the texts to insert species links in
+    :param index: the species index to link with (defaults to the project's)
+    :param already_linked: title/abstract blocks to leave untouched
+    :param stats: if given, species statistics for the texts are added to it
+                  (see add_species_stats), along with the hit counts of each
+                  entry (see add_hit)
+    :returns: list of texts with species links inserted
+    """
+
+    if index is None:
+        index = get_species_index()
+
+    # Split each text as we are only considering the first title to last
+    # abstract (main_body), and collect the blocks (title-/abstract for each
+    # language) of every text
+    splits = []
+    bodies = []
+    for text in texts:
+        pre_title = text[:text.index("<title")]
+        main_body = text[text.index("<title"):text.rindex("<keyword")]
+        post_abstract = text[text.rindex("<keyword"):]
+
+        spans = []
+        for (start, end) in get_species_block_spans(main_body):
+            if already_linked is None or main_body[start:end] not in already_linked:
+                spans.append((start, end, len(bodies)))
+                bodies.append(main_body[start:end])
+        splits.append((pre_title, main_body, post_abstract, spans))
+
+    candidates = find_species_candidates_batch(bodies, index)
+    hits = None
+    if stats is not None:
+        add_species_stats(stats, candidates)
+        hits = stats.setdefault('hits', dict())
+
+    linked = []
+    for (pre_title, main_body, post_abstract, spans) in splits:
+        # Move backwards from last language
+        for (start, end, block) in reversed(spans):
+            # When the titles come before the abstracts (<title en><title fr>
+            # <abstract en><abstract fr>), the blocks overlap, and linking a
+            # later block changes the text of an earlier one: its candidates
+            # are found again in the text as it now is
+            body = main_body[start:end]
+            if body == bodies[block]:
+                (species_list, genus_list, _) = candidates[block]
+            else:
+                (species_list, genus_list, _) = find_species_candidates_batch([body], index)[0]
+            body = link_species_block(body, species_list, genus_list, hits)
+
+            # Rejoin body to end of main_body
+            main_body = main_body[:start] + body + main_body[end:]
+
+        # Rejoin all three parts of the article
+        linked.append(pre_title + main_body + post_abstract)
+
+    if stats is not None:
+        stats['links_added'] = stats.get('links_added', 0) + sum(
+            after.count(TAXON_OPEN) - before.count(TAXON_OPEN) for (before, after) in zip(texts, linked))
+    return linked
+
+
+# Kinds of hit of a dictionary entry: by full name, by short name, and of its
+# genus on its own
+FULL_HIT = 'full'
+SHORT_HIT = 'short'
+GENUS_HIT = 'genus'
+
+
+def add_hit(hits, kind, name, written, expected):
+    """
+    (dict, str, str, str, str) -> None
+    Counts a match of a dictionary entry (or of a genus, for GENUS_HIT) in
+    hits, which maps each kind to names to [matches, case mismatches]. Names
+    are matched case-insensitively, so a match whose case differs from the
+    dictionary's (e.g. 'sida' for the genus Sida) is counted as a case
+    mismatch too.
+
+    :param hits: dict to count the hit in
+    :param kind: FULL_HIT, SHORT_HIT or GENUS_HIT
+    :param name: the entry as written in the dictionary, or the genus
+    :param written: the text matched
+    :param expected: the text as written in the dictionary
+    """
+
+    counts = hits.setdefault(kind, dict()).setdefault(name, [0, 0])
+    counts[0] += 1
+    if written != expected:
+        counts[1] += 1
+
+
+def link_species_block(body, species_list, genus_list, hits=None):
+    """
+    (str, list, list, dict) -> str
+    Links the species in one title/abstract block: the first occurrence of
+    each species is linked and the rest are italicised, along with their
+    genera.
+
+    :param body: the title/abstract block to link
+    :param species_list: the species that may occur in body
+    :param genus_list: every species of the genera that occur in body
+    :param hits: if given, every match is counted in it (see add_hit)
+    :returns: body with species links inserted
+    """
+
+    genus_to_species = dict()
+
+    # Fill in the genus_to_species dict (in dictionary order)
+    for species in genus_list:
+        genus = ('*' if species.pseudospecies else '') + species.genus
+        if genus not in genus_to_species:
+            genus_to_species[genus] = []
+        if species.species not in genus_to_species[genus]:
+            genus_to_species[genus].append(species.species)
+
+    # PART ONE
+
+    # Check the body for each candidate species
+    for species in species_list:
+        # A pseudospecies is a species that does not show up in the CRIA database
+        pseudospecies = species.pseudospecies
+        parts = [species.genus, species.species]
+
+        matches = []
+        short_matches = []
+        shortform = ''
+
+        # Get indices of all occurences of full species name
+        shortform = f'''{parts[0][0]}. {' '.join(parts[1:])}'''
+        for match in re.finditer(re.escape(parts[0]) + SEPARATOR + re.escape(parts[1]), body, re.IGNORECASE):
+            matches.append(match.span())
+
+        # Replace all full occurences with a standard '{genus} {species}' format.
+        # Italicize all but the first occurence (if not a pseudospecies)
+        name = ('*' if pseudospecies else '') + f'{parts[0]} {parts[1]}'
+        for i in range(len(matches) -1, -1, -1):
+            spec = remove_blank_chars(body[matches[i][0]: matches[i][1]])
+            if hits is not None:
+                add_hit(hits, FULL_HIT, name, spec, f'{parts[0]} {parts[1]}')
+            if (i == 0 and not pseudospecies):
+                body = body[:matches[i][0]] + get_species_link(spec) + body[matches[i][1]:]
+            else:
+                body = body[:matches[i][0]] + f'<i>{spec}</i>' + body[matches[i][1]:]
+
+        # Get indices of all occurences of short form of species name
+        short_parts = shortform.split(' ')
+        if len(short_parts) > 1:
+            for match in re.finditer(re.escape(short_parts[0]) + SEPARATOR + re.escape(' '.join(parts[1:])), body, re.IGNORECASE):
+                short_matches.append(match.span())
+
+        # Replace all short form occurences with standard 'C. {species}' format.
+        # Italicize all occurences
+        for i in range(len(short_matches) -1, -1, -1):
+            spec = remove_blank_chars(body[short_matches[i][0]: short_matches[i][1]])
+            if hits is not None:
+                add_hit(hits, SHORT_HIT, name, spec, shortform)
+            body = body[:short_matches[i][0]] + f'<i>{spec}</i>' + body[short_matches[i][1]:]
+
+    # PART TWO
+
+    # For each linked species, if it's genus occurs on its own before any links of the same
+    # genus (but different species), add a species link
+
+    # Find all species links for a given genus
+    for genus in genus_to_species.keys():
+
+        # The following regex matches species links for any species of a given genus currently processed
+        if genus[0] != '*':
+            master_reg = r'''<taxon genus="''' + re.escape(genus) + r'''" species="('''
+            for i in range(len(genus_to_species[genus])):
+                if i < len(genus_to_species[genus]) - 1:
+                    master_reg += re.escape(f'{genus_to_species[genus][i]}') + '|'
+                else:
+                    master_reg += re.escape(f'{genus_to_species[genus][i]}') + ''')"'''
+            
+            # Find all links that match said expression
+            matches = []
+            for match in re.finditer(master_reg, body, re.IGNORECASE):
+                matches.append(match.span())
+
+            if len(matches) > 0:
+                # Find first occurence of genus (on its own)
+                first_genus = re.search(re.escape(genus), body[:matches[0][0]], re.IGNORECASE)
+                if first_genus is not None:
+                    first_genus = first_genus.span()
+                
+                    # if first occurrence of genus preceedes 1st species link for it, add another link
+                    if (first_genus[1] < matches[0][0]):
+                        if hits is not None:
+                            add_hit(hits, GENUS_HIT, genus, body[first_genus[0]:first_genus[1]], genus)
+                        body = body[:first_genus[0]] + get_species_link(body[first_genus[0]:first_genus[1]]) + body[first_genus[1]:]
+
+        #Italicize subsequent occurrences of just the genus
+        matches = []
+        for match in re.finditer(r' ' + re.escape(genus.replace('*','')) + r'[ \n\.,\?\!]', body, re.IGNORECASE):
+            matches.append(match.span())
+
+        for i in range(len(matches) -1, -1, -1):
+            if hits is not None:
+                add_hit(hits, GENUS_HIT, genus.replace('*', ''), body[matches[i][0]+1:matches[i][1]-1], genus.replace('*', ''))
+                                                       #+1 and -1 to trim off surrounding chars
+            body = body[:matches[i][0]] + ' <i>' + body[matches[i][0]+1:matches[i][1]-1] + "</i>" + body[matches[i][1]-1] + body[matches[i][1]:] 
+
+    return body
+
+
+def get_species_blocks(text):
+    """
+    (str) -> list
+    Returns the title/abstract blocks of text that insertSpeciesLinks links
+    (one per language), in the order they appear.
+
+    :param text: the text to split into blocks
+    :returns: list of title/abstract blocks
+    """
 
-    # Split text as we are only considering the first title to last abstract
-    # (main_body)
-    pre_title = text[:text.index("<title")]
     main_body = text[text.index("<title"):text.rindex("<keyword")]
-    post_abstract = text[text.rindex("<keyword"):]
+    start_title_indices = [m.start() for m in re.finditer("<title", main_body)]
+    end_abstract_indices = [m.start() for m in re.finditer("</abstract>", main_body)]
+    return [main_body[start:end] for (start, end) in zip(start_title_indices, end_abstract_indices)]
+
+
+def get_species_block_spans(main_body):
+    """
+    (str) -> list
+    Returns the (start, end) spans of the title/abstract blocks (one per
+    language) in main_body, the text from the first <title to the last
+    <keyword.
+
+    :param main_body: the text to find blocks in
+    :returns: list of (start, end) spans
+    """
 
     # Get indices for each different language body stuff (title-/abstract for
     # each language)
     start_title_indices = [m.start() for m in re.finditer("<title", main_body)]
     end_abstract_indices = [m.start() for m in re.finditer("</abstract>",
                                                            main_body)]
+    return [(start_title_indices[j], end_abstract_indices[j]) for j in range(len(start_title_indices))]
 
-    # Move backwards from last language
-    for j in range(len(start_title_indices) - 1, -1, -1):
-        # Clear lists and dicts cuz we're starting a new language
-        short_forms = []
-        genus_to_species = dict()
 
-        # Chunk out the portion of the body we want to work on
-        body = main_body[start_title_indices[j]:end_abstract_indices[j]]
+# Words as they appear in abstracts: 'Citrus', 'limonum', 'ficus-indica', etc.
+WORD = re.compile(r'\w+(?:-\w+)*')
 
-        # PART ONE
+# find_species_candidates_batch joins blocks with BLOCK_SEPARATOR, which can't
+# occur in XML, and finds the words and separators in a single pass
+BLOCK_SEPARATOR = '\x00'
+WORD_OR_SEPARATOR = re.compile(r'\w+(?:-\w+)*|\x00')
 
-        # Check the body for each individual species in common_species.txt
-        for species in species_list:  
-            # EACH SPECIES MUST MATCH '.* .*'
-            if not re.search(r'.* .*', species):
-                continue
 
-            # A pseudospecies is a species that does not show up in the CRIA database
-            # Denoted by a prefixed asterisk (which we remove here)
-            pseudospecies = False
-            if species[0] == '*':
-                species = species[1:]
-                pseudospecies = True
+def find_species_candidates_batch(bodies, index):
+    """
+    (list, SpeciesIndex) -> list
+    Looks up every pair of adjacent words of each of bodies in the species
+    index, and finds the species that may occur in the body (by full or short
+    name) along with every species belonging to a genus that occurs in it,
+    both in dictionary order. The bodies are joined into one buffer, and its
+    words are found in one pass; word pairs are never taken across two
+    bodies.
+
+    :param bodies: the texts to find species candidates in
+    :param index: the species index to look words up in
+    :returns: list of (candidate species, species of every genus present,
+              number of words) for each of bodies
+    """
 
-            matches = []
-            short_matches = []
-            shortform = ''
-            parts = species.split(' ')
-
-            # Fill in the genus_to_species dict
-            if pseudospecies:
-                if '*' + parts[0] not in genus_to_species:
-                    genus_to_species['*' + parts[0]] = []
-                if parts[1] not in genus_to_species['*' + parts[0]]:
-                    genus_to_species['*' + parts[0]].append(parts[1])
-            else:
-                if parts[0] not in genus_to_species:
-                    genus_to_species[parts[0]] = []
-                if parts[1] not in genus_to_species[parts[0]]:
-                    genus_to_species[parts[0]].append(parts[1])
-
-            # Get indices of all occurences of full species name
-            shortform = f'''{parts[0][0]}. {' '.join(parts[1:])}'''
-            for match in re.finditer(re.escape(parts[0]) + r' *\n? *' + re.escape(parts[1]), body, re.IGNORECASE):
-                matches.append(match.span())
+    buffer = BLOCK_SEPARATOR.join(body.replace(BLOCK_SEPARATOR, ' ') for body in bodies)
+    words = [w.lower() for w in WORD_OR_SEPARATOR.findall(buffer)]
+
+    results = []
+    species = dict()
+    genera = dict()
+    count = 0
+    for i in range(len(words) + 1):
+        # Scatter the candidates found so far back to their body
+        if i == len(words) or words[i] == BLOCK_SEPARATOR:
+            results.append(([species[o] for o in sorted(species)], [genera[o] for o in sorted(genera)], count))
+            species = dict()
+            genera = dict()
+            count = 0
+            continue
+
+        count += 1
+        word = words[i]
+        in_genus = index.species_of(word)
+
+        for entry in in_genus:
+            genera[entry.ordinal] = entry
+
+        if i + 1 < len(words) and words[i + 1] != BLOCK_SEPARATOR:
+            # Full name: the first word is a genus
+            for entry in in_genus:
+                if entry.species.lower() == words[i + 1]:
+                    species[entry.ordinal] = entry
+            # Short name: the first word is a genus initial
+            if len(word) == 1:
+                for entry in index.lookup(word, words[i + 1]):
+                    species[entry.ordinal] = entry
+
+    return results[:len(bodies)]
+
+
+def add_species_stats(stats, candidates):
+    """
+    (dict, list) -> None
+    Adds the species statistics of blocks to stats: the number of blocks and
+    words searched, and for each species found (by full or short name), the
+    number of blocks it was found in.
 
-            # Replace all full occurences with a standard '{genus} {species}' format.
-            # Italicize all but the first occurence (if not a pseudospecies)
-            for i in range(len(matches) -1, -1, -1):
-                spec = remove_blank_chars(body[matches[i][0]: matches[i][1]])
-                if (i == 0 and not pseudospecies):
-                    body = body[:matches[i][0]] + get_species_link(spec) + body[matches[i][1]:]
-                else:
-                    body = body[:matches[i][0]] + f'<i>{spec}</i>' + body[matches[i][1]:]
-
-            # Get indices of all occurences of short form of species name
-            short_parts = shortform.split(' ')
-            if len(short_parts) > 1:
-                for match in re.finditer(re.escape(short_parts[0]) + r' *\n? *' + re.escape(' '.join(parts[1:])), body, re.IGNORECASE):
-                    short_matches.append(match.span())
-
-            # Replace all short form occurences with standard 'C. {species}' format.
-            # Italicize all occurences
-            for i in range(len(short_matches) -1, -1, -1):
-                spec = remove_blank_chars(body[short_matches[i][0]: short_matches[i][1]])
-                body = body[:short_matches[i][0]] + f'<i>{spec}</i>' + body[short_matches[i][1]:]
-
-        # PART TWO
-
-        # For each linked species, if it's genus occurs on its own before any links of the same
-        # genus (but different species), add a species link
-
-        # Find all species links for a given genus
-        for genus in genus_to_species.keys():
-
-            # The following regex matches species links for any species of a given genus currently processed
-            if genus[0] != '*':
-                master_reg = r'''<taxon genus="''' + re.escape(genus) + r'''" species="('''
-                for i in range(len(genus_to_species[genus])):
-                    if i < len(genus_to_species[genus]) - 1:
-                        master_reg += re.escape(f'{genus_to_species[genus][i]}') + '|'
-                    else:
-                        master_reg += re.escape(f'{genus_to_species[genus][i]}') + ''')"'''
-                
-                # Find all links that match said expression
-                matches = []
-                for match in re.finditer(master_reg, body, re.IGNORECASE):
-                    matches.append(match.span())
-    
-                if len(matches) > 0:
-                    # Find first occurence of genus (on its own)
-                    first_genus = re.search(re.escape(genus), body[:matches[0][0]], re.IGNORECASE)
-                    if first_genus is not None:
-                        first_genus = first_genus.span()
-                    
-                        # if first occurrence of genus preceedes 1st species link for it, add another link
-                        if (first_genus[1] < matches[0][0]):
-                            body = body[:first_genus[0]] + get_species_link(body[first_genus[0]:first_genus[1]]) + body[first_genus[1]:]
-
-            #Italicize subsequent occurrences of just the genus
-            matches = []
-            for match in re.finditer(r' ' + re.escape(genus.replace('*','')) + r'[ \n\.,\?\!]', body, re.IGNORECASE):
-                matches.append(match.span())
+    :param stats: dict to add the statistics to
+    :param candidates: the results of find_species_candidates_batch
+    """
+
+    stats['blocks'] = stats.get('blocks', 0) + len(candidates)
+    stats['words'] = stats.get('words', 0) + sum(count for (_, _, count) in candidates)
+    found = stats.setdefault('species_found', dict())
+    for (species_list, _, _) in candidates:
+        for entry in species_list:
+            name = f'{entry.genus} {entry.species}'
+            found[name] = found.get(name, 0) + 1
+
+
+def species_prefilter(text, index):
+    """
+    (str, SpeciesIndex) -> bool
+    Returns False if insertSpeciesLinks would certainly leave text unchanged:
+    none of its words is a genus (which every full name, and every genus
+    italicised on its own, begins with) or a species epithet (which every
+    short name ends with).
+
+    :param text: the text to check
+    :param index: the species index to check against
+    :returns: False if text can be skipped
+    """
 
-            for i in range(len(matches) -1, -1, -1):
-                                                           #+1 and -1 to trim off surrounding chars
-                body = body[:matches[i][0]] + ' <i>' + body[matches[i][0]+1:matches[i][1]-1] + "</i>" + body[matches[i][1]-1] + body[matches[i][1]:] 
+    (genera, epithets) = index.name_words()
+    words = {w.lower() for w in WORD.findall(text)}
+    return not (genera.isdisjoint(words) and epithets.isdisjoint(words))
 
-        # Rejoin body to end of main_body
-        main_body = main_body[:start_title_indices[j]] + body + main_body[end_abstract_indices[j]:]
 
-    # Rejoin all three parts of the article
-    return pre_title + main_body + post_abstract
+# A species link found by find_species_links. start and end are its span in
+# the searched text, and inner is the text between <taxon ...> and </taxon>.
+SpeciesLink = namedtuple('SpeciesLink', ['start', 'end', 'attributes', 'inner'])
+
+TAXON_OPEN = '<taxon '
+TAXON_CLOSE = '</taxon>'
+TAXON_ATTRIBUTE = re.compile(r'([\w-]+)="([^"]*)"')
+SP_TAG = re.compile(r'</?sp>')
+ITALICS = re.compile(r'<i>([^<]*)</i>')
+BLANKS = re.compile(r' {2,}')
+
+
+def find_species_links(text):
+    """
+    (str) -> list
+    Returns every species link (<taxon ...>...</taxon>) in text, in order, as
+    SpeciesLinks. The text is scanned once, so this is linear in the length
+    of text however many links (or malformed links) it contains.
+
+    :param text: the text to find species links in
+    :returns: list of species links in text
+    """
+
+    links = []
+    close = -1
+    start = text.find(TAXON_OPEN)
+    while start != -1:
+        open_end = text.find('>', start)
+        if open_end == -1:
+            break
+        if close < open_end:
+            close = text.find(TAXON_CLOSE, open_end)
+            if close == -1:
+                break
+
+        # An opening tag with no closing tag of its own; skip to the next one
+        next_start = text.find(TAXON_OPEN, start + 1, close)
+        if next_start != -1:
+            start = next_start
+            continue
+
+        attributes = dict(TAXON_ATTRIBUTE.findall(text, start, open_end))
+        end = close + len(TAXON_CLOSE)
+        links.append(SpeciesLink(start, end, attributes, text[open_end + 1:close]))
+        start = text.find(TAXON_OPEN, end)
+    return links
 
 
 def is_species_link(text):
@@ -176,8 +509,32 @@ def is_species_link(text):
     :returns: True if text is a species link
     """
 
-    return re.match(r'''^<taxon genus=".*" species=".*" sub-prefix=
-        ".*" sub-species=".*">.*<\/taxon>$''', text)
+    links = find_species_links(text)
+    return len(links) == 1 and links[0].start == 0 and links[0].end == len(text)
+
+
+def validate_species_link(link):
+    """
+    (SpeciesLink) -> list
+    Returns a list of problems with link: the genus, species, sub-prefix, and
+    sub-species attributes must be those get_species_link would give the text
+    inside the link.
+
+    :param link: the species link to validate
+    :returns: list of problems (empty if link is valid)
+    """
+
+    name = remove_blank_chars(SP_TAG.sub('', link.inner)).strip()
+    expected = find_species_links(get_species_link(name))
+    if len(expected) == 0:
+        return [f'"{name}" is not a species name']
+
+    problems = []
+    for (attribute, value) in expected[0].attributes.items():
+        if link.attributes.get(attribute) != value:
+            problems.append(f'{name}: expected {attribute}="{value}" but got '
+                            f'{attribute}="{link.attributes.get(attribute, "")}"')
+    return problems
 
 
 def remove_blank_chars(text):
@@ -192,10 +549,7 @@ def remove_blank_chars(text):
     :param text: text from which to remove superfluous blanks
     :returns: text with superfluous blanks removed
     """
-    text = text.replace('\n', ' ')
-    while '  ' in text:
-        text = text.replace('  ', ' ')
-    return text
+    return BLANKS.sub(' ', text.replace('\n', ' '))
 
 
 def remove_species_link(text):
@@ -204,19 +558,84 @@ def remove_species_link(text):
     Removes any species links in text and replaces them with the species name.
     The resulting text contains just the text within the <taxon></taxon> tags,
     sans <sp></sp> tags.
-    N.B.: Only used in the plugin
 
     :param text: text to remove species links from
     :returns: text with species links removed
     """
 
-    text = re.sub(r'''<taxon genus=".*" species=".*" sub-prefix=
-        ".*" sub-species=".*">''', '', text)
-    text = re.sub(r'<\/?sp>', '', text)
-    text = text.replace("</taxon>", "")
+    pieces = []
+    position = 0
+    for link in find_species_links(text):
+        pieces.append(text[position:link.start])
+        pieces.append(SP_TAG.sub('', link.inner))
+        position = link.end
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def unlink_species(text, index=None, removed=()):
+    """
+    (str, SpeciesIndex, iterable) -> str
+    Reverts what insertSpeciesLinks did to text: species links are removed,
+    and italics around dictionary species (full or short form) and genera are
+    dropped. Species that were in the dictionary text was linked with but are
+    no longer in index must be given as removed, or their italics (and their
+    genus's) are kept. Relinking the result gives the same links a fresh
+    preprocess would.
+
+    :param text: text to remove species links and italics from
+    :param index: the species index (defaults to the project's)
+    :param removed: names ('Genus species', as written in the dictionaries)
+                    removed from the dictionary since text was linked
+    :returns: text with species links and species italics removed
+    """
+
+    if index is None:
+        index = get_species_index()
+
+    removed_genera = set()
+    removed_pairs = set()
+    for name in removed:
+        (genus, species) = name.lstrip('*').lower().split(' ')[0:2]
+        removed_genera.add(genus)
+        removed_pairs.update({(genus, species), (genus[0], species)})
+
+    def unitalicise(match):
+        words = WORD.findall(match.group(1))
+        if len(words) == 1 and (index.species_of(words[0]) or words[0].lower() in removed_genera):
+            return match.group(1)
+        if len(words) == 2 and (index.lookup(words[0], words[1]) or
+                                (words[0].lower(), words[1].lower()) in removed_pairs):
+            return match.group(1)
+        return match.group(0)
+
+    # Species sharing a short form get italicised once each, so nested italics
+    # are unwrapped from the inside out
+    text = remove_species_link(text)
+    unlinked = ITALICS.sub(unitalicise, text)
+    while unlinked != text:
+        text = unlinked
+        unlinked = ITALICS.sub(unitalicise, text)
     return text
 
 
+def relink_species(text, index=None, removed=()):
+    """
+    (str, SpeciesIndex, iterable) -> str
+    Removes the species links (and species italics) from already processed
+    text and links it again, e.g. after the species dictionary has changed
+    (see unlink_species for the species removed from it).
+
+    :param text: text to relink
+    :param index: the species index (defaults to the project's)
+    :param removed: names removed from the dictionary since text was linked
+    :returns: relinked text
+    """
+
+    if index is None:
+        index = get_species_index()
+    return insertSpeciesLinks(unlink_species(text, index, removed), index)
+
 
 def get_species_link(link):
     """
@@ -0,0 +1,280 @@
+import time
+import signal
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from report import RunReport
+
+# Number of files listed in the memory section of the run report
+TOP_FILES = 5
+
+# Default time budgets (seconds) of each stage of a file, and of all the stages
+# of a file together. A stage takes milliseconds on a regular file, so only a
+# pathological input (e.g. one sending a regex into catastrophic backtracking)
+# should ever run out of its budget.
+STAGE_BUDGET = 10
+FILE_BUDGET = 30
+
+
+def budget_arg(arg: str) -> Optional[float]:
+	"""
+	Returns the time budget (seconds) given on the command line as arg, or
+	None for no limit (0).
+	"""
+	seconds = float(arg)
+	return seconds if seconds > 0 else None
+
+
+class StageTimeout(Exception):
+	"""
+	A stage that ran out of its time budget.
+	"""
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+	"""
+	Context manager raising StageTimeout in the code run inside it once it has
+	taken seconds (no limit if None). On the main thread the code is
+	interrupted with SIGALRM (the regex engine checks for signals as it
+	matches). Signals can't be used on other threads, where the code runs to
+	completion and StageTimeout is raised afterwards if it took too long.
+
+	:param seconds: the time limit
+	"""
+	if seconds is None:
+		yield
+		return
+	if seconds <= 0:
+		raise StageTimeout()
+
+	if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+		started = time.perf_counter()
+		yield
+		if time.perf_counter() - started > seconds:
+			raise StageTimeout()
+		return
+
+	def expired(signum, frame):
+		raise StageTimeout()
+
+	previous = signal.signal(signal.SIGALRM, expired)
+	signal.setitimer(signal.ITIMER_REAL, seconds)
+	try:
+		yield
+	finally:
+		signal.setitimer(signal.ITIMER_REAL, 0)
+		signal.signal(signal.SIGALRM, previous)
+
+
+class StageMonitor:
+	"""
+	Runs and measures the stages of preprocessing each file of an issue:
+	which stages changed the file, the time spent in each stage and, if
+	memory tracing is on, the peak memory allocated during each stage.
+	Stages that run out of their time budget are abandoned (leaving the file
+	as it was before the stage) and the file is flagged. Results go in the
+	run report.
+	"""
+
+	def __init__(self, report: RunReport, trace_memory: bool=False,
+				 stage_budget: Optional[float]=STAGE_BUDGET, file_budget: Optional[float]=FILE_BUDGET) -> None:
+		"""
+		:param report: the run report to record results in
+		:param trace_memory: whether to trace the memory used by each stage
+		:param stage_budget: seconds each stage may take on a file (None for
+							 no limit)
+		:param file_budget: seconds the stages of a file may take together
+							(None for no limit)
+		"""
+		self.report = report
+		self.trace_memory = trace_memory
+		self.stage_budget = stage_budget
+		self.file_budget = file_budget
+		self.stage_changes = report.section('stage_changes')
+		self.stage_skips = report.section('stage_skips')
+		self.stage_seconds = report.section('stage_seconds')
+		self.stage_timeouts = report.section('stage_timeouts')
+		self.filename = None
+		self.file_started = None
+
+		# Stages abandoned for each file, in the order they timed out
+		self.over_budget = dict()
+
+		# Peak memory (bytes) allocated in each stage, over all files, and
+		# the largest stage peak of each file along with the stage
+		self.stage_peaks = dict()
+		self.file_peaks = dict()
+
+		if trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	def begin_file(self, filename: str) -> None:
+		"""
+		Marks the start of a new file; subsequent stages are attributed to it.
+
+		:param filename: name of the file about to be preprocessed (None for
+						 stages working on every file of the issue at once)
+		"""
+		self.filename = filename
+		self.file_started = time.perf_counter() if filename is not None else None
+
+	def changed(self, stage: str) -> None:
+		"""
+		Records that stage changed the current file.
+
+		:param stage: name of the stage
+		"""
+		self.stage_changes[stage] = self.stage_changes.get(stage, 0) + 1
+
+	def skipped(self, stage: str) -> None:
+		"""
+		Records that stage was skipped for the current file by its prefilter.
+
+		:param stage: name of the stage
+		"""
+		self.stage_skips[stage] = self.stage_skips.get(stage, 0) + 1
+
+	def timed_out(self, stage: str) -> None:
+		"""
+		Records that stage ran out of its time budget on the current file.
+
+		:param stage: name of the stage
+		"""
+		self.stage_timeouts[stage] = self.stage_timeouts.get(stage, 0) + 1
+		if self.filename is not None:
+			self.over_budget.setdefault(self.filename, []).append(stage)
+			self.report.section('files_over_budget')[self.filename] = self.over_budget[self.filename]
+
+	def budget(self, files: int=1) -> Optional[float]:
+		"""
+		Returns the seconds the next stage of the current file may take: the
+		stage budget, or what is left of the file's budget if that's less.
+
+		:param files: the number of files the stage works on at once (which
+					  the stage budget is multiplied by)
+		"""
+		budgets = []
+		if self.stage_budget is not None:
+			budgets.append(self.stage_budget * files)
+		if self.file_budget is not None and self.file_started is not None:
+			budgets.append(self.file_budget - (time.perf_counter() - self.file_started))
+		return min(budgets) if len(budgets) > 0 else None
+
+	def add_seconds(self, stage: str, seconds: float) -> None:
+		"""
+		Adds seconds spent in stage that were measured elsewhere (e.g. on
+		another thread).
+		"""
+		self.stage_seconds[stage] = round(self.stage_seconds.get(stage, 0) + seconds, 6)
+
+	def _add_seconds(self, stage: str, started: float) -> None:
+		self.add_seconds(stage, time.perf_counter() - started)
+
+	def merge(self, metrics: Dict) -> None:
+		"""
+		Adds the results of another monitor (e.g. one that measured a file in
+		another process) to this monitor's.
+
+		:param metrics: the metrics of the other monitor's run report
+		"""
+		for (section, counts) in (('stage_changes', self.stage_changes), ('stage_skips', self.stage_skips),
+								  ('stage_timeouts', self.stage_timeouts)):
+			for (stage, count) in metrics.get(section, dict()).items():
+				counts[stage] = counts.get(stage, 0) + count
+		for (stage, seconds) in metrics.get('stage_seconds', dict()).items():
+			self.add_seconds(stage, seconds)
+		for (filename, stages) in metrics.get('files_over_budget', dict()).items():
+			self.over_budget.setdefault(filename, []).extend(stages)
+			self.report.section('files_over_budget')[filename] = self.over_budget[filename]
+
+	@contextmanager
+	def measure(self, stage: str):
+		"""
+		Context manager measuring the code run inside it as stage.
+
+		:param stage: name of the stage
+		"""
+		started = time.perf_counter()
+		if not self.trace_memory:
+			yield
+			self._add_seconds(stage, started)
+			return
+
+		tracemalloc.reset_peak()
+		(start, _) = tracemalloc.get_traced_memory()
+		yield
+		peak = tracemalloc.get_traced_memory()[1] - start
+		self._add_seconds(stage, started)
+
+		self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak)
+		if self.filename is not None and peak > self.file_peaks.get(self.filename, (0, None))[0]:
+			self.file_peaks[self.filename] = (peak, stage)
+
+	def attempt(self, stage: str, func: Callable, *args):
+		"""
+		Runs the stage func(*args) within its time budget, measuring it.
+
+		:param stage: name of the stage
+		:param func: the function performing the stage
+		:returns: what func returned, or None if it ran out of its budget (in
+				  which case anything it changed in place must be undone)
+		"""
+		with self.measure(stage):
+			try:
+				with time_limit(self.budget()):
+					return func(*args)
+			except StageTimeout:
+				self.timed_out(stage)
+				return None
+
+	def run(self, stage: str, func: Callable[..., str], text: str, *args,
+			prefilter: Optional[Callable[[str], bool]]=None) -> str:
+		"""
+		Runs the stage func(text, *args), measuring it and noting whether it
+		changed text. If prefilter(text) is False, the stage is skipped. If
+		the stage runs out of its time budget, text is returned unchanged.
+
+		:param stage: name of the stage
+		:param func: the function performing the stage
+		:param text: the text to process
+		:param prefilter: cheap check of whether the stage could change text
+		:returns: the processed text
+		"""
+		if prefilter is not None and not prefilter(text):
+			self.skipped(stage)
+			return text
+		result = self.attempt(stage, func, text, *args)
+		if result is None:
+			return text
+		if result != text:
+			self.changed(stage)
+		return result
+
+	def top_files(self) -> List[Tuple[str, int, str]]:
+		"""
+		Returns the files with the largest peak memory, largest first.
+
+		:returns: list of (filename, peak bytes, stage) tuples
+		"""
+		files = sorted(self.file_peaks.items(), key=lambda f: f[1][0], reverse=True)
+		return [(filename, peak, stage) for (filename, (peak, stage)) in files[:TOP_FILES]]
+
+	def finish(self) -> None:
+		"""
+		Adds the memory measurements (if any) to the run report.
+		"""
+		if not self.trace_memory:
+			return
+
+		memory = self.report.section('memory')
+		memory['stage_peak_bytes'] = dict(self.stage_peaks)
+		memory['top_files'] = [{'file': f, 'peak_bytes': p, 'stage': s} for (f, p, s) in self.top_files()]
+		memory['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+		try:
+			import resource
+			memory['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		except ImportError:
+			# No resource module on Windows
+			pass
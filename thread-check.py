@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import getopt
+import sysconfig
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from colours import colours
+from issue_context import preprocess_issue
+
+USAGE = 'USAGE: python thread-check.py -f <FILE> [-t <THREADS>]'
+
+
+def quiet(message: str) -> None:
+	pass
+
+
+def copy_issues(paths: list, folder: str) -> list:
+	"""
+	Copies the issue folder (jjvv(n)/) of each xml folder in paths into folder.
+
+	:param paths: paths to issues' xml folders
+	:param folder: the folder to copy the issues into
+	:returns: the paths of the copies' xml folders
+	"""
+	copies = []
+	for path in paths:
+		issue = os.path.dirname(os.path.dirname(path))
+		copy = os.path.join(folder, os.path.basename(issue))
+		shutil.copytree(issue, copy)
+		copies.append(copy.replace('\\', '/') + '/xml/')
+	return copies
+
+
+def read_tree(folder: str) -> dict:
+	"""
+	Returns the contents of every file under folder, by relative path.
+	"""
+	tree = dict()
+	for (root, _, filenames) in os.walk(folder):
+		for filename in filenames:
+			path = os.path.join(root, filename)
+			with open(path, 'rb') as f:
+				tree[os.path.relpath(path, folder)] = f.read()
+	return tree
+
+
+def gil_enabled() -> bool:
+	# Only free-threaded builds (3.13t and later) can run without the GIL
+	is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+	return True if is_gil_enabled is None else is_gil_enabled()
+
+
+# Preprocess copies of the listed issues twice, once one issue after another
+# and once on threads, and check that both give the same files. Run it under
+# a free-threaded build of CPython (python3.13t) to measure the speedup of
+# preprocessing issues in parallel without the GIL.
+if __name__ == '__main__':
+	path = None
+	threads = 4
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'f:t:', ['file=', 'threads='])
+	except getopt.GetoptError:
+		print(USAGE)
+		exit(3)
+
+	for opt, arg in opts:
+		if opt in ('-f', '--file'):
+			path = arg
+		if opt in ('-t', '--threads'):
+			threads = int(arg)
+
+	if path is None:
+		print(USAGE)
+		exit(3)
+	with open(path) as f:
+		paths = [line.strip().replace('\\', '/').rstrip('/') + '/' for line in f.readlines() if line.strip() != '']
+
+	free_threaded = bool(sysconfig.get_config_var('Py_GIL_DISABLED'))
+	print(f'Python {sys.version.split()[0]}, '
+		  f'{"free-threaded build" if free_threaded else "GIL build"}, GIL {"enabled" if gil_enabled() else "disabled"}')
+
+	with tempfile.TemporaryDirectory() as folder:
+		os.mkdir(os.path.join(folder, 'sequential'))
+		os.mkdir(os.path.join(folder, 'threaded'))
+		sequential = copy_issues(paths, os.path.join(folder, 'sequential'))
+		threaded = copy_issues(paths, os.path.join(folder, 'threaded'))
+
+		start = time.perf_counter()
+		sequential_codes = [preprocess_issue(p, out=quiet) for p in sequential]
+		sequential_seconds = time.perf_counter() - start
+
+		start = time.perf_counter()
+		with ThreadPoolExecutor(threads) as pool:
+			threaded_codes = list(pool.map(lambda p: preprocess_issue(p, out=quiet), threaded))
+		threaded_seconds = time.perf_counter() - start
+
+		before = read_tree(os.path.join(folder, 'sequential'))
+		after = read_tree(os.path.join(folder, 'threaded'))
+
+	differences = sorted(p for p in set(before) | set(after) if before.get(p) != after.get(p))
+	print(f'{len(paths)} issue(s): {sequential_seconds:.2f} s one after another, '
+		  f'{threaded_seconds:.2f} s on {threads} thread(s) ({sequential_seconds / threaded_seconds:.2f}x)')
+	if sequential_codes != threaded_codes:
+		print(f'{colours.RED}Exit codes differ: {sequential_codes} (sequential), {threaded_codes} (threaded){colours.ENDC}')
+	for difference in differences:
+		print(f'{colours.RED}Differs: {difference}{colours.ENDC}')
+	if len(differences) > 0 or sequential_codes != threaded_codes:
+		exit(1)
+	print(f'{colours.GREEN}Threaded output identical to sequential output ({len(before)} files){colours.ENDC}')
@@ -0,0 +1,296 @@
+import os
+import re
+import time
+import threading
+from typing import List, Dict, Optional
+from language_packs import LanguagePack, BUILTIN_PACKS
+from rule_packs import RulePack, load_rule_pack
+from regions import ABSTRACT, REGIONS, find_regions, replace_regions
+from rule_profile import RuleProfile
+
+# Words that predominantly require the processor to manually format them,
+# along with their most commonly formatted variant. Applied in order.
+TXT_SUBSTITUTIONS = [
+	('H2O2', 'H<sub>2</sub>O<sub>2</sub>'),
+	('H2O', 'H<sub>2</sub>O'),
+	('H20', 'H<sub>2</sub>0'),
+	('H2SO4', 'H<sub>2</sub>SO<sub>4</sub>'),
+	('&lt;!--', '<!--'),
+	('--&gt;', '-->'),
+	('\\\'', '\''),
+]
+
+# Patterns to format, applied in order after TXT_SUBSTITUTIONS. Each has a
+# guard: literals at least one of which any match must contain, so the
+# pattern is only searched for in text containing one of them.
+REG_SUBSTITUTIONS = [
+	# simple tags
+	(re.compile(r'&lt;(|/)(i|b|sup|sub)&gt;'), r'<\1\2>', ('&lt;',)),
+	# inverse units
+	(re.compile(r'(m|g|ha| L|ml)-1'), r'\1<sup>-1</sup>', ('-1',)),
+	# scientific notation
+	(re.compile(r'(\d?\.?\d+ ?\n?(x|&#215;)\n? ?10)(-?\d+)'), r'\1<sup>\3</sup>', ('10',)),
+	# extra whitespace in hyphenations
+	(re.compile(r'-\n ?'), r'-', ('-\n',)),
+	# 50-doses
+	(re.compile(r'(LC|LD|IC)50'), r'\1<sub>50</sub>', ('50',)),
+	# Bi-elemental oxygen compounds
+	(re.compile(r'([A-Z]|\d)O(\d)(\d?(\+|-|))'), r'\1O<sub>\2</sub><sup>\3</sup>', tuple(f'O{d}' for d in range(10))),
+	# metre-based units
+	(re.compile(r'/(cm|km|m)(\d)'), r'/\1<sup>\2</sup>', ('/cm', '/km', '/m')),
+	# Ammonia-based compounds
+	(re.compile(r'NH(\d)(\+?)'), r'NH<sub>\1</sub><sup>\2</sup>', ('NH',)),
+]
+
+# Empty tags (a few may be added by the substitutions above)
+EMPTY_TAG = re.compile(r'<(i|b|sup|sub)><\/\1>')
+EMPTY_TAG_GUARD = ('></',)
+
+# N.B.: the substitutions have always been made with
+# re.sub(pattern, repl, text, re.IGNORECASE), which passes IGNORECASE as the
+# count (2) rather than as a flag. So the patterns are case-sensitive and each
+# is replaced at most twice per file. Kept as is so output doesn't change.
+SUB_COUNT = re.IGNORECASE
+
+# The regions (see regions.py) the built-in substitutions apply to, and those
+# section headers are formatted in. Nothing outside them (the <article> tag,
+# authors, <index>, <copyright>) is ever changed.
+TEXT_SUB_REGIONS = REGIONS
+HEADER_REGIONS = (ABSTRACT,)
+
+
+def contains_any(text: str, literals) -> bool:
+	"""
+	Returns True if text contains any of literals.
+	"""
+	for literal in literals:
+		if literal in text:
+			return True
+	return False
+
+
+class TextRules:
+	"""
+	The text substitutions of a journal compiled into one matcher: the
+	built-in rules, then those of its rule packs in the order listed, then
+	the removal of empty tags. Built by compile_text_rules, which shares one
+	matcher between every journal using the same rule packs, so rules added
+	for one journal cost the others nothing.
+
+	Each rule only applies to the text of its regions (title, abstract
+	and/or keyword): the built-in rules to all three, those of rule packs to
+	the regions they list.
+	"""
+
+	def __init__(self, packs: List[RulePack]) -> None:
+		# (name, old, new, pattern, guard, count, regions): pattern is None for
+		# literal substitutions
+		self.rules = [(old, old, new, None, None, 0, TEXT_SUB_REGIONS) for (old, new) in TXT_SUBSTITUTIONS]
+		self.rules += [(pattern.pattern, None, repl, pattern, guard, SUB_COUNT, TEXT_SUB_REGIONS)
+					   for (pattern, repl, guard) in REG_SUBSTITUTIONS]
+
+		# Rules from packs replace every match (they have no legacy count)
+		for pack in packs:
+			for (kind, old, new, guard, regions) in pack.rules:
+				name = f'{os.path.basename(pack.name)}: {old}'
+				if kind == 'LITERAL':
+					self.rules.append((name, old, new, None, None, 0, regions))
+				else:
+					self.rules.append((name, None, new, re.compile(old), guard, 0, regions))
+		self.rules.append((EMPTY_TAG.pattern, None, '', EMPTY_TAG, EMPTY_TAG_GUARD, SUB_COUNT, TEXT_SUB_REGIONS))
+
+		# Literals at least one of which text must contain for any rule to
+		# change it (None if a regex has no guard, so any text may change)
+		literals = []
+		for (_, old, _, pattern, guard, _, _) in self.rules:
+			if pattern is None:
+				literals.append(old)
+			elif guard is None:
+				literals = None
+				break
+			else:
+				literals += guard
+		self.literals = tuple(dict.fromkeys(literals)) if literals is not None else None
+
+		self.packs = [pack.name for pack in packs]
+		self.compile_seconds = 0.0
+
+	def apply(self, text: str, profile: Optional[RuleProfile]=None) -> str:
+		"""
+		Applies every rule to the text of its regions in text.
+
+		:param text: text in which to replace unformatted words
+		:param profile: if given, each rule is measured in this profile
+		:returns: text with proper xml format tags applied
+		"""
+		regions = find_regions(text)
+		# The text of each region, replaced as the rules are applied
+		pieces = [text[start:end] for (start, end, _, _) in regions]
+
+		for (name, old, new, pattern, guard, count, rule_regions) in self.rules:
+			targets = [i for (i, region) in enumerate(regions) if region[2] in rule_regions]
+			if pattern is None:
+				for i in targets:
+					if profile is None:
+						pieces[i] = pieces[i].replace(old, new)
+					else:
+						pieces[i] = profile.literal('literal', name, pieces[i], old, new)
+				continue
+
+			# A limited count is shared by the regions, in order, so a rule
+			# still makes at most count replacements per file
+			remaining = count
+			searched = False
+			for i in targets:
+				if guard is not None and not contains_any(pieces[i], guard):
+					continue
+				searched = True
+				if profile is None:
+					(pieces[i], replaced) = pattern.subn(new, pieces[i], remaining)
+				else:
+					replaced = min(len(pattern.findall(pieces[i])), remaining) if count > 0 else 0
+					pieces[i] = profile.regex('regex', name, pieces[i], pattern, new, remaining)
+				if count > 0:
+					remaining -= replaced
+					if remaining == 0:
+						break
+			if not searched and profile is not None:
+				profile.skipped('regex', name)
+
+		return replace_regions(text, regions, pieces)
+
+	def prefilter(self, text: str) -> bool:
+		"""
+		Returns False if apply would certainly leave text unchanged: text
+		contains none of the literal substitutions or regex guards.
+		"""
+		return self.literals is None or contains_any(text, self.literals)
+
+	def summary(self) -> Dict:
+		# For run reports
+		return {'packs': self.packs, 'rules': len(self.rules), 'compile_seconds': round(self.compile_seconds, 6)}
+
+
+# Compiled rules, by the rule packs (and their modification times) they were
+# compiled from
+_compiled_rules = dict()
+_compile_lock = threading.Lock()
+
+
+def compile_text_rules(paths: List[str]) -> TextRules:
+	"""
+	Returns the text rules of the built-in rules plus the rule packs at paths,
+	compiling them (and timing the compilation) the first time they are used.
+
+	:param paths: paths to rule pack files, in the order they apply
+	:raises OSError, RulePackError: if a rule pack can't be loaded
+	:returns: the compiled rules
+	"""
+	key = tuple((os.path.abspath(path), os.stat(path).st_mtime_ns) for path in paths)
+	with _compile_lock:
+		if key not in _compiled_rules:
+			start = time.perf_counter()
+			rules = TextRules([load_rule_pack(path) for path in paths])
+			rules.compile_seconds = time.perf_counter() - start
+			_compiled_rules[key] = rules
+		return _compiled_rules[key]
+
+
+# The rules of journals without rule packs
+BUILTIN_RULES = TextRules([])
+
+
+def text_subs_prefilter(text: str) -> bool:
+	"""
+	Returns False if common_text_subs would certainly leave text unchanged:
+	text contains none of the literal substitutions or regex guards.
+
+	:param text: the text common_text_subs would be applied to
+	:returns: False if the stage can be skipped
+	"""
+	return BUILTIN_RULES.prefilter(text)
+
+
+def header_guard(packs: Optional[Dict[str, LanguagePack]]=None) -> List[str]:
+	"""
+	Returns literals at least one of which text must contain for
+	surround_headers to change it: every header and substitution of packs,
+	less those containing another (if 'Aims' occurs, so does 'Aim').
+
+	:param packs: dict of lang codes to language packs (defaults to the
+				  built-in packs)
+	:returns: list of literals
+	"""
+	if packs is None:
+		packs = BUILTIN_PACKS
+
+	literals = set()
+	for pack in packs.values():
+		literals.update(pack.headers())
+		literals.update(pack.substitutions.keys())
+	return sorted(l for l in literals if not any(o != l and o in l for o in literals))
+
+
+def common_text_subs(text: str, profile: Optional[RuleProfile]=None) -> str:
+	"""
+	Formats words that predominantly require the processor to manually format
+	them with their most commonly formatted variant.
+
+	:param text: text in which to replace unformatted words
+	:param profile: if given, each rule is measured in this profile
+	:returns: text with proper xml format tags applied
+	"""
+	return BUILTIN_RULES.apply(text, profile)
+
+
+def surround_headers(text: str, front: str, special_front: str, back: str,
+					 packs: Optional[Dict[str, LanguagePack]]=None,
+					 profile: Optional[RuleProfile]=None) -> str:
+	"""
+	For a header in the language packs, it is replaced by the sequence
+	(special_front+header+back, thereby automatically applying bold, italics,
+	or linebreaks to the different sections within an abstract.
+
+	Only the text of <abstract> blocks is changed. Each only has the headers
+	of its own language (lang attribute) applied to it; abstracts without a
+	lang, or in a language without a pack, have every pack applied.
+
+	special_front is only applied for introduction headers that don't require
+	a preceeding linebreak.
+
+	:param text: the text containing headers to format
+	:param front: the opening format tag
+	:param special_front: the opening format tag (for intro headers only)
+	:param back: the closing format tag
+	:param packs: dict of lang codes to language packs (defaults to the
+				  built-in packs)
+	:param profile: if given, each header is measured in this profile
+	:returns: text with format tags applied to the headers in it
+	"""
+	if packs is None:
+		packs = BUILTIN_PACKS
+
+	def apply_packs(text: str, packs: List[LanguagePack]) -> str:
+		for pack in packs:
+			intro_headers = [h.lower() for h in pack.intro_headers]
+			for header in pack.headers():
+				# If not an intro header
+				if header.lower() not in intro_headers:
+					replacement = "\n" + front + header + back
+				else:
+					replacement = "\n" + special_front + header + back
+				if profile is None:
+					text = text.replace(header, replacement)
+				else:
+					text = profile.literal('header', f'{pack.lang}: {header}', text, header, replacement)
+
+			for key in pack.substitutions.keys():
+				if profile is None:
+					text = text.replace(key, pack.substitutions[key])
+				else:
+					text = profile.literal('header-sub', f'{pack.lang}: {key}', text, key, pack.substitutions[key])
+		return text
+
+	regions = [r for r in find_regions(text) if r[2] in HEADER_REGIONS]
+	return replace_regions(text, regions, [apply_packs(text[start:end], [packs[lang]] if lang in packs else packs.values())
+										   for (start, end, _, lang) in regions])
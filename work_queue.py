@@ -0,0 +1,210 @@
+import os
+import time
+import socket
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+# Statuses of an issue in the queue
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Seconds a claimed issue is held for without a heartbeat before another
+# worker may reclaim it
+LEASE_SECONDS = 60
+
+# Issues whose lease has expired this many times (i.e. whose worker died or
+# hung each time) are marked FAILED instead of being handed out again
+MAX_ATTEMPTS = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS issues (
+	path TEXT PRIMARY KEY,
+	issue TEXT NOT NULL,
+	position INTEGER NOT NULL,
+	status TEXT NOT NULL DEFAULT 'pending',
+	worker TEXT,
+	lease_expires REAL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	code INTEGER
+)
+'''
+
+
+def issue_name(path: str) -> str:
+	"""
+	Returns the name of the issue folder (jjVV(N)) of the xml folder at path.
+
+	:param path: path to an issue's xml folder
+	:returns: the issue folder's name
+	"""
+	return os.path.basename(os.path.dirname(path.replace('\\', '/').rstrip('/')))
+
+
+def worker_id() -> str:
+	"""
+	Returns an identifier for this process that is unique across machines.
+	"""
+	return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+	"""
+	Queue of issues to preprocess, shared by any number of worker processes
+	(on one machine, or on several machines through a shared folder) via a
+	SQLite database.
+
+	A worker claims an issue by taking a lease on it, renews the lease with
+	heartbeats while it works, and completes or releases it when done. A
+	lease that isn't renewed in time expires and the issue is handed to the
+	next worker to ask. Claims are made inside an exclusive transaction, and
+	an issue folder (jjVV(N)) is never leased to two workers at once, even
+	if it was queued under two different paths.
+
+	Leases are timed by each worker's own clock, so the clocks of machines
+	sharing a queue must be kept in sync (e.g. by NTP), and the database
+	must be on a file system with working file locks.
+	"""
+
+	def __init__(self, path: str) -> None:
+		"""
+		:param path: path to the queue's database (created if missing)
+		"""
+		self.path = path
+		self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+		self._db.execute(SCHEMA)
+
+	def close(self) -> None:
+		self._db.close()
+
+	def _transaction(self):
+		# BEGIN IMMEDIATE takes the database's write lock up front, so no two
+		# workers can read the same pending issue and both claim it
+		self._db.execute('BEGIN IMMEDIATE')
+		return self._db
+
+	def add(self, paths: List[str]) -> int:
+		"""
+		Adds the issues at paths to the end of the queue. Paths already in the
+		queue are left as they are.
+
+		:param paths: paths to the issues' xml folders
+		:returns: the number of issues added
+		"""
+		db = self._transaction()
+		try:
+			position = db.execute('SELECT COALESCE(MAX(position), -1) FROM issues').fetchone()[0]
+			added = 0
+			for path in paths:
+				path = path.strip().replace('\\', '/')
+				if path == '':
+					continue
+				position += 1
+				added += db.execute('INSERT OR IGNORE INTO issues (path, issue, position) VALUES (?, ?, ?)',
+									(path, issue_name(path), position)).rowcount
+			db.execute('COMMIT')
+		except:
+			db.execute('ROLLBACK')
+			raise
+		return added
+
+	def _reclaim_expired(self, db: sqlite3.Connection, now: float) -> None:
+		db.execute('UPDATE issues SET status = ?, worker = NULL, lease_expires = NULL '
+				   'WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+				   (FAILED, LEASED, now, MAX_ATTEMPTS))
+		db.execute('UPDATE issues SET status = ?, worker = NULL, lease_expires = NULL '
+				   'WHERE status = ? AND lease_expires < ?',
+				   (PENDING, LEASED, now))
+
+	def claim(self, worker: str, lease_seconds: float=LEASE_SECONDS) -> Optional[str]:
+		"""
+		Leases the next pending issue to worker, first returning any issues
+		whose leases have expired to the queue.
+
+		:param worker: the claiming worker's id
+		:param lease_seconds: how long the lease lasts without a heartbeat
+		:returns: path to the claimed issue's xml folder, or None if there is
+		          nothing left to claim
+		"""
+		now = time.time()
+		db = self._transaction()
+		try:
+			self._reclaim_expired(db, now)
+			row = db.execute('SELECT path FROM issues WHERE status = ? AND issue NOT IN '
+							 '(SELECT issue FROM issues WHERE status = ?) ORDER BY position LIMIT 1',
+							 (PENDING, LEASED)).fetchone()
+			if row is not None:
+				db.execute('UPDATE issues SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 '
+						   'WHERE path = ?', (LEASED, worker, now + lease_seconds, row[0]))
+			db.execute('COMMIT')
+		except:
+			db.execute('ROLLBACK')
+			raise
+		return None if row is None else row[0]
+
+	def heartbeat(self, path: str, worker: str, lease_seconds: float=LEASE_SECONDS) -> bool:
+		"""
+		Renews worker's lease on the issue at path.
+
+		:param path: path to the issue's xml folder
+		:param worker: the id of the worker holding the lease
+		:param lease_seconds: how long the renewed lease lasts
+		:returns: False if worker no longer holds the lease (it expired and
+		          the issue may already be in another worker's hands)
+		"""
+		now = time.time()
+		return self._db.execute('UPDATE issues SET lease_expires = ? '
+								'WHERE path = ? AND worker = ? AND status = ? AND lease_expires >= ?',
+								(now + lease_seconds, path, worker, LEASED, now)).rowcount == 1
+
+	def complete(self, path: str, worker: str, code: int) -> bool:
+		"""
+		Marks worker's issue at path DONE (if code is 0) or FAILED.
+
+		:param path: path to the issue's xml folder
+		:param worker: the id of the worker holding the lease
+		:param code: exit code of the preprocessing run
+		:returns: False if worker no longer held the lease
+		"""
+		return self._db.execute('UPDATE issues SET status = ?, code = ?, worker = NULL, lease_expires = NULL '
+								'WHERE path = ? AND worker = ? AND status = ?',
+								(DONE if code == 0 else FAILED, code, path, worker, LEASED)).rowcount == 1
+
+	def release(self, path: str, worker: str) -> bool:
+		"""
+		Returns worker's issue at path to the queue unfinished (e.g. when the
+		worker is stopped), without counting it as a failed attempt.
+
+		:param path: path to the issue's xml folder
+		:param worker: the id of the worker holding the lease
+		:returns: False if worker no longer held the lease
+		"""
+		return self._db.execute('UPDATE issues SET status = ?, worker = NULL, lease_expires = NULL, '
+								'attempts = attempts - 1 WHERE path = ? AND worker = ? AND status = ?',
+								(PENDING, path, worker, LEASED)).rowcount == 1
+
+	def retry_failed(self) -> int:
+		"""
+		Returns every FAILED issue to the queue.
+
+		:returns: the number of issues requeued
+		"""
+		return self._db.execute('UPDATE issues SET status = ?, attempts = 0, code = NULL WHERE status = ?',
+								(PENDING, FAILED)).rowcount
+
+	def counts(self) -> Dict[str, int]:
+		"""
+		Returns the number of issues with each status.
+		"""
+		counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+		for (status, count) in self._db.execute('SELECT status, COUNT(*) FROM issues GROUP BY status'):
+			counts[status] = count
+		return counts
+
+	def issues(self) -> List[Tuple]:
+		"""
+		Returns (path, status, worker, attempts, code) for every issue, in
+		queue order.
+		"""
+		return self._db.execute('SELECT path, status, worker, attempts, code FROM issues ORDER BY position').fetchall()
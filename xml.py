@@ -1,5 +1,16 @@
 import re
 
+# A tag's attributes: ' name="value"' any number of times. Values can't contain
+# quotes, so there is only one way to match a line and matching takes time
+# linear in its length (unlike ( \w+=".*")?, which tries every quote in the
+# line as the end of the attributes)
+NAME_VALUE = r'[\w-]+="[^"]*"'
+ATTRIBUTES = r'(?: ' + NAME_VALUE + r')*'
+ATTRIBUTE = re.compile(r'(?<!\w)\w+(?:-\w+)?=\"[\w\d\s\.\-_]*\"')
+TAG = re.compile(r'^\s*<(\w+)' + ATTRIBUTES + r'>')
+ELEMENT = re.compile(r'^<(\w+)' + ATTRIBUTES + r'>(.*)</\1>$')
+ATTRIBUTES_ONLY = re.compile(r'^\s*<([\w-]+) (' + NAME_VALUE + ATTRIBUTES + r')?>.*</\1>$')
+
 class XMLError(Exception):
 	pass
 
@@ -12,11 +23,11 @@ class xml:
 			return None
 
 		# Ignore the inner XML and closing tag
-		text = re.sub(r'^\s*<([\w-]+) (\w+=\".*\")?>.*</\1>$', r'\2', text)
+		text = ATTRIBUTES_ONLY.sub(r'\2', text)
 
 		# Parse out each match and add them to a dict
 		matches = dict()
-		for match in re.findall(r'[\w]+-?[\w]+=\"[\w\d\s\.\-_]*\"', text):
+		for match in ATTRIBUTE.findall(text):
 			tokens = match.split('=')
 			key = tokens[0]
 			value = ''.join(tokens[-1:]).strip('\'\"')
@@ -81,7 +92,7 @@ class xml:
 		if not xml.is_valid(text):
 			return None
 
-		match = re.search(r'^\s*<(\w+)( \w+=\".*\")?>', text)
+		match = TAG.search(text)
 		return None if match == None else match.group(1)
 
 	@staticmethod
@@ -90,7 +101,7 @@ class xml:
 			return None
 
 		# <abstract> is the only Bioline xml tag that exceeds one line
-		return re.search(r'^<(\w+)( \w+=\".*\")?>(.*)</\1>$', text).group(3)
+		return ELEMENT.search(text).group(2)
 
 
 	@staticmethod
@@ -102,7 +113,7 @@ class xml:
 		if not xml.is_valid(text):
 			return None
 
-		return re.sub(r'^(\s*)<(\w+)( \w+=\".*\")?>(.*)</\1>$', r'\1<\2\3>' + inner + r'</\2>', text)
+		return re.sub(r'^(\s*)<(\w+)(' + ATTRIBUTES + r')>(.*)</\1>$', r'\1<\2\3>' + inner + r'</\2>', text)
 
 
 	@staticmethod